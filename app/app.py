@@ -9,12 +9,16 @@ import json
 import time
 import streamlit as st
 
-from rag.retriever import retrieve_top_k
-from rag.citations import build_context_with_citations, citations_to_ui_lines
+from rag.retriever import retrieve_top_k, retrieval_cache_stats
+from rag.manifest import IndexManifest, manifest_path
+from rag.vector_store import VECTOR_BACKEND
+from rag.citations import citations_to_ui_lines, score_label
+from rag.tracing import trace
 
 from app.prompts import SYSTEM_BASE, explain_prompt, extract_prompt, qa_prompt
-from app.generate import generate_text
-from app.context import ChatTurn, trim_history, history_to_messages
+from app.generate import generate_text_stream
+from app.pipeline import RetrievalSettings, aretrieve_many, explain_plan, extract_async, get_runner, traced
+from app.context import ChatTurn, trim_history, history_to_messages, pack_prompt
 from app.guards import (
     validate_report_input,
     validate_question_input,
@@ -34,13 +38,62 @@ IMPRESSION: Mild right lower lobe opacity may represent atelectasis versus early
 """
 
 
+class StreamTimer:
+    """
+    Wraps a token stream and records time-to-first-token and total time from t0.
+    """
+
+    def __init__(self, stream, t0: float):
+        self.stream = stream
+        self.t0 = t0
+        self.ttft = None
+        self.total = None
+
+    def __iter__(self):
+        for piece in self.stream:
+            if self.ttft is None:
+                self.ttft = time.time() - self.t0
+            yield piece
+        self.total = time.time() - self.t0
+        if self.ttft is None:
+            self.ttft = self.total
+
+    def summary(self) -> str:
+        return f"First token in {self.ttft or 0:.2f}s | total {self.total or 0:.2f}s"
+
+
+def render_stream(stream, finalize=None) -> str:
+    """
+    Render tokens as they arrive, then replace with the finalized text (if any).
+    """
+    placeholder = st.empty()
+    with placeholder.container():
+        text = st.write_stream(stream)
+    text = text if isinstance(text, str) else "".join(str(t) for t in text)
+    if finalize is not None:
+        final = finalize(text)
+        if final != text:
+            placeholder.write(final)
+        return final
+    return text
+
+
+def stage_stats(tr) -> str:
+    """Per-stage timings and prompt size for the Run stats caption."""
+    line = tr.breakdown()
+    prompt_tokens = tr.attr("generation", "prompt_tokens")
+    if prompt_tokens is not None:
+        line += f" | prompt {prompt_tokens} tokens"
+    return line
+
+
 def show_citations(citation_lines, citations):
     with st.expander("Show citations / sources"):
         for line in citation_lines:
             st.write(line)
         st.markdown("---")
         for c in citations:
-            st.markdown(f"**[{c.cid}] {c.source} - page {c.page}** (score: {c.score:.3f})")
+            st.markdown(f"**[{c.cid}] {c.source} - page {c.page}** ({score_label(c)})")
             st.caption(c.snippet)
 
 
@@ -51,6 +104,9 @@ def ensure_session_state():
         st.session_state.report_text = ""
     if "pending_question" not in st.session_state:
         st.session_state.pending_question = None
+    if "extract_prefetch" not in st.session_state:
+        # (report_text, Future) started from the Explain tab
+        st.session_state.extract_prefetch = None
 
 
 def main():
@@ -115,8 +171,24 @@ def main():
                 "Higher min score = stricter evidence quality."
             )
             top_k = st.slider("Top-K retrieved chunks", 6, 20, 12, 1)
-            min_score = st.slider("Min similarity score", 0.30, 0.80, 0.50, 0.01)
+            min_score = st.slider(
+                "Min similarity score", 0.30, 0.80, 0.50, 0.01,
+                help="Cosine similarity between the question and a chunk's embedding. Hybrid retrieval also "
+                     "keeps keyword (BM25) matches that contain most of the query terms; those are shown as "
+                     "\"keyword match\" instead of a similarity.",
+            )
             final_top_k = st.slider("Final chunks used in prompt", 2, 10, 6, 1)
+            sources = st.multiselect(
+                "Only use evidence from these references (empty = all)",
+                sorted(IndexManifest.load(manifest_path(VECTOR_BACKEND)).files),
+            )
+            metadata_filter = {"source": {"$in": sources}} if sources else None
+
+            cache = retrieval_cache_stats()
+            st.caption(
+                f"Retrieval cache: {cache['hits']} hits / {cache['misses']} misses "
+                f"(hit rate {cache['hit_rate']:.0%}, {cache['entries']} entries)"
+            )
 
     # RIGHT: tabs
     with col_right:
@@ -126,40 +198,64 @@ def main():
         with tabs[0]:
             st.subheader("Explain the report")
             level = st.selectbox("Explanation level", ["simple", "normal", "clinician"], index=1)
+            prefetch_extract = st.checkbox("Also prepare Extract in the background", value=True)
 
             if st.button("Generate Explanation"):
                 ok, err = validate_report_input(st.session_state.report_text)
                 if not ok:
                     st.error(err)
                 else:
-                    with st.spinner("Retrieving evidence and generating explanation..."):
-                        t0 = time.time()
-                        retrieved = retrieve_top_k(
-                            query=f"Explain terms and phrases in this report: {st.session_state.report_text[:300]}",
-                            top_k=top_k,
-                            min_score=min_score,
-                            final_top_k=final_top_k,
+                    runner = get_runner()
+                    report_text = st.session_state.report_text
+                    if prefetch_extract:
+                        # Extract needs no retrieval: run it alongside Explain.
+                        # Resubmitting cancels the previous in-flight run.
+                        st.session_state.extract_prefetch = (
+                            report_text,
+                            runner.submit("extract", traced("extract", extract_async(report_text))),
                         )
 
-                        top_score = max([r.get("score", 0) for r in retrieved], default=0)
-                        chunks_used = len(retrieved)
-
-                        context_block, citations = build_context_with_citations(retrieved)
-                        user_prompt = explain_prompt(level, st.session_state.report_text, context_block)
-                        answer = generate_text(SYSTEM_BASE, user_prompt)
-                        answer = enforce_disclaimer(answer)
-                        t1 = time.time()
-
-                    lat = t1 - t0
-                    st.success(f"Done in {lat:.2f}s")
-                    st.caption(f"Run stats: **{chunks_used} chunks used** | **top score {top_score:.3f}**")
-
-                    with st.container(border=True):
-                        st.markdown("### Explanation in Plain English")
-                        st.write(answer)
-
-                    citation_lines = citations_to_ui_lines(citations)
-                    show_citations(citation_lines, citations)
+                    with trace("explain", level=level) as tr:
+                        with st.spinner("Retrieving evidence..."):
+                            t0 = time.time()
+                            # Key findings/terms from the whole report, retrieved as one batch
+                            plan = explain_plan(report_text)
+                            retrieved = runner.run(
+                                "explain-retrieval",
+                                aretrieve_many(
+                                    plan.queries,
+                                    RetrievalSettings(top_k=top_k, min_score=min_score, final_top_k=final_top_k,
+                                                      metadata_filter=metadata_filter),
+                                ),
+                            )
+
+                            top_score = max([r.get("score", 0) for r in retrieved], default=0)
+
+                            user_prompt, context_block, citations, _ = pack_prompt(
+                                lambda ctx: explain_prompt(level, report_text, ctx), retrieved
+                            )
+                            chunks_used = len(citations)
+                            # Packing may drop the weakest chunks to fit the budget; check what is sent
+                            ok_ev, err_ev = validate_retrieval_results(citations, min_results=2)
+
+                        if ok_ev:
+                            with st.container(border=True):
+                                st.markdown("### Explanation in Plain English")
+                                timer = StreamTimer(generate_text_stream(SYSTEM_BASE, user_prompt), t0)
+                                answer = render_stream(timer, finalize=enforce_disclaimer)
+
+                    if ok_ev:
+                        st.success(timer.summary())
+                    else:
+                        st.warning(enforce_disclaimer(err_ev))
+                    st.caption(f"Run stats: **{chunks_used} chunks used** | **top similarity {top_score:.3f}**")
+                    if plan.terms:
+                        st.caption("Evidence retrieved for: " + ", ".join(plan.terms))
+                    st.caption(stage_stats(tr))
+
+                    if ok_ev:
+                        citation_lines = citations_to_ui_lines(citations)
+                        show_citations(citation_lines, citations)
 
         # TAB 2: Extract 
         with tabs[1]:
@@ -169,17 +265,43 @@ def main():
                 if not ok:
                     st.error(err)
                 else:
-                    with st.spinner("Extracting..."):
-                        t0 = time.time()
+                    t0 = time.time()
+                    prefetched = st.session_state.extract_prefetch
+                    raw_view = st.empty()
+
+                    result = None
+                    if prefetched is not None and prefetched[0] == st.session_state.report_text:
+                        # Started from the Explain tab; usually already finished
+                        st.session_state.extract_prefetch = None
+                        try:
+                            with st.spinner("Finishing extraction..."):
+                                result = prefetched[1].result()
+                        except Exception:
+                            result = None  # cancelled or failed: extract again below
+
+                    if result is not None:
+                        answer = result.answer
+                        with raw_view.container():
+                            st.text(answer)
+                        st.success(
+                            f"Prepared in background ({result.timings['total']:.2f}s) | "
+                            f"waited {time.time() - t0:.2f}s"
+                        )
+                    else:
                         user_prompt = extract_prompt(st.session_state.report_text)
-                        answer = generate_text(SYSTEM_BASE, user_prompt)
-                        t1 = time.time()
 
-                    st.success(f"Done in {t1 - t0:.2f}s")
+                        # Show raw JSON as it streams; replaced by the parsed view below
+                        with trace("extract") as tr, raw_view.container():
+                            timer = StreamTimer(generate_text_stream(SYSTEM_BASE, user_prompt), t0)
+                            answer = render_stream(timer)
+
+                        st.success(timer.summary())
+                        st.caption(stage_stats(tr))
 
                     # Try to render JSON nicely
                     try:
                         parsed = json.loads(answer)
+                        raw_view.empty()
                         st.json(parsed)
 
                         # Pretty views (if keys exist)
@@ -259,49 +381,60 @@ def main():
                 with st.chat_message("user"):
                     st.write(question)
 
-                with st.spinner("Retrieving evidence + answering..."):
-                    t0 = time.time()
-                    retrieved = retrieve_top_k(
-                        query=question,
-                        top_k=top_k,
-                        min_score=min_score,
-                        final_top_k=final_top_k,
-                    )
-
-                    ok_ev, err_ev = validate_retrieval_results(retrieved, min_results=2)
-                    if not ok_ev:
-                        assistant_reply = err_ev
-                        assistant_reply = enforce_disclaimer(assistant_reply)
-                        t1 = time.time()
-                        with st.chat_message("assistant"):
-                            st.write(assistant_reply)
-                        st.session_state.chat_history.append(ChatTurn(role="assistant", content=assistant_reply))
-                        st.info(f"Done in {t1 - t0:.2f}s (no sufficient evidence)")
-                        return
-
-                    context_block, citations = build_context_with_citations(retrieved)
-                    user_prompt = qa_prompt(question, st.session_state.report_text, context_block)
-
-                    # Context management: include last N turns
-                    trimmed = trim_history(st.session_state.chat_history[:-1], max_turns=6)
-                    history_msgs = history_to_messages(trimmed)
-
-                    assistant_reply = generate_text(SYSTEM_BASE, user_prompt, history_messages=history_msgs)
-                    assistant_reply = enforce_disclaimer(assistant_reply)
-                    t1 = time.time()
-
-                with st.chat_message("assistant"):
-                    st.write(assistant_reply)
+                with trace("qa") as tr:
+                    with st.spinner("Retrieving evidence..."):
+                        t0 = time.time()
+                        retrieved = retrieve_top_k(
+                            query=question,
+                            top_k=top_k,
+                            min_score=min_score,
+                            final_top_k=final_top_k,
+                            metadata_filter=metadata_filter,
+                        )
+
+                        ok_ev, err_ev = validate_retrieval_results(retrieved, min_results=2)
+                        if ok_ev:
+                            # Context management: include last N turns
+                            trimmed = trim_history(st.session_state.chat_history[:-1], max_turns=6)
+                            history_msgs = history_to_messages(trimmed)
+
+                            # Evidence fills whatever the token budget leaves after report + history
+                            report_text = st.session_state.report_text
+                            # (the oldest turns are dropped first if evidence would not fit)
+                            user_prompt, context_block, citations, history_msgs = pack_prompt(
+                                lambda ctx: qa_prompt(question, report_text, ctx), retrieved,
+                                history_messages=history_msgs,
+                            )
+                            # Packing may drop the weakest chunks to fit the budget; check what is sent
+                            ok_ev, err_ev = validate_retrieval_results(citations, min_results=2)
+
+                        if not ok_ev:
+                            assistant_reply = err_ev
+                            assistant_reply = enforce_disclaimer(assistant_reply)
+                            t1 = time.time()
+                            with st.chat_message("assistant"):
+                                st.write(assistant_reply)
+                            st.session_state.chat_history.append(ChatTurn(role="assistant", content=assistant_reply))
+                            st.info(f"Done in {t1 - t0:.2f}s (no sufficient evidence)")
+                            return
+
+                    with st.chat_message("assistant"):
+                        timer = StreamTimer(
+                            generate_text_stream(SYSTEM_BASE, user_prompt, history_messages=history_msgs,
+                                                 cache_question=question), t0
+                        )
+                        assistant_reply = render_stream(timer, finalize=enforce_disclaimer)
 
                 st.session_state.chat_history.append(ChatTurn(role="assistant", content=assistant_reply))
-                st.info(f"Done in {t1 - t0:.2f}s")
+                st.info(timer.summary())
+                st.caption(stage_stats(tr))
 
                 citation_lines = citations_to_ui_lines(citations)
 
                 with st.expander("Top evidence snippets (preview)", expanded=False):
                     for c in citations[:3]:
                         with st.container(border=True):
-                            st.markdown(f"**[{c.cid}] {c.source} — page {c.page}** (score: {c.score:.3f})")
+                            st.markdown(f"**[{c.cid}] {c.source} — page {c.page}** ({score_label(c)})")
                             st.caption(c.snippet)
                         
                 show_citations(citation_lines, citations)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from app.pipeline import RetrievalSettings, explain_async, extract_async
+from app.guards import validate_report_input
+
+TASKS = ("explain", "extract")
+
+
+def report_sha256(text: str) -> str:
+    """Dedup key: identical reports modulo whitespace share one result."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def iter_reports(path: str | Path, id_field: str = "id", text_field: str = "report_text") -> Iterator[Tuple[str, str]]:
+    """
+    Stream (report_id, report_text) from a .jsonl or .csv dump without loading it.
+    Rows without an id get their 1-based row number.
+    """
+    path = Path(path)
+    with path.open("r", encoding="utf-8", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            # Reports can exceed the 128 KB default; a C long is 32-bit on Windows
+            csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for n, row in enumerate(rows, start=1):
+            rid = row.get(id_field)
+            yield (str(rid) if rid not in (None, "") else str(n)), (row.get(text_field) or "")
+
+
+def load_done(out_path: Path) -> Tuple[Set[str], Dict[str, str]]:
+    """
+    Ids already written successfully, and report hash -> id of its full result.
+    Error rows are not counted, so a resumed run retries them.
+    """
+    done: Set[str] = set()
+    by_hash: Dict[str, str] = {}
+    if not out_path.exists():
+        return done, by_hash
+    with out_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            if "error" in row:
+                continue
+            done.add(row["id"])
+            if "duplicate_of" not in row:
+                by_hash[row["report_sha256"]] = row["id"]
+    return done, by_hash
+
+
+async def process_report(
+    rid: str,
+    text: str,
+    tasks: Tuple[str, ...],
+    level: str,
+    settings: RetrievalSettings,
+) -> Dict[str, Any]:
+    """Run the requested flows for one report concurrently; one output row."""
+    row: Dict[str, Any] = {"id": rid, "report_sha256": report_sha256(text)}
+    t0 = time.perf_counter()
+
+    coros = {}
+    if "explain" in tasks:
+        coros["explain"] = explain_async(text, level, settings)
+    if "extract" in tasks:
+        coros["extract"] = extract_async(text)
+    results = dict(zip(coros, await asyncio.gather(*coros.values())))
+
+    if "explain" in results:
+        row["explanation"] = results["explain"].answer
+        row["citations"] = [
+            {k: v for k, v in asdict(c).items() if k != "snippet"} for c in results["explain"].citations
+        ]
+    if "extract" in results:
+        raw = results["extract"].answer
+        try:
+            row["extraction"] = json.loads(raw)
+        except json.JSONDecodeError:
+            row["extraction_raw"] = raw
+    row["timings"] = {name: round(r.timings["total"], 3) for name, r in results.items()}
+    row["total_sec"] = round(time.perf_counter() - t0, 3)
+    return row
+
+
+class Progress:
+    def __init__(self, every_sec: float = 10.0):
+        self.t0 = time.perf_counter()
+        self.every_sec = every_sec
+        self._last = self.t0
+        self.processed = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = 0
+
+    def per_minute(self) -> float:
+        elapsed = time.perf_counter() - self.t0
+        return (self.processed + self.duplicates) / elapsed * 60 if elapsed else 0.0
+
+    def line(self) -> str:
+        return (f"processed={self.processed} duplicates={self.duplicates} skipped={self.skipped} "
+                f"invalid={self.invalid} errors={self.errors} | {self.per_minute():.1f} reports/min")
+
+    def tick(self) -> None:
+        now = time.perf_counter()
+        if now - self._last >= self.every_sec:
+            self._last = now
+            print(self.line(), flush=True)
+
+
+async def run_batch(
+    input_path: str | Path,
+    out_path: str | Path,
+    tasks: Tuple[str, ...] = TASKS,
+    level: str = "normal",
+    concurrency: int = 8,
+    settings: Optional[RetrievalSettings] = None,
+    id_field: str = "id",
+    text_field: str = "report_text",
+    resume: bool = True,
+) -> Progress:
+    """
+    Stream reports, keep at most `concurrency` in flight, append one JSON row
+    per report as it finishes. Identical reports are processed once; repeats
+    are written as {"id", "report_sha256", "duplicate_of": <id>}.
+    """
+    settings = settings or RetrievalSettings()
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    done, by_hash = load_done(out_path) if resume else (set(), {})
+    if not resume:
+        out_path.unlink(missing_ok=True)
+
+    progress = Progress()
+    in_flight: Dict[str, asyncio.Task] = {}    # report hash -> task
+    waiting: Dict[str, list] = {}              # report hash -> duplicate ids seen while in flight
+
+    with out_path.open("a", encoding="utf-8") as out:
+
+        def write(row: Dict[str, Any]) -> None:
+            out.write(json.dumps(row) + "\n")
+            out.flush()
+
+        def finish(task: asyncio.Task) -> None:
+            key, rid = task.get_name().split(":", 1)
+            in_flight.pop(key, None)
+            try:
+                row = task.result()
+            except Exception as e:
+                # Duplicates waiting on this report fail with it; all are retried on resume
+                error = f"{type(e).__name__}: {e}"
+                for failed_id in [rid] + waiting.pop(key, []):
+                    write({"id": failed_id, "report_sha256": key, "error": error})
+                    progress.errors += 1
+                return
+            write(row)
+            by_hash[key] = rid
+            progress.processed += 1
+            for dup_id in waiting.pop(key, []):
+                write({"id": dup_id, "report_sha256": key, "duplicate_of": rid})
+                progress.duplicates += 1
+
+        for rid, text in iter_reports(input_path, id_field=id_field, text_field=text_field):
+            if rid in done:
+                progress.skipped += 1
+                continue
+            ok, err = validate_report_input(text)
+            if not ok:
+                write({"id": rid, "report_sha256": report_sha256(text), "invalid": err})
+                progress.invalid += 1
+                continue
+
+            key = report_sha256(text)
+            if key in by_hash:
+                write({"id": rid, "report_sha256": key, "duplicate_of": by_hash[key]})
+                progress.duplicates += 1
+                continue
+            if key in in_flight:
+                waiting.setdefault(key, []).append(rid)
+                continue
+
+            # Backpressure: never read further ahead than `concurrency` reports
+            while len(in_flight) >= concurrency:
+                finished, _ = await asyncio.wait(in_flight.values(), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    finish(task)
+                progress.tick()
+
+            in_flight[key] = asyncio.create_task(
+                process_report(rid, text, tasks, level, settings), name=f"{key}:{rid}"
+            )
+
+        while in_flight:
+            finished, _ = await asyncio.wait(in_flight.values(), return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                finish(task)
+            progress.tick()
+
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain/extract an archive of radiology reports.")
+    parser.add_argument("input", help=".jsonl or .csv file with one report per row")
+    parser.add_argument("--out", default="data/batch/results.jsonl", help="Output JSONL (appended; resumable)")
+    parser.add_argument("--tasks", default="explain,extract",
+                        help="Comma-separated subset of: explain, extract")
+    parser.add_argument("--level", choices=["simple", "normal", "clinician"], default="normal")
+    parser.add_argument("--concurrency", type=int, default=8, help="Reports processed at once")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="report_text")
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--min-score", type=float, default=0.50)
+    parser.add_argument("--final-top-k", type=int, default=6)
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping written ids")
+    args = parser.parse_args()
+
+    tasks = tuple(t.strip() for t in args.tasks.split(",") if t.strip())
+    unknown = [t for t in tasks if t not in TASKS]
+    if unknown or not tasks:
+        parser.error(f"--tasks must be a subset of {', '.join(TASKS)}")
+
+    progress = asyncio.run(run_batch(
+        args.input,
+        args.out,
+        tasks=tasks,
+        level=args.level,
+        concurrency=args.concurrency,
+        settings=RetrievalSettings(top_k=args.top_k, min_score=args.min_score, final_top_k=args.final_top_k),
+        id_field=args.id_field,
+        text_field=args.text_field,
+        resume=not args.no_resume,
+    ))
+    print(f"Done: {progress.line()}")
+    print(f"Saved: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,24 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
-from typing import List, Literal
+from typing import Any, Callable, Dict, List, Literal, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from rag.citations import Citation, build_context_with_citations, format_context_entry
+from rag.packing import CHUNK_TOKEN_CAP, pack_by_tokens, relevance
+from rag.tokens import count_message_tokens, count_tokens
+from app.prompts import SYSTEM_BASE
+
+load_dotenv()
+
+# Whole-request prompt budget: system + history + user prompt (template, report, evidence)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Evidence chunks pack_prompt tries to keep before giving up (shortening them if it must)
+MIN_EVIDENCE_CHUNKS = int(os.getenv("MIN_EVIDENCE_CHUNKS", "2"))
+# Chunks are never shortened below this to meet MIN_EVIDENCE_CHUNKS
+MIN_CHUNK_TOKENS = 48
 
 
 Role = Literal["user", "assistant"]
@@ -27,3 +44,87 @@ def history_to_messages(history: List[ChatTurn]) -> List[dict]:
     Convert ChatTurn list into OpenAI-compatible messages.
     """
     return [{"role": h.role, "content": h.content} for h in history]
+
+
+def prompt_tokens(system_prompt: str, history_messages: List[dict], user_prompt: str) -> int:
+    """
+    Prompt tokens for the messages generate_text would send.
+    """
+    messages = [{"role": "system", "content": system_prompt}, *history_messages,
+                {"role": "user", "content": user_prompt}]
+    return count_message_tokens(messages)
+
+
+class PackedPrompt(NamedTuple):
+    user_prompt: str
+    context_block: str
+    citations: List[Citation]
+    history_messages: List[dict]  # what to send: the oldest turns may have been dropped
+
+
+def pack_prompt(
+    build_prompt: Callable[[str], str],
+    results: List[Dict[str, Any]],
+    history_messages: Optional[List[dict]] = None,
+    system_prompt: str = SYSTEM_BASE,
+    budget_tokens: int = PROMPT_TOKEN_BUDGET,
+    per_chunk_token_cap: int = CHUNK_TOKEN_CAP,
+    min_evidence: int = MIN_EVIDENCE_CHUNKS,
+) -> PackedPrompt:
+    """
+    Fill the evidence slot of a prompt so the whole request (system prompt,
+    history, template and report text) stays within budget_tokens.
+    build_prompt maps an evidence block to the user prompt, e.g.
+    lambda ctx: explain_prompt(level, report_text, ctx).
+
+    Evidence outranks chat history: the oldest history messages are dropped
+    while they push evidence chunks out. If the prompt still has room for
+    fewer than min_evidence whole chunks (e.g. a long report), chunks are
+    shortened (not below MIN_CHUNK_TOKENS) so that many fit.
+    Returns PackedPrompt(user_prompt, context_block, citations,
+    history_messages); send the returned history, not the one passed in.
+    """
+    history = list(history_messages or [])
+    base = build_prompt("")
+
+    # Citation header + entry separator, sized for the widest header
+    entry_overhead = 2 + max(
+        (count_tokens(format_context_entry(len(results), (r.get("metadata") or {}).get("source", "unknown"),
+                                           (r.get("metadata") or {}).get("page", -1), ""))
+         for r in results),
+        default=0,
+    )
+
+    def room(hist: List[dict]) -> int:
+        return budget_tokens - prompt_tokens(system_prompt, hist, base)
+
+    def pack(hist: List[dict], cap: int) -> List[Dict[str, Any]]:
+        return pack_by_tokens(results, max_context_tokens=room(hist), per_chunk_token_cap=cap,
+                              entry_overhead_tokens=entry_overhead)
+
+    packed = pack(history, per_chunk_token_cap)
+    if history:
+        most = len(pack([], per_chunk_token_cap))
+        while history and len(packed) < most:
+            history = history[1:]
+            # Keep the history starting on a user turn
+            while history and history[0].get("role") == "assistant":
+                history = history[1:]
+            packed = pack(history, per_chunk_token_cap)
+
+    floor = min(min_evidence, sum(1 for r in results if (r.get("text") or "").strip()))
+    if len(packed) < floor:
+        cap = min(per_chunk_token_cap, room(history) // floor - entry_overhead)
+        if cap >= MIN_CHUNK_TOKENS:
+            shortened = pack(history, cap)
+            if len(shortened) > len(packed):
+                packed = shortened
+
+    while True:
+        context_block, citations = build_context_with_citations(packed, max_snippet_chars=None)
+        user_prompt = build_prompt(context_block)
+        # Token merges at entry boundaries can add a token or two; drop the weakest until it fits
+        if not packed or prompt_tokens(system_prompt, history, user_prompt) <= budget_tokens:
+            return PackedPrompt(user_prompt, context_block, citations, history)
+        weakest = min(range(len(packed)), key=lambda i: relevance(packed[i]))
+        packed = packed[:weakest] + packed[weakest + 1:]
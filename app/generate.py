@@ -1,30 +1,161 @@
 import os
+from typing import Iterator
+
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from rag.clients import get_openai_client, get_async_openai_client
+from rag.tokens import count_message_tokens, count_tokens
+from rag.tracing import span, start_span
+from app.response_cache import get_response_cache
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+TEMPERATURE = 0.2
+
+
+def _build_messages(system_prompt: str, user_prompt: str, history: list[dict]) -> list[dict]:
+    messages = [{"role": "system", "content": system_prompt}]
+
+    if history:
+        messages.extend(history)
 
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+def _record_usage(sp, resp, answer: str) -> None:
+    """Token counts from the API response when present, else counted locally."""
+    usage = getattr(resp, "usage", None)
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        sp.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    else:
+        sp.set(completion_tokens=count_tokens(answer, CHAT_MODEL))
 
-def generate_text(system_prompt: str, user_prompt: str, history_messages: list[dict] | None = None) -> str:
+
+def generate_text(
+    system_prompt: str,
+    user_prompt: str,
+    history_messages: list[dict] | None = None,
+    use_cache: bool = True,
+    cache_question: str | None = None,
+) -> str:
     """
     Generate a response using OpenAI chat completions.
     system_prompt: overall instruction
     user_prompt: task prompt (already includes context/report)
     history_messages: optional list of prior messages (role/content)
+    use_cache: consult the response cache (only active when LLM_CACHE_ENABLED is set)
+    cache_question: the user's question inside user_prompt, if any; enables
+        the cache's near-duplicate-question lookup (the rest of the prompt
+        must match exactly)
     """
-    messages = [{"role": "system", "content": system_prompt}]
+    history = list(history_messages or [])
+    messages = _build_messages(system_prompt, user_prompt, history)
+    with span("generation", model=CHAT_MODEL, prompt_tokens=count_message_tokens(messages, CHAT_MODEL)) as sp:
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, question=cache_question)
+            sp.set(cache_hit=cached is not None)
+            if cached is not None:
+                return cached
 
-    if history_messages:
-        messages.extend(history_messages)
+        resp = get_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+        )
+        answer = resp.choices[0].message.content.strip()
+        _record_usage(sp, resp, answer)
 
-    messages.append({"role": "user", "content": user_prompt})
+        if cache is not None:
+            cache.put(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, answer,
+                      question=cache_question)
+        return answer
+
+
+def generate_text_stream(
+    system_prompt: str,
+    user_prompt: str,
+    history_messages: list[dict] | None = None,
+    use_cache: bool = True,
+    cache_question: str | None = None,
+) -> Iterator[str]:
+    """
+    Streaming variant of generate_text: yields text deltas as they arrive.
+    A cache hit is yielded as a single piece. The full answer is cached only
+    if the stream is consumed to the end.
+    """
+    history = list(history_messages or [])
+    messages = _build_messages(system_prompt, user_prompt, history)
+    # Detached span: it stays open across yields and closes when the stream ends
+    sp = start_span("generation", model=CHAT_MODEL, prompt_tokens=count_message_tokens(messages, CHAT_MODEL))
+    try:
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, question=cache_question)
+            sp.set(cache_hit=cached is not None)
+            if cached is not None:
+                yield cached
+                return
+
+        stream = get_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            stream=True,
+        )
+
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    sp.set(ttft_ms=round(sp.duration_ms, 1))
+                parts.append(delta)
+                yield delta
+
+        answer = "".join(parts).strip()
+        sp.set(completion_tokens=count_tokens(answer, CHAT_MODEL))
+        if cache is not None:
+            cache.put(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, answer,
+                      question=cache_question)
+    finally:
+        sp.finish()
+
+
+async def agenerate_text(
+    system_prompt: str,
+    user_prompt: str,
+    history_messages: list[dict] | None = None,
+    use_cache: bool = True,
+    cache_question: str | None = None,
+) -> str:
+    """
+    Async variant of generate_text on the shared AsyncOpenAI client.
+    Cancelling the awaiting task aborts the in-flight HTTP request.
+    """
+    history = list(history_messages or [])
+    messages = _build_messages(system_prompt, user_prompt, history)
+    with span("generation", model=CHAT_MODEL, prompt_tokens=count_message_tokens(messages, CHAT_MODEL)) as sp:
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, question=cache_question)
+            sp.set(cache_hit=cached is not None)
+            if cached is not None:
+                return cached
+
+        resp = await get_async_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+        )
+        answer = resp.choices[0].message.content.strip()
+        _record_usage(sp, resp, answer)
 
-    resp = client.chat.completions.create(
-        model=CHAT_MODEL,
-        messages=messages,
-        temperature=0.2,
-    )
-    return resp.choices[0].message.content.strip()
+        if cache is not None:
+            cache.put(CHAT_MODEL, TEMPERATURE, system_prompt, history, user_prompt, answer,
+                      question=cache_question)
+        return answer
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any
+from typing import Any, Sequence
 
 
 DISCLAIMER_TEXT = (
@@ -30,9 +30,10 @@ def validate_question_input(question: str) -> tuple[bool, str]:
     return True, ""
 
 
-def validate_retrieval_results(results: List[Dict[str, Any]], min_results: int = 2) -> tuple[bool, str]:
+def validate_retrieval_results(results: Sequence[Any], min_results: int = 2) -> tuple[bool, str]:
     """
-    Ensure we have enough evidence to answer reliably.
+    Ensure we have enough evidence to answer reliably. Pass the retrieved
+    results, or the citations pack_prompt kept (what the prompt really holds).
     """
     if not results or len(results) < min_results:
         return False, (
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Coroutine, Dict, List, Optional
+
+from rag.retriever import retrieve_many, retrieve_top_k
+from rag.packing import CONTEXT_TOKEN_BUDGET, pack_by_tokens
+from rag.query_planner import QueryPlan, plan_queries
+from rag.citations import Citation
+from rag.tracing import trace
+
+from app.prompts import SYSTEM_BASE, explain_prompt, extract_prompt, qa_prompt
+from app.generate import agenerate_text
+from app.context import pack_prompt
+from app.guards import validate_retrieval_results, enforce_disclaimer
+
+
+@dataclass
+class RetrievalSettings:
+    top_k: int = 12
+    min_score: float = 0.50
+    final_top_k: int = 6
+    # Pinecone-style metadata filter, e.g. {"source": {"$in": [...]}}; None searches everything
+    metadata_filter: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class PipelineResult:
+    answer: str
+    retrieved: List[Dict[str, Any]] = field(default_factory=list)
+    citations: List[Citation] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def explain_query(report_text: str) -> str:
+    """Single retrieval query for reports the planner finds nothing in."""
+    return f"Explain terms and phrases in this report: {report_text[:300]}"
+
+
+def explain_plan(report_text: str, max_queries: int = 6) -> QueryPlan:
+    """
+    Retrieval queries for the Explain flow: key findings and terms from the
+    whole report (impression first), else explain_query.
+    """
+    plan = plan_queries(report_text, max_queries=max_queries)
+    if not plan.queries:
+        plan.queries = [explain_query(report_text)]
+    return plan
+
+
+async def aretrieve(query: str, settings: Optional[RetrievalSettings] = None) -> List[Dict[str, Any]]:
+    """
+    retrieve_top_k on a worker thread (embedding + vector query are blocking calls).
+    """
+    settings = settings or RetrievalSettings()
+    return await asyncio.to_thread(
+        retrieve_top_k,
+        query,
+        top_k=settings.top_k,
+        min_score=settings.min_score,
+        final_top_k=settings.final_top_k,
+        metadata_filter=settings.metadata_filter,
+    )
+
+
+def merge_results(
+    result_lists: List[List[Dict[str, Any]]],
+    final_top_k: int,
+    max_context_tokens: int = CONTEXT_TOKEN_BUDGET,
+) -> List[Dict[str, Any]]:
+    """
+    Merge per-query results round-robin (each query's best chunk, then each
+    one's second, ...) so every sub-query is represented, keeping one chunk
+    per (source, page), then fit them into one shared token budget.
+    """
+    merged: List[Dict[str, Any]] = []
+    seen = set()
+    for rank in range(max((len(r) for r in result_lists), default=0)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            r = results[rank]
+            meta = r.get("metadata", {})
+            key = (meta.get("source", "unknown"), int(meta.get("page", -1)))
+            if key not in seen:
+                seen.add(key)
+                merged.append(r)
+    return pack_by_tokens(merged[:final_top_k], max_context_tokens=max_context_tokens)
+
+
+async def aretrieve_many(
+    queries: List[str],
+    settings: Optional[RetrievalSettings] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve several sub-queries as one batch (single embeddings request,
+    batched vector queries) and merge them.
+    """
+    settings = settings or RetrievalSettings()
+    result_lists = await asyncio.to_thread(
+        retrieve_many,
+        queries,
+        top_k=settings.top_k,
+        min_score=settings.min_score,
+        final_top_k=settings.final_top_k,
+        metadata_filter=settings.metadata_filter,
+    )
+    return merge_results(result_lists, settings.final_top_k)
+
+
+async def explain_async(
+    report_text: str,
+    level: str = "normal",
+    settings: Optional[RetrievalSettings] = None,
+    sub_queries: Optional[List[str]] = None,
+    min_results: int = 2,
+) -> PipelineResult:
+    """
+    Report explanation. Skips generation when too little evidence survives packing.
+    """
+    t0 = time.perf_counter()
+    retrieved = await aretrieve_many(sub_queries or explain_plan(report_text).queries, settings)
+    t1 = time.perf_counter()
+
+    user_prompt, _, citations, _ = pack_prompt(lambda ctx: explain_prompt(level, report_text, ctx), retrieved)
+    # Packing may drop the weakest chunks to fit the budget; check what is sent
+    ok, err = validate_retrieval_results(citations, min_results=min_results)
+    if not ok:
+        return PipelineResult(
+            answer=enforce_disclaimer(err),
+            retrieved=retrieved,
+            timings={"retrieval": t1 - t0, "generation": 0.0, "total": t1 - t0},
+        )
+
+    answer = enforce_disclaimer(await agenerate_text(SYSTEM_BASE, user_prompt))
+    t2 = time.perf_counter()
+
+    return PipelineResult(
+        answer=answer,
+        retrieved=retrieved,
+        citations=citations,
+        timings={"retrieval": t1 - t0, "generation": t2 - t1, "total": t2 - t0},
+    )
+
+
+async def extract_async(report_text: str) -> PipelineResult:
+    t0 = time.perf_counter()
+    answer = await agenerate_text(SYSTEM_BASE, extract_prompt(report_text))
+    t1 = time.perf_counter()
+    return PipelineResult(answer=answer, timings={"generation": t1 - t0, "total": t1 - t0})
+
+
+async def qa_async(
+    question: str,
+    report_text: str,
+    history_messages: Optional[List[dict]] = None,
+    settings: Optional[RetrievalSettings] = None,
+    min_results: int = 2,
+) -> PipelineResult:
+    """
+    Evidence Q&A. Skips generation when retrieval returns too little evidence.
+    """
+    t0 = time.perf_counter()
+    retrieved = await aretrieve(question, settings)
+    t1 = time.perf_counter()
+
+    ok, err = validate_retrieval_results(retrieved, min_results=min_results)
+    if ok:
+        # The oldest history turns are dropped first if the evidence would not fit
+        user_prompt, _, citations, history_messages = pack_prompt(
+            lambda ctx: qa_prompt(question, report_text, ctx), retrieved, history_messages=history_messages
+        )
+        # Packing may drop the weakest chunks to fit the budget; check what is sent
+        ok, err = validate_retrieval_results(citations, min_results=min_results)
+    if not ok:
+        return PipelineResult(
+            answer=enforce_disclaimer(err),
+            retrieved=retrieved,
+            timings={"retrieval": t1 - t0, "generation": 0.0, "total": t1 - t0},
+        )
+
+    answer = enforce_disclaimer(
+        await agenerate_text(SYSTEM_BASE, user_prompt, history_messages=history_messages,
+                             cache_question=question)
+    )
+    t2 = time.perf_counter()
+
+    return PipelineResult(
+        answer=answer,
+        retrieved=retrieved,
+        citations=citations,
+        timings={"retrieval": t1 - t0, "generation": t2 - t1, "total": t2 - t0},
+    )
+
+
+async def explain_and_extract(
+    report_text: str,
+    level: str = "normal",
+    settings: Optional[RetrievalSettings] = None,
+) -> tuple[PipelineResult, PipelineResult]:
+    """
+    Extract needs no retrieval, so it runs while Explain is still retrieving.
+    """
+    explained, extracted = await asyncio.gather(
+        explain_async(report_text, level, settings),
+        extract_async(report_text),
+    )
+    return explained, extracted
+
+
+async def traced(name: str, coro: Coroutine) -> Any:
+    """Await coro inside its own trace (e.g. a background prefetch)."""
+    with trace(name):
+        return await coro
+
+
+class PipelineRunner:
+    """
+    Runs pipeline coroutines on one background event loop, so synchronous callers
+    (Streamlit, scripts) can submit work and collect it later. Submitting under a
+    key that is still running cancels the previous run (e.g. user resubmits).
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="pipeline-loop", daemon=True)
+        self._thread.start()
+        self._tasks: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    async def _in_context(ctx: contextvars.Context, coro: Coroutine) -> Any:
+        # Run in the submitter's context so its active trace sees the spans
+        return await asyncio.get_running_loop().create_task(coro, context=ctx)
+
+    def submit(self, key: str, coro: Coroutine) -> Future:
+        ctx = contextvars.copy_context()
+        with self._lock:
+            prev = self._tasks.get(key)
+            if prev is not None and not prev.done():
+                prev.cancel()
+            fut = asyncio.run_coroutine_threadsafe(self._in_context(ctx, coro), self._loop)
+            self._tasks[key] = fut
+        return fut
+
+    def cancel(self, key: str) -> bool:
+        with self._lock:
+            fut = self._tasks.pop(key, None)
+        return fut.cancel() if fut is not None else False
+
+    def run(self, key: str, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Submit and block for the result."""
+        return self.submit(key, coro).result(timeout)
+
+
+_runner: Optional[PipelineRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> PipelineRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = PipelineRunner()
+    return _runner
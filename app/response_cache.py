@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Off by default: cached prompts contain report text and are written to local disk.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/index/llm_cache.sqlite")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+# Cosine threshold for near-duplicate questions; 0 disables the similarity path
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0"))
+# Max same-scope candidates scanned on a similarity lookup (most recent first)
+LLM_CACHE_SCAN_LIMIT = int(os.getenv("LLM_CACHE_SCAN_LIMIT", "500"))
+
+
+def _sha256(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def scope_key(model: str, temperature: float, system_prompt: str, history: List[dict], context: str = "") -> str:
+    """
+    Everything except the question; similarity matches never cross scopes.
+    context is the user prompt with the question cut out (template, report
+    text, evidence), so a report differing only in "left"/"right" or
+    "6 mm"/"16 mm" is a different scope.
+    """
+    return _sha256([model, temperature, system_prompt, history, context])
+
+
+def _context_of(user_prompt: str, question: Optional[str]) -> Optional[str]:
+    """user_prompt minus the question, or None when there is no question to compare on."""
+    if not question or not question.strip() or question not in user_prompt:
+        return None
+    return user_prompt.replace(question, "\0")
+
+
+def prompt_key(model: str, temperature: float, system_prompt: str, history: List[dict], user_prompt: str) -> str:
+    return _sha256([model, temperature, system_prompt, history, user_prompt])
+
+
+class ResponseCache:
+    """
+    SQLite-backed chat-completion cache with exact-key lookup, optional
+    embedding-similarity lookup for near-duplicate questions, and LRU eviction.
+
+    Only the question is embedded and compared, and only against entries
+    whose report text and evidence are byte-identical (they are hashed into
+    the scope). Calls without a `question` use the exact key alone.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        similarity_threshold: float = LLM_CACHE_SIMILARITY,
+        embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed_fn = embed_fn
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " embedding BLOB,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_scope ON responses(scope, last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    @property
+    def _use_similarity(self) -> bool:
+        return self.similarity_threshold > 0 and self.embed_fn is not None
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def get(
+        self,
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        history: List[dict],
+        user_prompt: str,
+        question: Optional[str] = None,
+    ) -> Optional[str]:
+        key = prompt_key(model, temperature, system_prompt, history, user_prompt)
+
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._touch(key)
+                self.hits += 1
+                return row[0]
+
+        context = _context_of(user_prompt, question)
+        if self._use_similarity and context is not None:
+            scope = scope_key(model, temperature, system_prompt, history, context)
+            query = self._embed(question)
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, response, embedding FROM responses"
+                    " WHERE scope = ? AND embedding IS NOT NULL"
+                    " ORDER BY last_used DESC LIMIT ?",
+                    (scope, LLM_CACHE_SCAN_LIMIT),
+                ).fetchall()
+                if rows:
+                    mat = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                    scores = mat @ query
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold:
+                        self._touch(rows[best][0])
+                        self.similar_hits += 1
+                        return rows[best][1]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(
+        self,
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        history: List[dict],
+        user_prompt: str,
+        response: str,
+        question: Optional[str] = None,
+    ) -> None:
+        key = prompt_key(model, temperature, system_prompt, history, user_prompt)
+        context = _context_of(user_prompt, question)
+        scope = scope_key(model, temperature, system_prompt, history, user_prompt if context is None else context)
+        blob = self._embed(question).tobytes() if self._use_similarity and context is not None else None
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, response, embedding, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, scope, response, blob, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _touch(self, key: str) -> None:
+        """Caller holds the lock."""
+        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used rows above max_entries. Caller holds the lock."""
+        if self.max_entries <= 0:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.similar_hits + self.misses
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.similar_hits) / total, 3) if total else 0.0,
+            "entries": int(count),
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Process-wide cache, or None unless LLM_CACHE_ENABLED is set.
+    """
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            embed_fn = None
+            if LLM_CACHE_SIMILARITY > 0:
+                from rag.embeddings import embed_texts
+
+                embed_fn = embed_texts
+            _cache = ResponseCache(embed_fn=embed_fn)
+    return _cache
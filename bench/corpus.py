@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from rag.loaders import DocumentChunk
+from bench.fakes import TopicSpace
+
+# Radiology-flavoured vocabulary so text lengths and tokenization look like the real KB
+_WORDS = (
+    "opacity atelectasis consolidation effusion pneumothorax cardiomegaly nodule mass "
+    "interstitial alveolar hilar mediastinal pleural lobe segment bilateral unilateral "
+    "mild moderate severe acute chronic stable unchanged increased decreased likely "
+    "represents suggests correlate clinically recommend follow-up imaging findings "
+    "impression patient chest radiograph lateral frontal view lung base apex costophrenic "
+    "angle diaphragm heart silhouette normal limits no evidence of with without the a of "
+    "and in is are may be to for on at from right left upper lower middle"
+).split()
+
+
+def synthetic_text(rng: random.Random, n_chars: int) -> str:
+    words: List[str] = []
+    size = 0
+    while size < n_chars:
+        w = rng.choice(_WORDS)
+        words.append(w)
+        size += len(w) + 1
+        if rng.random() < 0.08:
+            words[-1] += "."
+    return " ".join(words)[:n_chars]
+
+
+def synthetic_documents(n_pages: int, page_chars: int = 3000, seed: int = 0) -> List[DocumentChunk]:
+    """Page-level documents in the shape produced by rag.loaders."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_pages):
+        docs.append(DocumentChunk(
+            text=synthetic_text(rng, page_chars),
+            metadata={"source": f"synthetic_{i // 50:04d}.pdf", "page": i % 50 + 1,
+                      "doc_type": "radiology_reference"},
+        ))
+    return docs
+
+
+def write_text_kb(folder: str | Path, n_files: int, file_chars: int = 6000, seed: int = 0) -> Path:
+    """Write a folder of .txt KB files for load_knowledge_base."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    for i in range(n_files):
+        (folder / f"synthetic_{i:05d}.txt").write_text(synthetic_text(rng, file_chars), encoding="utf-8")
+    return folder
+
+
+def write_blank_pdf(path: str | Path) -> Path:
+    """One empty page, so load_knowledge_base has a PDF to open when no real KB is available."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    with Path(path).open("wb") as f:
+        writer.write(f)
+    return Path(path)
+
+
+def synthetic_index(
+    n_chunks: int,
+    space: TopicSpace,
+    chunk_chars: int = 1000,
+    n_texts: int = 512,
+    seed: int = 0,
+) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+    """
+    ids, unit vectors and metadata for an n_chunks index. Chunk texts cycle
+    through n_texts distinct strings so million-row corpora stay small in RAM.
+    """
+    rng = random.Random(seed)
+    texts = [synthetic_text(rng, chunk_chars) for _ in range(n_texts)]
+    topics = np.random.default_rng(seed).integers(0, space.n_topics, size=n_chunks)
+    vectors = space.sample(topics, seed=seed)
+
+    ids = [f"chunk-{i}" for i in range(n_chunks)]
+    metadata = [
+        {"source": f"synthetic_{i // 500:05d}.pdf", "page": i % 500 // 10 + 1,
+         "chunk_index": i % 10, "text": texts[i % n_texts]}
+        for i in range(n_chunks)
+    ]
+    return ids, vectors, metadata
+
+
+def synthetic_results(n: int = 12, chunk_chars: int = 1000, seed: int = 0) -> List[Dict[str, Any]]:
+    """Raw retriever matches (pre-ranking), scores descending."""
+    rng = random.Random(seed)
+    results = []
+    for i in range(n):
+        score = round(0.85 - i * 0.03, 4)
+        results.append({
+            "id": f"r{i}",
+            "text": synthetic_text(rng, chunk_chars),
+            "score": score,
+            "metadata": {"source": f"synthetic_{i % 4}.pdf", "page": i % 5 + 1},
+        })
+    return results
+
+
+def synthetic_questions(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What does {rng.choice(_WORDS)} {rng.choice(_WORDS)} mean in a chest radiograph? ({i})" for i in range(n)]
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rag.metadata_filter import MetadataIndex
+from rag.vector_store import LocalVectorStore
+
+
+def text_seed(text: str) -> int:
+    """Stable 64-bit seed for a text (Python's hash() is salted per process)."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class Latency:
+    """
+    Injected per-call latency: a fixed delay plus uniform jitter (seeded).
+    """
+
+    def __init__(self, seconds: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    def sleep(self) -> None:
+        delay = self.seconds + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class TopicSpace:
+    """
+    Fixed set of random unit "topic" directions. Fake embeddings are a topic
+    plus noise, so queries land near corpus chunks of the same topic and
+    retrieval scores clear the usual min_score threshold.
+    """
+
+    def __init__(self, dims: int = 256, n_topics: int = 64, noise: float = 0.35, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        centroids = rng.standard_normal((n_topics, dims)).astype(np.float32)
+        self.centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.dims = dims
+        self.noise = noise
+
+    @property
+    def n_topics(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def topic_of(self, text: str) -> int:
+        return text_seed(text) % self.n_topics
+
+    def embed(self, text: str) -> np.ndarray:
+        rng = np.random.default_rng(text_seed(text))
+        vec = self.centroids[self.topic_of(text)] + self.noise * rng.standard_normal(self.dims).astype(np.float32) / np.sqrt(self.dims)
+        return vec / np.linalg.norm(vec)
+
+    def sample(self, topics: np.ndarray, seed: int = 0) -> np.ndarray:
+        """Unit vectors for many chunks at once (one row per topic id)."""
+        rng = np.random.default_rng(seed)
+        noise = rng.standard_normal((len(topics), self.dims)).astype(np.float32) / np.sqrt(self.dims)
+        mat = self.centroids[topics] + self.noise * noise
+        return mat / np.linalg.norm(mat, axis=1, keepdims=True)
+
+
+class FakeOpenAI:
+    """
+    Stand-in for the subset of the OpenAI client this project uses:
+    embeddings.create, chat.completions.create (incl. stream=True) and models.retrieve.
+    Outputs are deterministic; latency is injected per call.
+    """
+
+    def __init__(
+        self,
+        space: TopicSpace,
+        embed_latency: Optional[Latency] = None,
+        chat_latency: Optional[Latency] = None,
+        answer: str = "Atelectasis means partial collapse of lung tissue [1]. Opacity is a whiter area on the image [2].",
+        stream_pieces: int = 16,
+    ):
+        self.space = space
+        self.embed_latency = embed_latency or Latency()
+        self.chat_latency = chat_latency or Latency()
+        self.answer = answer
+        self.stream_pieces = stream_pieces
+        self.calls = {"embeddings": 0, "chat": 0}
+
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.models = SimpleNamespace(retrieve=lambda model: SimpleNamespace(id=model))
+
+    def _embed(self, model: str, input: List[str], **kwargs):
+        self.calls["embeddings"] += 1
+        self.embed_latency.sleep()
+        data = [SimpleNamespace(index=i, embedding=self.space.embed(t).tolist()) for i, t in enumerate(input)]
+        return SimpleNamespace(data=data, model=model)
+
+    def _chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs):
+        self.calls["chat"] += 1
+        self.chat_latency.sleep()
+        if not stream:
+            message = SimpleNamespace(content=self.answer)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream()
+
+    def _stream(self):
+        step = max(1, len(self.answer) // self.stream_pieces)
+        for start in range(0, len(self.answer), step):
+            delta = SimpleNamespace(content=self.answer[start:start + step])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeAsyncOpenAI:
+    """
+    Async counterpart of FakeOpenAI (chat.completions.create only), sharing its outputs.
+    """
+
+    def __init__(self, sync: FakeOpenAI):
+        self.sync = sync
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+
+    async def _chat(self, model: str, messages: List[Dict[str, Any]], **kwargs):
+        return await asyncio.to_thread(self.sync._chat, model, messages, **kwargs)
+
+
+class FakeVectorStore(LocalVectorStore):
+    """
+    In-memory LocalVectorStore (never flushed) with injected query latency,
+    standing in for a remote Pinecone index.
+    """
+
+    name = "fake"
+
+    def __init__(self, query_latency: Optional[Latency] = None, **kwargs):
+        super().__init__(index_dir="/nonexistent/bench-index", **kwargs)
+        self.query_latency = query_latency or Latency()
+
+    def load_arrays(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict[str, Any]]) -> None:
+        """
+        Bulk-load pre-normalized vectors, bypassing the per-record upsert path
+        (which would dominate setup time for million-row corpora).
+        """
+        with self._lock:
+            self._vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self._codes = self._scales = None
+            self._ivf = None
+            self._ids = list(ids)
+            self._metadata = list(metadata)
+            self._meta_index = MetadataIndex(self._metadata)
+            self._pos = {vid: i for i, vid in enumerate(self._ids)}
+            self._pending.clear()
+
+    def query_many(self, vectors, top_k: int = 10, include_metadata: bool = True, filter=None) -> List[Dict[str, Any]]:
+        # One round trip per call; query() goes through here too
+        self.query_latency.sleep()
+        return super().query_many(vectors, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+
+def install_fakes(client: FakeOpenAI, store: FakeVectorStore, lexical=None, chunks=None) -> None:
+    """
+    Route the shared client/store singletons to the fakes and turn off the
+    on-disk embedding cache and in-memory retrieval cache, so every call
+    exercises the code under test. `lexical` (a BM25Index over the same
+    corpus, or None for vector-only) replaces any BM25 index on disk, and
+    `chunks` (a ChunkStore, or None to read text from vector metadata) any
+    chunk store.
+    """
+    from pathlib import Path
+
+    import rag.bm25 as bm25
+    import rag.chunk_store as chunk_store
+    import rag.clients as clients
+    import rag.embedding_cache as embedding_cache
+    import rag.vector_store as vector_store
+    import app.response_cache as response_cache
+    from rag.retriever import clear_retrieval_cache
+
+    clients._openai_client = client
+    clients._async_openai_client = FakeAsyncOpenAI(client)
+    embedding_cache.EMBED_CACHE_ENABLED = False
+    response_cache.LLM_CACHE_ENABLED = False
+    vector_store._STORES[vector_store.VECTOR_BACKEND] = store
+    bm25._PINNED[Path(vector_store.LOCAL_INDEX_DIR)] = lexical
+    chunk_store._PINNED[Path(vector_store.LOCAL_INDEX_DIR)] = chunks
+    clear_retrieval_cache()
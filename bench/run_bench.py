@@ -0,0 +1,362 @@
+"""
+Offline benchmark suite: fake OpenAI + in-memory vector store, synthetic corpora.
+
+    python -m bench.run_bench                           # 10k and 100k chunks
+    python -m bench.run_bench --sizes 10000,1000000 --dims 128
+    python -m bench.run_bench --embed-latency 0.05 --chat-latency 0.8
+    python -m bench.run_bench --compare bench/results/<old>.json
+
+Results are written to bench/results/<git sha>.json (or --out).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from bench.fakes import FakeOpenAI, FakeVectorStore, Latency, TopicSpace, install_fakes
+from bench.corpus import (
+    synthetic_documents,
+    synthetic_index,
+    synthetic_questions,
+    synthetic_results,
+    write_blank_pdf,
+    write_text_kb,
+)
+from eval.run_eval import percentile
+from rag.loaders import load_knowledge_base
+from rag.chunking import chunk_documents
+from rag.bm25 import BM25Index
+from rag.chunk_store import ChunkStore
+from rag.ranking import rank_and_filter
+from rag.citations import build_context_with_citations
+from app.context import pack_prompt
+from rag.retriever import retrieve_many, retrieve_top_k
+from app.prompts import SYSTEM_BASE, qa_prompt
+from app.generate import generate_text
+from app.guards import validate_retrieval_results, enforce_disclaimer
+
+RESULTS_DIR = Path("bench/results")
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 1, items: int = 1) -> Dict[str, float]:
+    """
+    Call fn `repeat` times; per-call latency percentiles in ms and throughput
+    in items/sec (items = units of work per call, e.g. chunks produced).
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    total = sum(samples)
+    return {
+        "repeat": repeat,
+        "mean_ms": round(total / repeat * 1000, 4),
+        "p50_ms": round(percentile(samples, 50) * 1000, 4),
+        "p95_ms": round(percentile(samples, 95) * 1000, 4),
+        "min_ms": round(min(samples) * 1000, 4),
+        "items_per_sec": round(items * repeat / total, 2) if total else 0.0,
+    }
+
+
+def qa_flow(question: str) -> str:
+    """The Evidence Q&A path from app.py, minus Streamlit."""
+    retrieved = retrieve_top_k(question, top_k=12, min_score=0.50, final_top_k=6, use_cache=False)
+    ok, err = validate_retrieval_results(retrieved, min_results=2)
+    if not ok:
+        return enforce_disclaimer(err)
+    user_prompt, _, _, _ = pack_prompt(lambda ctx: qa_prompt(question, report_text="", evidence_context=ctx), retrieved)
+    return enforce_disclaimer(generate_text(SYSTEM_BASE, user_prompt, use_cache=False))
+
+
+def bench_micro(args) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Real KB PDFs (if present) plus synthetic .txt files
+        pdfs = sorted(Path(args.kb).glob("*.pdf")) if Path(args.kb).exists() else []
+        if pdfs:
+            for pdf in pdfs:
+                shutil.copy(pdf, tmp)
+        else:
+            write_blank_pdf(Path(tmp) / "blank.pdf")
+        write_text_kb(tmp, n_files=args.kb_files, seed=args.seed)
+
+        docs = load_knowledge_base(tmp, workers=args.workers)
+        out["load_knowledge_base"] = {
+            "pdfs": len(pdfs),
+            "txt_files": args.kb_files,
+            "workers": args.workers,
+            **measure(lambda: load_knowledge_base(tmp, workers=args.workers), repeat=3, items=len(docs)),
+        }
+
+    pages = synthetic_documents(args.pages, seed=args.seed)
+    n_chunks = len(chunk_documents(pages))
+    out["chunk_documents"] = {
+        "pages": len(pages),
+        "chunks": n_chunks,
+        **measure(lambda: chunk_documents(pages), repeat=max(1, args.micro_repeat // 20), items=n_chunks),
+    }
+
+    raw = synthetic_results(12, seed=args.seed)
+    out["rank_and_filter"] = measure(lambda: rank_and_filter(raw), repeat=args.micro_repeat)
+
+    out["rank_and_filter_rerank"] = measure(
+        lambda: rank_and_filter(raw, query="What does ground-glass opacity mean?"), repeat=args.micro_repeat
+    )
+
+    ranked = rank_and_filter(raw)
+    out["build_context_with_citations"] = measure(
+        lambda: build_context_with_citations(ranked), repeat=args.micro_repeat
+    )
+    out["pack_prompt"] = measure(
+        lambda: pack_prompt(lambda ctx: qa_prompt("q", report_text="", evidence_context=ctx), ranked),
+        repeat=args.micro_repeat,
+    )
+    return out
+
+
+def bench_size(n_chunks: int, space: TopicSpace, client: FakeOpenAI, args) -> Dict[str, Any]:
+    store = FakeVectorStore(query_latency=Latency(args.store_latency, args.jitter, seed=args.seed))
+    t0 = time.perf_counter()
+    ids, vectors, metadata = synthetic_index(n_chunks, space, seed=args.seed)
+    store.load_arrays(ids, vectors, metadata)
+    build_sec = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    lexical = BM25Index.build(zip(ids, metadata))
+    bm25_sec = time.perf_counter() - t0
+    install_fakes(client, store, lexical=lexical)
+
+    questions = synthetic_questions(args.queries, seed=args.seed)
+    query_vecs = [space.embed(q) for q in questions]
+    it_vec = iter(range(10 ** 9))
+    it_q = iter(range(10 ** 9))
+
+    out: Dict[str, Any] = {"chunks": n_chunks, "dims": space.dims, "setup_sec": round(build_sec, 3),
+                           "bm25_build_sec": round(bm25_sec, 3)}
+    out["vector_query"] = measure(
+        lambda: store.query(query_vecs[next(it_vec) % len(query_vecs)], top_k=12), repeat=args.queries
+    )
+    # ~10% of the corpus (20 of the synthetic source files); the mask is built once and cached
+    source_filter = {"source": {"$in": sorted({m["source"] for m in metadata})[:20]}}
+    it_f = iter(range(10 ** 9))
+    out["vector_query_filtered"] = measure(
+        lambda: store.query(query_vecs[next(it_f) % len(query_vecs)], top_k=12, filter=source_filter),
+        repeat=args.queries,
+    )
+    out["quantized"] = bench_quantized(vectors, ids, metadata, query_vecs, store, args)
+    out["ivf"] = bench_ivf(vectors, ids, metadata, query_vecs, store, args)
+    it_lex = iter(range(10 ** 9))
+    out["lexical_query"] = measure(
+        lambda: lexical.search(questions[next(it_lex) % len(questions)], top_k=12), repeat=args.queries
+    )
+    out["retrieve_top_k"] = measure(
+        lambda: retrieve_top_k(questions[next(it_q) % len(questions)], use_cache=False), repeat=args.queries
+    )
+    out["chunk_store"] = bench_chunk_store(ids, metadata, questions, client, store, lexical, args)
+
+    # Same queries as one batch: one embeddings call, one query_many
+    out["retrieve_many"] = {
+        "queries": len(questions),
+        **measure(lambda: retrieve_many(questions, use_cache=False), repeat=5, items=len(questions)),
+    }
+    out["retrieve_top_k_loop"] = {
+        "queries": len(questions),
+        **measure(lambda: [retrieve_top_k(q, use_cache=False) for q in questions], repeat=5, items=len(questions)),
+    }
+
+    answered = sum(1 for q in questions if not qa_flow(q).startswith("I don't know"))
+    out["qa_flow"] = {"answered": answered, **measure(lambda: qa_flow(questions[0]), repeat=args.queries)}
+
+    # Throughput under concurrent requests (threads share the fakes and the store)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(qa_flow, questions))
+    wall = time.perf_counter() - t0
+    out["qa_flow_concurrent"] = {
+        "concurrency": args.concurrency,
+        "queries": len(questions),
+        "wall_sec": round(wall, 4),
+        "queries_per_sec": round(len(questions) / wall, 2),
+    }
+
+    del store, vectors, metadata, lexical
+    return out
+
+
+def bench_chunk_store(ids, metadata, questions, client, store, lexical, args) -> Dict[str, Any]:
+    """
+    Chunk store size vs raw text, a 12-id lookup, and retrieve_top_k with
+    text hydrated from the store instead of vector metadata.
+    """
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        chunks = ChunkStore.write(((vid, m["text"], m) for vid, m in zip(ids, metadata)), tmp)
+        out: Dict[str, Any] = {
+            "build_sec": round(time.perf_counter() - t0, 3),
+            "codec": chunks.codec,
+            "stored_mb": round(chunks.stored_bytes / 2 ** 20, 2),
+            "raw_mb": round(chunks.raw_bytes / 2 ** 20, 2),
+        }
+        lookups = [[ids[i] for i in rng.choice(len(ids), 12, replace=False)] for _ in range(args.micro_repeat)]
+        it = iter(range(10 ** 9))
+        out["get_many_12"] = measure(lambda: chunks.get_many(lookups[next(it) % len(lookups)]),
+                                     repeat=args.micro_repeat)
+
+        install_fakes(client, store, lexical=lexical, chunks=chunks)
+        it_q = iter(range(10 ** 9))
+        out["retrieve_top_k"] = measure(
+            lambda: retrieve_top_k(questions[next(it_q) % len(questions)], use_cache=False), repeat=args.queries
+        )
+        install_fakes(client, store, lexical=lexical)
+        chunks.close()
+    return out
+
+
+def bench_quantized(vectors, ids, metadata, query_vecs, exact_store, args, k: int = 12) -> Dict[str, Any]:
+    """Query latency, index size and recall@k against the exact float32 search per quantization mode."""
+    truth = [{m["id"] for m in r["matches"]} for r in exact_store.query_many(query_vecs, top_k=k)]
+    out: Dict[str, Any] = {}
+    for mode in ("float16", "int8"):
+        store = FakeVectorStore(quantization=mode)
+        store.load_arrays(ids, vectors, metadata)
+        t0 = time.perf_counter()
+        store.query(query_vecs[0], top_k=k)  # quantizes the matrix
+        quantize_sec = time.perf_counter() - t0
+        for rescore in (0, 4):
+            store.rescore = rescore
+            res = store.query_many(query_vecs, top_k=k)
+            recall = sum(len({m["id"] for m in r["matches"]} & t) / k for r, t in zip(res, truth)) / len(truth)
+            it = iter(range(10 ** 9))
+            out[f"{mode}_rescore{rescore}"] = {
+                f"recall@{k}": round(recall, 4),
+                "index_mb": round((store._codes.nbytes + (store._scales.nbytes if store._scales is not None else 0))
+                                  / 2 ** 20, 2),
+                "quantize_sec": round(quantize_sec, 3),
+                **measure(lambda: store.query(query_vecs[next(it) % len(query_vecs)], top_k=k), repeat=args.queries),
+            }
+        del store
+    return out
+
+
+def bench_ivf(vectors, ids, metadata, query_vecs, exact_store, args, k: int = 12) -> Dict[str, Any]:
+    """IVF training time, then recall@k against exact search and query latency per nprobe."""
+    truth = [{m["id"] for m in r["matches"]} for r in exact_store.query_many(query_vecs, top_k=k)]
+    store = FakeVectorStore(ann="ivf", min_ann_vectors=0)
+    store.load_arrays(ids, vectors, metadata)
+    t0 = time.perf_counter()
+    store.build_ann()
+    out: Dict[str, Any] = {"nlist": store._ivf.nlist, "train_sec": round(time.perf_counter() - t0, 3)}
+    for nprobe in (1, 4, 16, 64):
+        store.nprobe = nprobe
+        res = store.query_many(query_vecs, top_k=k)
+        recall = sum(len({m["id"] for m in r["matches"]} & t) / k for r, t in zip(res, truth)) / len(truth)
+        it = iter(range(10 ** 9))
+        out[f"nprobe_{nprobe}"] = {
+            f"recall@{k}": round(recall, 4),
+            **measure(lambda: store.query(query_vecs[next(it) % len(query_vecs)], top_k=k), repeat=args.queries),
+        }
+    return out
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """p50 ratios (current / baseline) for every benchmark present in both runs."""
+    lines = []
+
+    def walk(cur, base, path):
+        for key, value in cur.items():
+            if key not in base:
+                continue
+            if isinstance(value, dict) and "p50_ms" in value and "p50_ms" in base[key]:
+                ratio = value["p50_ms"] / base[key]["p50_ms"] if base[key]["p50_ms"] else float("inf")
+                lines.append(f"{path + key:<45} p50 {base[key]['p50_ms']:>10.3f} -> {value['p50_ms']:>10.3f} ms  x{ratio:.2f}")
+            elif isinstance(value, dict) and isinstance(base[key], dict):
+                walk(value, base[key], f"{path}{key}.")
+
+    walk(current["results"], baseline.get("results", {}), "")
+    return lines
+
+
+def main(args) -> Dict[str, Any]:
+    space = TopicSpace(dims=args.dims, seed=args.seed)
+    client = FakeOpenAI(
+        space,
+        embed_latency=Latency(args.embed_latency, args.jitter, seed=args.seed),
+        chat_latency=Latency(args.chat_latency, args.jitter, seed=args.seed + 1),
+    )
+
+    report: Dict[str, Any] = {
+        "revision": git_revision(),
+        "run_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "results": {},
+    }
+
+    print("micro ...", flush=True)
+    report["results"]["micro"] = bench_micro(args)
+    for n in args.sizes:
+        print(f"corpus {n} chunks ...", flush=True)
+        report["results"][f"corpus_{n}"] = bench_size(n, space, client, args)
+
+    out_path = Path(args.out) if args.out else RESULTS_DIR / f"{report['revision']}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report["results"], indent=2))
+    print(f"\nSaved: {out_path}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"\n=== vs {baseline.get('revision')} ({args.compare}) ===")
+        print("\n".join(compare(report, baseline)))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with fake OpenAI/Pinecone backends.")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",") if x],
+                        default=[10_000, 100_000], help="Comma-separated corpus sizes in chunks")
+    parser.add_argument("--dims", type=int, default=256,
+                        help="Embedding dims (1536 matches production; 1M x 1536 needs ~6 GB)")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per corpus benchmark")
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads for the concurrent Q&A run")
+    parser.add_argument("--pages", type=int, default=2000, help="Pages for the chunking benchmark")
+    parser.add_argument("--kb", default="data/knowledge_base", help="PDFs copied into the loader benchmark")
+    parser.add_argument("--kb-files", type=int, default=200, help=".txt files for the loader benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="PDF extraction processes for the loader benchmark")
+    parser.add_argument("--micro-repeat", type=int, default=2000, help="Repetitions for micro benchmarks")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per fake embeddings call")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Seconds per fake chat call")
+    parser.add_argument("--store-latency", type=float, default=0.0, help="Seconds per vector query")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform extra latency (0..jitter) per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Output JSON path")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare p50s against")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args(sys.argv[1:]))
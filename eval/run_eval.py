@@ -1,12 +1,31 @@
+import argparse
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from rag.clients import health_check
+from rag.vector_store import VECTOR_BACKEND
 from rag.retriever import retrieve_top_k
-from rag.citations import build_context_with_citations, citations_to_ui_lines
+from rag.citations import citations_to_ui_lines
 from app.prompts import SYSTEM_BASE, qa_prompt
 from app.generate import generate_text
-from app.guards import enforce_disclaimer
+from app.context import pack_prompt
+from app.guards import enforce_disclaimer, validate_retrieval_results
+
+EVAL_PATH = Path("eval/eval_set.json")
+OUT_PATH = Path("eval/results.json")
+CHECKPOINT_PATH = Path("eval/checkpoint.jsonl")
+
+# Retrieval settings (keep consistent with app defaults)
+TOP_K = 12
+MIN_SCORE = 0.50
+FINAL_TOP_K = 6
+# Evidence chunks a prompt needs, as in the app's Q&A tab
+MIN_RESULTS = 2
+
+STAGES = ["embedding", "vector_query", "lexical", "ranking", "generation", "total"]
 
 
 def has_citation_markers(text: str) -> bool:
@@ -19,11 +38,124 @@ def has_citation_markers(text: str) -> bool:
     return False
 
 
-def main():
-    eval_path = Path("eval/eval_set.json")
-    out_path = Path("eval/results.json")
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile (pct in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def evaluate_query(q: dict) -> dict:
+    """
+    Retrieve + generate for one eval query, timing each stage.
+    The retrieval cache is bypassed so every query measures the real pipeline.
+    """
+    qid = q["id"]
+    qtype = q.get("type")
+    question = q["question"]
+
+    stages = {"embedding": 0.0, "vector_query": 0.0, "lexical": 0.0, "ranking": 0.0, "generation": 0.0}
+    t0 = time.time()
+
+    # Retrieve evidence
+    retrieved = retrieve_top_k(
+        question, top_k=TOP_K, min_score=MIN_SCORE, final_top_k=FINAL_TOP_K,
+        use_cache=False, timings=stages,
+    )
+
+    # The app's gate: enough evidence retrieved, and still enough after packing the
+    # prompt. Otherwise do NOT generate and do NOT cite (more defensible)
+    citations = []
+    ok, refusal = validate_retrieval_results(retrieved, min_results=MIN_RESULTS)
+    if ok:
+        user_prompt, _, citations, _ = pack_prompt(
+            lambda ctx: qa_prompt(question, report_text="", evidence_context=ctx), retrieved
+        )
+        ok, refusal = validate_retrieval_results(citations, min_results=MIN_RESULTS)
+    if not ok:
+        latency = round(time.time() - t0, 3)
+        stages["total"] = latency
+        return {"id": qid, "type": qtype, "question": question, "latency_sec": latency,
+                "stages": {k: round(v, 4) for k, v in stages.items()},
+                "retrieved_chunks_count": len(retrieved), "evidence_chunks_used": len(citations),
+                "refused": True, "citations_present": False, "citations_ui": [],
+                "top_sources": [], "answer": enforce_disclaimer(refusal)}
+
+    # Generate answer using Q&A prompt, evidence packed into the prompt token budget
+    tg = time.time()
+    answer = generate_text(SYSTEM_BASE, user_prompt, cache_question=question)
+    stages["generation"] = time.time() - tg
+    answer = enforce_disclaimer(answer)
+
+    latency = round(time.time() - t0, 3)
+    stages["total"] = latency
+
+    return {
+        "id": qid,
+        "type": qtype,
+        "question": question,
+        "latency_sec": latency,
+        "stages": {k: round(v, 4) for k, v in stages.items()},
+        "retrieved_chunks_count": len(retrieved),
+        "evidence_chunks_used": len(citations),
+        "refused": False,
+        "citations_present": has_citation_markers(answer),
+        "citations_ui": citations_to_ui_lines(citations),
+        "top_sources": [
+            {"source": c.source, "page": c.page, "score": round(c.score, 4)} for c in citations
+        ],
+        "answer": answer
+    }
+
+
+def load_checkpoint(path: Path) -> dict:
+    """Completed items from a previous run, by query id. Torn trailing lines are ignored."""
+    done = {}
+    if not path.exists():
+        return done
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        done[item["id"]] = item
+    return done
+
+
+def latency_breakdown(items: list[dict]) -> dict:
+    """p50/p90/p99/max per stage across answered items."""
+    breakdown = {}
+    for stage in STAGES:
+        values = [it["stages"][stage] for it in items if "stages" in it]
+        breakdown[stage] = {
+            "p50": round(percentile(values, 50), 3),
+            "p90": round(percentile(values, 90), 3),
+            "p99": round(percentile(values, 99), 3),
+            "max": round(max(values, default=0.0), 3),
+        }
+    return breakdown
+
+
+def slowest_queries(items: list[dict], n: int = 3) -> list[dict]:
+    """Tail queries with the stage that dominated each one."""
+    timed = [it for it in items if "stages" in it]
+    slowest = sorted(timed, key=lambda it: it["latency_sec"], reverse=True)[:n]
+    out = []
+    for it in slowest:
+        parts = {k: v for k, v in it["stages"].items() if k != "total"}
+        out.append({
+            "id": it["id"],
+            "latency_sec": it["latency_sec"],
+            "dominant_stage": max(parts, key=parts.get),
+            "stages": it["stages"],
+        })
+    return out
+
 
-    data = json.loads(eval_path.read_text(encoding="utf-8"))
+def main(workers: int = 4, resume: bool = False, checkpoint_path: Path = CHECKPOINT_PATH):
+    data = json.loads(EVAL_PATH.read_text(encoding="utf-8"))
     queries = data["queries"]
 
     results = {
@@ -35,81 +167,75 @@ def main():
         "summary": {}
     }
 
-    total_latency = 0.0
-    citations_yes = 0
-    evidence_yes = 0
-    evidence_and_cited = 0
-
-    # Retrieval settings (keep consistent with app defaults)
-    TOP_K = 12
-    MIN_SCORE = 0.50
-    FINAL_TOP_K = 6
-
-    for q in queries:
-        qid = q["id"]
-        qtype = q.get("type")
-        question = q["question"]
-
-        t0 = time.time()
-
-        # Retrieve evidence
-        retrieved = retrieve_top_k(question, top_k=TOP_K, min_score=MIN_SCORE, final_top_k=FINAL_TOP_K)
-        
-        # If no evidence, do NOT generate and do NOT cite (more defensible)
-        if len(retrieved) == 0:
-            latency = round(time.time() - t0, 3)
-            total_latency += latency
-
-            item = {"id": qid, "type": qtype, "question": question, "latency_sec": latency,
-                    "retrieved_chunks_count": 0, "citations_present": False, "citations_ui": [],
-                    "top_sources": [], "answer": "I don't know based on the provided sources."}
-            results["items"].append(item)
-            print(f"{qid}: latency={latency}s, chunks=0, citations=False (no evidence)")
-            continue
+    # Warm the shared clients' connection pools so the first query isn't penalized
+    results["health"] = health_check(check_pinecone=VECTOR_BACKEND == "pinecone")
+    print(f"Health: {results['health']}")
 
-        evidence_yes += 1
-        
-        # Build citation context
-        context_block, citations = build_context_with_citations(retrieved)
-
-        # Generate answer using Q&A prompt (uses evidence context + citations)
-        user_prompt = qa_prompt(question, report_text="", evidence_context=context_block)
-        answer = generate_text(SYSTEM_BASE, user_prompt)
-        answer = enforce_disclaimer(answer)
-
-        t1 = time.time()
-        latency = round(t1 - t0, 3)
-        total_latency += latency
-
-        cite_ok = has_citation_markers(answer)
-        if cite_ok:
-            citations_yes += 1
-            evidence_and_cited += 1
-
-        item = {
-            "id": qid,
-            "type": qtype,
-            "question": question,
-            "latency_sec": latency,
-            "retrieved_chunks_count": len(retrieved),
-            "citations_present": cite_ok,
-            "citations_ui": citations_to_ui_lines(citations),
-            "top_sources": [
-                {"source": c.source, "page": c.page, "score": round(c.score, 4)} for c in citations
-            ],
-            "answer": answer
-        }
+    done = load_checkpoint(checkpoint_path) if resume else {}
+    if not resume:
+        checkpoint_path.unlink(missing_ok=True)
+    todo = [q for q in queries if q["id"] not in done]
+    if done:
+        print(f"Resuming: {len(done)} done, {len(todo)} remaining")
+
+    # Each finished item is appended (and flushed) as one JSON line, so an
+    # interrupted run loses at most the queries that were still in flight
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    ckpt_lock = threading.Lock()
+    failed = {}
+    wall0 = time.time()
+
+    with checkpoint_path.open("a", encoding="utf-8") as ckpt, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(evaluate_query, q): q for q in todo}
+        for fut in as_completed(futures):
+            qid = futures[fut]["id"]
+            try:
+                item = fut.result()
+            except Exception as e:
+                # Not checkpointed: --resume retries it
+                failed[qid] = f"{type(e).__name__}: {e}"
+                print(f"{qid}: FAILED ({failed[qid]})")
+                continue
+
+            with ckpt_lock:
+                ckpt.write(json.dumps(item) + "\n")
+                ckpt.flush()
+            done[qid] = item
+            print(f"{qid}: latency={item['latency_sec']}s, chunks={item['retrieved_chunks_count']}, "
+                  f"refused={item.get('refused', False)}, "
+                  f"citations={item['citations_present']}")
+
+    wall = time.time() - wall0
+
+    # Keep eval-set order regardless of completion order
+    items = [done[q["id"]] for q in queries if q["id"] in done]
+    items += [{"id": q["id"], "type": q.get("type"), "question": q["question"], "error": failed[q["id"]]}
+              for q in queries if q["id"] in failed]
+    results["items"] = items
 
-        results["items"].append(item)
-        print(f"{qid}: latency={latency}s, chunks={len(retrieved)}, citations={cite_ok}")
+    answered = [it for it in items if "error" not in it]
+    latencies = [it["latency_sec"] for it in answered]
+    # Checkpoints from before the refused flag refused only on zero retrieved chunks
+    evidence_yes = sum(1 for it in answered if not it.get("refused", it["retrieved_chunks_count"] == 0))
+    citations_yes = sum(1 for it in answered if it["citations_present"])
 
     n = len(queries)
-    avg_latency = round(total_latency / max(n, 1), 3)
+    avg_latency = round(sum(latencies) / max(len(latencies), 1), 3)
     citation_coverage = round(citations_yes / max(n, 1), 3)
     evidence_rate = round(evidence_yes / max(n, 1), 3)
-    citation_when_evidence = round(evidence_and_cited / max(evidence_yes, 1), 3)
+    citation_when_evidence = round(citations_yes / max(evidence_yes, 1), 3)
     results["summary"] = {
         "avg_latency_sec": avg_latency,
+        "p50_latency_sec": percentile(latencies, 50),
+        "p90_latency_sec": percentile(latencies, 90),
+        "p95_latency_sec": percentile(latencies, 95),
+        "p99_latency_sec": percentile(latencies, 99),
+        "latency_by_stage_sec": latency_breakdown(answered),
+        "slowest_queries": slowest_queries(answered),
+        "wall_clock_sec": round(wall, 3),
+        "workers": workers,
+        "failed": len(failed),
         "citation_coverage": citation_coverage,
         "evidence_rate": evidence_rate,
         "citation_coverage_given_evidence": citation_when_evidence,
@@ -117,19 +243,32 @@ def main():
             "top_k": TOP_K,
             "min_score": MIN_SCORE,
             "final_top_k": FINAL_TOP_K,
+            "min_results": MIN_RESULTS,
         },
         "notes": (
             "citation_coverage detects [1]..[10] markers in answers. "
-            "If retrieval returns 0 chunks, the script returns an 'I don't know' answer without citations."
+            "As in the app, a query whose retrieved or packed evidence is under min_results chunks is refused "
+            "(no generation, no citations); evidence_rate is the share not refused. "
+            "Per-query latencies are measured under concurrency; wall_clock_sec covers this run only."
         ),
     }
 
-    out_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    OUT_PATH.write_text(json.dumps(results, indent=2), encoding="utf-8")
 
     print("\n=== SUMMARY ===")
     print(json.dumps(results["summary"], indent=2))
-    print(f"\nSaved: {out_path}")
+    print(f"\nSaved: {OUT_PATH}")
+    if failed:
+        print(f"{len(failed)} queries failed; rerun with --resume to retry them.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the evaluation set.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Queries evaluated concurrently (1 = serial)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip queries already recorded in the checkpoint")
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH,
+                        help="Per-query JSONL checkpoint")
+    args = parser.parse_args()
+    main(workers=args.workers, resume=args.resume, checkpoint_path=args.checkpoint)
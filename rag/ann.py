@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import math
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Rows scored against the centroids at a time while assigning (~16 MB of scores)
+_ASSIGN_BYTES = 1 << 24
+
+
+def default_nlist(n: int) -> int:
+    """Inverted lists for n vectors: ~4 * sqrt(n), so each list holds ~sqrt(n) / 4 rows."""
+    return max(1, min(n, int(4 * math.sqrt(n))))
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over the rows of the local vector matrix.
+
+    Spherical k-means centroids partition the (L2-normalized) rows into
+    nlist lists; a query scores the centroids, then only the rows of its
+    nprobe best lists. The index stores one list id per row:
+
+      ivf_centroids.npy   float32 (nlist, dims)
+      ivf_assign.npy      int32 list id per matrix row
+
+    and derives the CSR layout (offsets + rows grouped by list, each list
+    in row order) in memory, like the BM25 postings. Inserts assign new
+    rows to their nearest centroid without retraining. Instances are never
+    modified: update() and keep() return a new index, so a query holding
+    the old one is unaffected.
+    """
+
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGN_FILE = "ivf_assign.npy"
+
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assign = np.ascontiguousarray(assign, dtype=np.int32)
+        self._index_lists()
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def __len__(self) -> int:
+        return int(self.assign.shape[0])
+
+    def _index_lists(self) -> None:
+        self.rows = np.argsort(self.assign, kind="stable").astype(np.int32)
+        self.offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.assign, minlength=self.nlist), out=self.offsets[1:])
+
+    @classmethod
+    def train(
+        cls,
+        matrix: np.ndarray,
+        nlist: int = 0,
+        iterations: int = 8,
+        sample: int = 32,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        k-means on at most sample * nlist rows (nlist 0 = default_nlist),
+        then assign every row. Centroids are re-normalized each iteration,
+        so cosine (dot product) is the distance throughout; empty lists
+        are re-seeded from random rows.
+        """
+        n = matrix.shape[0]
+        nlist = min(n, nlist or default_nlist(n))
+        rng = np.random.default_rng(seed)
+        pick = np.sort(rng.choice(n, size=min(n, sample * nlist), replace=False))
+        train = np.asarray(matrix[pick], dtype=np.float32)
+
+        centroids = train[rng.choice(train.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = _nearest(train, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+            # Per-list sums via one sort + reduceat (np.add.at is far slower)
+            order = np.argsort(labels, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(train[order], starts[~empty], axis=0)
+            if empty.any():
+                sums[empty] = train[rng.choice(train.shape[0], size=int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+
+        return cls(centroids, _nearest(matrix, centroids))
+
+    def update(self, positions: np.ndarray, vectors: np.ndarray) -> "IVFIndex":
+        """Index with the rows at positions (new rows extend the matrix) assigned to their nearest list."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size == 0:
+            return self
+        assign = np.zeros(max(len(self), int(positions.max()) + 1), dtype=np.int32)
+        assign[:len(self)] = self.assign
+        assign[positions] = _nearest(vectors, self.centroids)
+        return IVFIndex(self.centroids, assign)
+
+    def keep(self, mask: np.ndarray) -> "IVFIndex":
+        """Index without the rows where mask is False (mirrors a delete on the matrix)."""
+        return IVFIndex(self.centroids, self.assign[mask])
+
+    def probe(self, q: np.ndarray, nprobe: int) -> list[np.ndarray]:
+        """Sorted candidate row ids from the nprobe nearest lists, per query row."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = q @ self.centroids.T
+        if nprobe < self.nlist:
+            lists = np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            lists = np.broadcast_to(np.arange(self.nlist), scores.shape)
+        return [
+            np.sort(np.concatenate([self.rows[self.offsets[j]:self.offsets[j + 1]] for j in row]))
+            for row in lists
+        ]
+
+    def needs_retrain(self, n: int) -> bool:
+        """True once the corpus has grown enough that lists are ~4x their trained size."""
+        return default_nlist(n) >= 2 * self.nlist
+
+    def save(self, index_dir: str | Path) -> None:
+        index_dir = Path(index_dir)
+        for name, arr in ((self.CENTROIDS_FILE, self.centroids), (self.ASSIGN_FILE, self.assign)):
+            path = index_dir / name
+            tmp = path.with_suffix(".npy.tmp")
+            with tmp.open("wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, index_dir: str | Path, n: int, dims: int, newer_than: float = 0.0) -> Optional["IVFIndex"]:
+        """
+        The saved index if it covers exactly n rows of dims and was written
+        after newer_than (the vectors file mtime); None otherwise.
+        """
+        index_dir = Path(index_dir)
+        paths = [index_dir / cls.CENTROIDS_FILE, index_dir / cls.ASSIGN_FILE]
+        if not all(p.exists() for p in paths) or min(p.stat().st_mtime for p in paths) < newer_than:
+            return None
+        centroids, assign = (np.load(p) for p in paths)
+        if assign.shape[0] != n or centroids.shape[1] != dims:
+            return None
+        return cls(centroids, assign)
+
+
+def _nearest(mat: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the highest-dot-product centroid for each row, in blocks of rows."""
+    n = mat.shape[0]
+    out = np.empty(n, dtype=np.int32)
+    rows = max(1, _ASSIGN_BYTES // max(centroids.shape[0] * 4, 1))
+    for lo in range(0, n, rows):
+        out[lo:lo + rows] = np.argmax(np.asarray(mat[lo:lo + rows], dtype=np.float32) @ centroids.T, axis=1)
+    return out
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from rag.chunk_store import ChunkStore
+from rag.metadata_filter import MetadataIndex
+from rag.vector_store import LOCAL_INDEX_DIR
+
+# Words that carry no signal in radiology questions ("what does X mean in my report")
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been being but by can could did do does
+for from had has have how i if in into is it its may me mean means meaning might my no
+not of on or our should so such than that the their them then there these they this
+those to was we were what when where which while who why will with would you your
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased terms minus stopwords. Hyphenated terms are kept whole and
+    also split, so "ground-glass" matches both "ground-glass" and "ground glass".
+    """
+    out = []
+    for tok in _TOKEN.findall(text.lower()):
+        if "-" in tok:
+            out.append(tok)
+            out.extend(p for p in tok.split("-") if p not in STOPWORDS)
+        elif tok not in STOPWORDS:
+            out.append(tok)
+    return out
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the KB chunks, stored as a compact inverted index next to
+    the local vector files:
+
+      bm25_terms.json     sorted vocabulary
+      bm25_offsets.npy    int64, postings range per term
+      bm25_postings.npy   int32 doc positions, grouped by term
+      bm25_weights.npy    float32 BM25 term weight, parallel to postings
+      bm25_docs.jsonl     {"id", "metadata"} per doc (text only if store_text)
+
+    The tf and length-normalisation part of BM25 is precomputed per posting
+    at build time, so a query is one gather-add per term scaled by its IDF.
+    Arrays are memory-mapped; a query touches only its terms' postings.
+    """
+
+    TERMS_FILE = "bm25_terms.json"
+    DOCS_FILE = "bm25_docs.jsonl"
+    ARRAYS = ("offsets", "postings", "weights")
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.terms: List[str] = []
+        self._term_pos: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self._meta_index: Optional[MetadataIndex] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        docs: Iterable[Tuple[str, Dict[str, Any]]],
+        store_text: bool = True,
+        **kwargs,
+    ) -> "BM25Index":
+        """
+        docs: (id, metadata) pairs; metadata["text"] is indexed. With
+        store_text=False the text is dropped from the kept metadata (hits
+        are then hydrated from the chunk store).
+        """
+        index = cls(**kwargs)
+        per_term: Dict[str, List[Tuple[int, int]]] = {}
+        doc_len = []
+        for pos, (vid, meta) in enumerate(docs):
+            index.ids.append(vid)
+            index.metadata.append(meta if store_text else {k: v for k, v in meta.items() if k != "text"})
+            counts = Counter(tokenize(meta.get("text", "")))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                per_term.setdefault(term, []).append((pos, tf))
+
+        index.terms = sorted(per_term)
+        sizes = [len(per_term[t]) for t in index.terms]
+        index.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=index.offsets[1:])
+        flat = [p for t in index.terms for p in per_term[t]]
+        index.postings = np.fromiter((p for p, _ in flat), dtype=np.int32, count=len(flat))
+        tf = np.fromiter((tf for _, tf in flat), dtype=np.float32, count=len(flat))
+
+        lengths = np.asarray(doc_len, dtype=np.float32)
+        avgdl = float(lengths.mean()) if lengths.size else 1.0
+        norm = index.k1 * (1 - index.b + index.b * lengths / max(avgdl, 1e-9))
+        index.weights = (tf * (index.k1 + 1) / (tf + norm[index.postings])).astype(np.float32)
+        index._finish()
+        return index
+
+    def _finish(self) -> None:
+        self._term_pos = {t: i for i, t in enumerate(self.terms)}
+        self._meta_index = MetadataIndex(self.metadata)
+
+    def save(self, index_dir: str | Path = LOCAL_INDEX_DIR) -> None:
+        """Write every file via tmp + os.replace; the docs file goes last (it is the load marker)."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+
+        for name in self.ARRAYS:
+            path = index_dir / f"bm25_{name}.npy"
+            tmp = path.with_suffix(".npy.tmp")
+            with tmp.open("wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(tmp, path)
+
+        terms = index_dir / self.TERMS_FILE
+        tmp = terms.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.terms), encoding="utf-8")
+        os.replace(tmp, terms)
+
+        docs = index_dir / self.DOCS_FILE
+        tmp = docs.with_suffix(".jsonl.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for vid, meta in zip(self.ids, self.metadata):
+                f.write(json.dumps({"id": vid, "metadata": meta}) + "\n")
+        os.replace(tmp, docs)
+
+    @classmethod
+    def load(cls, index_dir: str | Path = LOCAL_INDEX_DIR, **kwargs) -> Optional["BM25Index"]:
+        """The saved index, or None if it was never built."""
+        index_dir = Path(index_dir)
+        docs = index_dir / cls.DOCS_FILE
+        if not docs.exists():
+            return None
+
+        index = cls(**kwargs)
+        for name in cls.ARRAYS:
+            setattr(index, name, np.load(index_dir / f"bm25_{name}.npy", mmap_mode="r"))
+        index.terms = json.loads((index_dir / cls.TERMS_FILE).read_text(encoding="utf-8"))
+        with docs.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                index.ids.append(row["id"])
+                index.metadata.append(row.get("metadata", {}))
+
+        if (len(index.terms) + 1 != index.offsets.shape[0]
+                or int(index.offsets[-1]) != index.postings.shape[0]
+                or index.postings.shape[0] != index.weights.shape[0]):
+            raise ValueError(f"BM25 index is inconsistent in {index_dir}; rebuild with --full")
+        index._finish()
+        return index
+
+    def _idf(self, df: int) -> float:
+        n = len(self.ids)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def idf(self, term: str) -> float:
+        """BM25 IDF of term (unseen terms get the maximum)."""
+        j = self._term_pos.get(term)
+        return self._idf(0 if j is None else int(self.offsets[j + 1] - self.offsets[j]))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        min_coverage: float = 0.0,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k docs by BM25, as {"id", "score", "coverage", "metadata"}.
+        coverage is the IDF-weighted share of query terms the doc contains
+        (0..1); docs below min_coverage are dropped, as are docs not
+        matching the metadata filter (applied before top-k selection).
+        """
+        n = len(self.ids)
+        terms = list(dict.fromkeys(tokenize(query)))
+        if n == 0 or top_k <= 0 or not terms:
+            return []
+
+        scores = np.zeros(n, dtype=np.float32)
+        matched = np.zeros(n, dtype=np.float32)
+        total_idf = 0.0
+        for term in terms:
+            j = self._term_pos.get(term)
+            if j is None:
+                total_idf += self._idf(0)  # unseen terms still count against coverage
+                continue
+            lo, hi = int(self.offsets[j]), int(self.offsets[j + 1])
+            docs = self.postings[lo:hi]
+            idf = self._idf(hi - lo)
+            total_idf += idf
+            # Postings hold each doc once per term, so fancy-index += is safe
+            scores[docs] += idf * self.weights[lo:hi]
+            matched[docs] += idf
+
+        coverage = matched / total_idf
+        keep = (scores > 0) & (coverage >= min_coverage)
+        if filter:
+            keep &= self._meta_index.mask(filter)
+        candidates = np.flatnonzero(keep)
+        if candidates.size == 0:
+            return []
+        if candidates.size > top_k:
+            part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[part]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [
+            {
+                "id": self.ids[i],
+                "score": float(scores[i]),
+                "coverage": float(coverage[i]),
+                "metadata": dict(self.metadata[i]),
+            }
+            for i in candidates
+        ]
+
+
+def build_bm25_from_chunks(chunks: ChunkStore, index_dir: str | Path = LOCAL_INDEX_DIR) -> BM25Index:
+    """
+    Rebuild used by build_pinecone_index: index every chunk in the (already
+    updated) chunk store and save. The saved docs carry no text.
+    """
+    docs = ((vid, {**rec["metadata"], "text": rec["text"]}) for vid, rec in chunks.items())
+    index = BM25Index.build(docs, store_text=False)
+    index.save(index_dir)
+    return index
+
+
+_loaded: Dict[Path, Tuple[float, Optional[BM25Index]]] = {}
+_load_lock = threading.Lock()
+# Indexes set in-process (benchmarks), bypassing the files: index_dir -> index or None
+_PINNED: Dict[Path, Optional[BM25Index]] = {}
+
+
+def get_bm25_index(index_dir: str | Path = LOCAL_INDEX_DIR) -> Optional[BM25Index]:
+    """
+    Process-wide index for index_dir (None if not built). Reloaded only when
+    the docs file's mtime changes, so this is cheap to call on every query.
+    """
+    if Path(index_dir) in _PINNED:
+        return _PINNED[Path(index_dir)]
+
+    path = Path(index_dir) / BM25Index.DOCS_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    with _load_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, BM25Index.load(index_dir))
+            _loaded[path] = cached
+        return cached[1]
@@ -1,15 +1,115 @@
-from rag.loaders import load_knowledge_base
-from rag.chunking import chunk_documents
-from rag.pinecone_upsert import upsert_chunks
+import argparse
+import os
+from pathlib import Path
 
-def main():
-    docs = load_knowledge_base("data/knowledge_base")
-    chunks = chunk_documents(docs, chunk_size=1000, overlap=150)
+from rag.loaders import list_knowledge_base_files, iter_knowledge_base_files, format_load_timings
+from rag.chunking import CHUNK_TARGET_TOKENS, CHUNK_OVERLAP_TOKENS, iter_chunk_documents
+from rag.pinecone_upsert import get_store, _make_id
+from rag.bm25 import BM25Index, build_bm25_from_chunks
+from rag.chunk_store import ChunkStore, update_chunk_store
+from rag.ingest import stream_ingest
+from rag.embeddings import embedding_cache_stats
+from rag.manifest import IndexManifest, manifest_path, plan_rebuild, text_sha256
+from rag.vector_store import LOCAL_INDEX_DIR, VECTOR_BACKEND
 
-    print(f"Pages loaded: {len(docs)}")
-    print(f"Chunks created: {len(chunks)}")
+KB_FOLDER = "data/knowledge_base"
+CHUNK_TARGET = CHUNK_TARGET_TOKENS
+OVERLAP = CHUNK_OVERLAP_TOKENS
 
-    upsert_chunks(chunks, batch_size=64)
+def main(backend: str | None = None, full: bool = False, workers: int = 1):
+    backend = (backend or VECTOR_BACKEND).lower()
+    store = get_store(backend)
+
+    manifest = IndexManifest.load(manifest_path(backend))
+    settings = {"chunker": "sentence", "target_tokens": CHUNK_TARGET, "overlap_tokens": OVERLAP}
+
+    files = list_knowledge_base_files(KB_FOLDER)
+    # Without a BM25 index or chunk store every file is reparsed to fill them;
+    # unchanged chunks still skip embedding
+    local_missing = not all((Path(LOCAL_INDEX_DIR) / name).exists()
+                            for name in (BM25Index.DOCS_FILE, ChunkStore.META_FILE))
+    plan = plan_rebuild(files, manifest, settings, full=full or local_missing)
+
+    print(f"KB files: {len(files)} ({len(plan.changed)} changed, "
+          f"{len(plan.unchanged)} unchanged, {len(plan.removed)} removed)")
+
+    # New per-file chunk maps for the files we reparse, filled while streaming
+    new_entries = {f.name: {} for f in plan.changed}
+    old_entries = {name: manifest.chunk_hashes(name) for name in new_entries}
+    # Chunk text store: unchanged files' chunks are copied now, reparsed chunks
+    # are appended as they stream past (only ids and offsets stay in memory)
+    chunk_writer = update_chunk_store(manifest.all_ids([f.name for f in plan.unchanged]))
+    counts = {"pages": 0, "chunks": 0}
+    timings = {}
+
+    def pages():
+        for doc in iter_knowledge_base_files(plan.changed, workers=workers, timings=timings):
+            counts["pages"] += 1
+            yield doc
+
+    def changed_chunks():
+        for c in iter_chunk_documents(pages(), target_tokens=CHUNK_TARGET, overlap_tokens=OVERLAP):
+            counts["chunks"] += 1
+            vec_id = _make_id(c.metadata)
+            h = text_sha256(c.text)
+            source = c.metadata["source"]
+            new_entries[source][vec_id] = h
+            chunk_writer.add(vec_id, c.text, c.metadata)
+            if full or old_entries[source].get(vec_id) != h:
+                yield c
+
+    try:
+        stats = stream_ingest(changed_chunks(), store=store, batch_size=64)
+    except BaseException:
+        chunk_writer.abort()
+        raise
+
+    print(f"Pages loaded: {counts['pages']}")
+    print(f"Chunks created: {counts['chunks']} ({stats.chunks} new or changed, upserted)")
+    for line in format_load_timings(timings):
+        print(f"  {line}")
+    print(f"Stages: parse {stats.parse_seconds:.2f}s | embed {stats.embed_seconds:.2f}s | "
+          f"upsert {stats.upsert_seconds:.2f}s | wall {stats.wall_seconds:.2f}s")
+
+    stale = manifest.all_ids(plan.removed)
+    for name, entry in new_entries.items():
+        stale.update(set(old_entries[name]) - set(entry))
+
+    if stale:
+        print(f"Deleting {len(stale)} stale vectors...")
+        store.delete(sorted(stale))
+        store.flush()
+
+    chunks = chunk_writer.commit()
+    print(f"Chunk store: {len(chunks)} chunks, {chunks.stored_bytes / 1e6:.2f} MB "
+          f"({chunks.raw_bytes / 1e6:.2f} MB raw, {chunks.codec})")
+
+    # BM25 index for hybrid retrieval: one streaming pass over the new chunk store
+    lexical = build_bm25_from_chunks(chunks)
+    print(f"BM25 index: {len(lexical)} chunks, {len(lexical.terms)} terms")
+
+    cache_stats = embedding_cache_stats()
+    if cache_stats:
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+              f"({cache_stats['entries']} entries)")
+
+    if stale or stats.chunks or plan.removed or manifest.settings != settings:
+        manifest.bump()
+    for name in plan.removed:
+        manifest.files.pop(name, None)
+    for name, entry in new_entries.items():
+        manifest.files[name] = {"sha256": plan.hashes[name], "chunks": entry}
+    manifest.settings = settings
+    manifest.save()
+    print(f"Manifest v{manifest.version} saved: {manifest.path}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build the knowledge-base vector index.")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default=None,
+                        help="Vector backend to write to (default: VECTOR_BACKEND env, else pinecone)")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the manifest and reindex every file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes used for PDF text extraction (1 = sequential)")
+    args = parser.parse_args()
+    main(backend=args.backend, full=args.full, workers=args.workers)
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.vector_store import LOCAL_INDEX_DIR
+
+load_dotenv()
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+# Uncompressed bytes per block: smaller blocks = less to decompress per lookup, worse ratio
+CHUNK_STORE_BLOCK_BYTES = int(os.getenv("CHUNK_STORE_BLOCK_BYTES", "16384"))
+# Decompressed blocks kept in memory (LRU)
+CHUNK_STORE_CACHE_BLOCKS = int(os.getenv("CHUNK_STORE_CACHE_BLOCKS", "256"))
+
+_INDEX_DTYPE = np.dtype([("id", "S20"), ("block", "<u4"), ("offset", "<u4"), ("length", "<u4")])
+
+
+def _id_key(vid: str) -> bytes:
+    """Chunk ids are SHA-1 hex digests (pinecone_upsert._make_id); other ids are hashed to fit."""
+    try:
+        if len(vid) == 40:
+            return bytes.fromhex(vid)
+    except ValueError:
+        pass
+    return hashlib.sha1(vid.encode("utf-8")).digest()
+
+
+def _stored_key(key: np.bytes_) -> bytes:
+    # numpy drops trailing NUL bytes from "S20" values
+    return bytes(key).ljust(20, b"\0")
+
+
+def _compressor(codec: str):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress
+    return lambda data: zlib.compress(data, 6)
+
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Chunk store was written with zstd; install `zstandard` to read it")
+        return zstandard.ZstdDecompressor().decompress
+    return zlib.decompress
+
+
+class ChunkStore:
+    """
+    Chunk text + metadata, kept out of the vector index and looked up by
+    chunk id after ranking:
+
+      chunks.blk          compressed blocks (zstd if installed, else zlib)
+      chunks_blocks.npy   int64 byte offset of each block in chunks.blk
+      chunks_index.npy    (id, block, offset, length) records sorted by the
+                          20-byte SHA-1 id, for binary search
+      chunks_meta.json    codec and counts (written last: the load marker)
+
+    Each record is one JSON object {"text", "metadata"}. The block file and
+    index are memory-mapped; a lookup decompresses straight from the mapped
+    bytes (no read copy) and slices the record out of the decompressed
+    block. Records are written in input order, so chunks of one page share
+    a block and a query's hits often cost one decompression.
+    """
+
+    BLOCKS_FILE = "chunks.blk"
+    OFFSETS_FILE = "chunks_blocks.npy"
+    INDEX_FILE = "chunks_index.npy"
+    META_FILE = "chunks_meta.json"
+
+    def __init__(self, index_dir: str | Path = LOCAL_INDEX_DIR, cache_blocks: int = CHUNK_STORE_CACHE_BLOCKS):
+        self.index_dir = Path(index_dir)
+        meta = json.loads((self.index_dir / self.META_FILE).read_text(encoding="utf-8"))
+        self.codec = meta["codec"]
+        self.raw_bytes = int(meta.get("raw_bytes", 0))
+        self._decompress = _decompressor(self.codec)
+        self.index = np.load(self.index_dir / self.INDEX_FILE, mmap_mode="r")
+        self.block_offsets = np.load(self.index_dir / self.OFFSETS_FILE)
+        self._keys = self.index["id"]
+
+        path = self.index_dir / self.BLOCKS_FILE
+        self._file = path.open("rb")
+        size = path.stat().st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        self.cache_blocks = cache_blocks
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        # chunk_store_reader() blocks using this store; guarded by _load_lock
+        self._readers = 0
+        self._retired = False
+
+    def __len__(self) -> int:
+        return int(self.index.shape[0])
+
+    @property
+    def stored_bytes(self) -> int:
+        return int(self.block_offsets[-1]) if self.block_offsets.size else 0
+
+    def _position(self, vid: str) -> int:
+        key = _id_key(vid)
+        i = int(np.searchsorted(self._keys, key))
+        return i if i < len(self) and _stored_key(self._keys[i]) == key else -1
+
+    def __contains__(self, vid: str) -> bool:
+        return self._position(vid) >= 0
+
+    def _block(self, b: int) -> bytes:
+        with self._lock:
+            data = self._cache.get(b)
+            if data is not None:
+                self._cache.move_to_end(b)
+                return data
+        lo, hi = int(self.block_offsets[b]), int(self.block_offsets[b + 1])
+        data = self._decompress(memoryview(self._mmap)[lo:hi])
+        with self._lock:
+            self._cache[b] = data
+            if len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return data
+
+    def get_many(self, ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """{"text", "metadata"} per id (None if unknown); each block is decompressed at most once."""
+        out: List[Optional[Dict[str, Any]]] = [None] * len(ids)
+        by_block: Dict[int, List[Tuple[int, int, int]]] = {}
+        for j, vid in enumerate(ids):
+            i = self._position(vid) if vid else -1
+            if i >= 0:
+                rec = self.index[i]
+                by_block.setdefault(int(rec["block"]), []).append((j, int(rec["offset"]), int(rec["length"])))
+        for b, wanted in by_block.items():
+            view = memoryview(self._block(b))
+            for j, offset, length in wanted:
+                out[j] = json.loads(bytes(view[offset:offset + length]))
+        return out
+
+    def get(self, vid: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([vid])[0]
+
+    def _payloads(self) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        (20-byte id, encoded record) in file order. Each block is decompressed
+        once, outside the LRU, so a full scan doesn't evict query-time blocks.
+        """
+        current, data = -1, b""
+        for i in np.lexsort((self.index["offset"], self.index["block"])):
+            rec = self.index[i]
+            b, offset = int(rec["block"]), int(rec["offset"])
+            if b != current:
+                lo, hi = int(self.block_offsets[b]), int(self.block_offsets[b + 1])
+                current, data = b, self._decompress(memoryview(self._mmap)[lo:hi])
+            yield _stored_key(rec["id"]), data[offset:offset + int(rec["length"])]
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        (id, record) for every chunk in file order; for rebuilding BM25. Ids
+        come back as the hex of the stored key, i.e. unchanged for SHA-1
+        chunk ids.
+        """
+        for key, payload in self._payloads():
+            yield key.hex(), json.loads(payload)
+
+    def hydrate(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Fill "text" and "metadata" of retrieval results from the store. Results
+        whose id is not stored keep what the index returned (the retriever
+        re-fetches those from the vector store or drops them).
+        """
+        records = self.get_many([r.get("id") or "" for r in results])
+        out = []
+        for r, rec in zip(results, records):
+            if rec is not None:
+                r = dict(r, text=rec["text"], metadata={**rec["metadata"], **(r.get("metadata") or {})})
+            out.append(r)
+        return out
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    @classmethod
+    def write(
+        cls,
+        records: Iterable[Tuple[str, str, Dict[str, Any]]],
+        index_dir: str | Path = LOCAL_INDEX_DIR,
+        block_bytes: int = CHUNK_STORE_BLOCK_BYTES,
+    ) -> "ChunkStore":
+        """
+        Write (id, text, metadata) records as a new store in one pass,
+        replacing any existing one. A repeated id keeps its last record.
+        """
+        writer = ChunkStoreWriter(index_dir, block_bytes=block_bytes)
+        try:
+            for vid, text, meta in records:
+                writer.add(vid, text, meta)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+
+class ChunkStoreWriter:
+    """
+    Streams records into a new chunk store: each block is compressed and
+    appended to a tmp file as soon as it fills, so memory holds one block
+    plus an id -> (block, offset, length) entry per record, never the text.
+    commit() writes the sorted id index and swaps the files in (tmp +
+    os.replace, the meta file last); until then readers see the old store.
+    """
+
+    def __init__(self, index_dir: str | Path = LOCAL_INDEX_DIR, block_bytes: int = CHUNK_STORE_BLOCK_BYTES):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.block_bytes = block_bytes
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self._compress = _compressor(self.codec)
+        self._tmp_blk = self.index_dir / (ChunkStore.BLOCKS_FILE + ".tmp")
+        self._file = self._tmp_blk.open("wb")
+        # A repeated id just points its entry at the newer record
+        self._entries: Dict[bytes, Tuple[int, int, int]] = {}
+        self._offsets = [0]
+        self._block = bytearray()
+        self.raw_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, vid: str, text: str, metadata: Dict[str, Any]) -> None:
+        meta = {k: v for k, v in metadata.items() if k != "text"}
+        self._add_payload(_id_key(vid), json.dumps({"text": text, "metadata": meta}).encode("utf-8"))
+
+    def copy_from(self, store: ChunkStore, keep_ids: Set[str]) -> None:
+        """Append the records of store whose id is in keep_ids, without re-encoding them."""
+        keep = {_id_key(v) for v in keep_ids}
+        for key, payload in store._payloads():
+            if key in keep:
+                self._add_payload(key, payload)
+
+    def _add_payload(self, key: bytes, payload: bytes) -> None:
+        if self._block and len(self._block) + len(payload) > self.block_bytes:
+            self._flush_block()
+        self._entries[key] = (len(self._offsets) - 1, len(self._block), len(payload))
+        self._block += payload
+        self.raw_bytes += len(payload)
+
+    def _flush_block(self) -> None:
+        data = self._compress(bytes(self._block))
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._block.clear()
+
+    def commit(self) -> ChunkStore:
+        if self._block:
+            self._flush_block()
+        self._file.close()
+
+        index = np.fromiter(((key, *entry) for key, entry in self._entries.items()),
+                            dtype=_INDEX_DTYPE, count=len(self._entries))
+        index.sort(order="id")
+        for name, arr in ((ChunkStore.INDEX_FILE, index),
+                          (ChunkStore.OFFSETS_FILE, np.asarray(self._offsets, dtype=np.int64))):
+            path = self.index_dir / name
+            tmp = path.with_suffix(".npy.tmp")
+            with tmp.open("wb") as fh:
+                np.save(fh, arr)
+            os.replace(tmp, path)
+        os.replace(self._tmp_blk, self.index_dir / ChunkStore.BLOCKS_FILE)
+
+        meta_path = self.index_dir / ChunkStore.META_FILE
+        tmp_meta = meta_path.with_suffix(".json.tmp")
+        tmp_meta.write_text(json.dumps({"codec": self.codec, "count": len(index), "raw_bytes": self.raw_bytes}),
+                            encoding="utf-8")
+        os.replace(tmp_meta, meta_path)
+        return ChunkStore(self.index_dir)
+
+    def abort(self) -> None:
+        """Drop the partial store; the existing one is untouched."""
+        self._file.close()
+        self._tmp_blk.unlink(missing_ok=True)
+
+
+def update_chunk_store(
+    keep_ids: Set[str],
+    index_dir: str | Path = LOCAL_INDEX_DIR,
+) -> ChunkStoreWriter:
+    """
+    Incremental rewrite used by build_pinecone_index: a writer already
+    holding the stored chunks whose id is in keep_ids (chunks of unchanged
+    files). add() every chunk of the reparsed files as they stream past,
+    then commit() to swap in the compacted store.
+    """
+    writer = ChunkStoreWriter(index_dir)
+    if (Path(index_dir) / ChunkStore.META_FILE).exists():
+        old = ChunkStore(index_dir)
+        try:
+            writer.copy_from(old, keep_ids)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            old.close()
+    return writer
+
+
+_loaded: Dict[Path, Tuple[float, Optional[ChunkStore]]] = {}
+_load_lock = threading.Lock()
+# Stores set in-process (benchmarks), bypassing the files: index_dir -> store or None
+_PINNED: Dict[Path, Optional[ChunkStore]] = {}
+
+
+def _current(index_dir: str | Path, acquire: bool) -> Optional[ChunkStore]:
+    """The loaded store for index_dir, reloaded on an mtime change; acquire counts a reader."""
+    if Path(index_dir) in _PINNED:
+        return _PINNED[Path(index_dir)]
+
+    path = Path(index_dir) / ChunkStore.META_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    with _load_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            if cached is not None:
+                # Close the replaced store now, or when its last reader exits
+                cached[1]._retired = True
+                if cached[1]._readers == 0:
+                    cached[1].close()
+            cached = (mtime, ChunkStore(index_dir))
+            _loaded[path] = cached
+        if acquire:
+            cached[1]._readers += 1
+        return cached[1]
+
+
+def get_chunk_store(index_dir: str | Path = LOCAL_INDEX_DIR) -> Optional[ChunkStore]:
+    """
+    Process-wide store for index_dir (None if never built). Reopened only
+    when the meta file's mtime changes, so this is cheap to call per query.
+    The store it replaces is closed; reads that may overlap a rebuild
+    should go through chunk_store_reader().
+    """
+    return _current(index_dir, acquire=False)
+
+
+@contextmanager
+def chunk_store_reader(index_dir: str | Path = LOCAL_INDEX_DIR) -> Iterator[Optional[ChunkStore]]:
+    """
+    get_chunk_store(), held open for the block: if a rebuild replaces the
+    store meanwhile, it is closed when the last reader exits, so in-flight
+    queries finish on it and long sessions don't leak one mapping per
+    reindex.
+    """
+    pinned = Path(index_dir) in _PINNED
+    store = _current(index_dir, acquire=True)
+    try:
+        yield store
+    finally:
+        if store is not None and not pinned:
+            with _load_lock:
+                store._readers -= 1
+                if store._retired and store._readers == 0:
+                    store.close()
@@ -1,9 +1,36 @@
 from __future__ import annotations
 
+import os
+import re
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+from dotenv import load_dotenv
 
 from rag.loaders import DocumentChunk
+from rag.tokens import count_tokens
+
+load_dotenv()
+
+# Sentence chunker defaults (~1000 characters); chunks stay under rag.packing.CHUNK_TOKEN_CAP
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+# Candidate boundaries: after sentence punctuation (+ closing quotes/brackets) before
+# a capitalised word or digit, before an upper-case section heading ("IMPRESSION:",
+# "CLINICAL HISTORY:"), or at a blank line.
+_BOUNDARY = re.compile(
+    r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+(?=[\"'(\[]?[A-Z0-9])"
+    r"|\s+(?=(?:[A-Z][A-Z/&-]+ ){0,3}[A-Z][A-Z/&-]+:)"
+    r"|\n\s*\n"
+)
+_HEADING = re.compile(r"(?:[A-Z][A-Z/&-]+ ){0,3}[A-Z][A-Z/&-]+:")
+_ABBREVIATIONS = frozenset({
+    "e.g", "i.e", "etc", "vs", "fig", "figs", "dr", "mr", "mrs", "ms", "st", "no",
+    "approx", "al", "ca", "cf", "ref", "resp", "max", "min",
+})
+
+Span = Tuple[int, int]
 
 
 @dataclass
@@ -19,7 +46,7 @@ def chunk_text(
 ) -> List[str]:
     """
     Simple character-based chunking with overlap.
-    Works well for PDFs and is predictable.
+    Kept for callers that want fixed windows; the index uses chunk_spans.
     """
     if not text:
         return []
@@ -41,33 +68,157 @@ def chunk_text(
     return chunks
 
 
-def chunk_documents(
-    docs: List[DocumentChunk],
-    chunk_size: int = 1000,
-    overlap: int = 150,
-    min_chunk_chars: int = 200,
-) -> List[TextChunk]:
+def _is_abbreviation(text: str, period: int) -> bool:
+    """True if the '.' at text[period] ends an abbreviation or an initial."""
+    start = period
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    word = text[start:period].lstrip("\"'([").lower()
+    return len(word) == 1 or word in _ABBREVIATIONS
+
+
+def _strip_span(text: str, start: int, end: int) -> Span:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int, bool]]:
     """
-    Convert page-level DocumentChunks into smaller TextChunks.
-    Keeps metadata for citations (source + page).
-    Adds chunk_id within a page.
+    (start, end, starts_section) for each sentence of text, in one regex pass.
+    Spans exclude surrounding whitespace; starts_section marks a heading.
     """
-    all_chunks: List[TextChunk] = []
+    spans = []
+    start = 0
+    for m in _BOUNDARY.finditer(text):
+        cut = m.start()
+        # "e.g. Chest", "Dr. Smith", "J. Radiol" are not sentence ends
+        if cut > 0 and text[cut - 1] == "." and _is_abbreviation(text, cut - 1):
+            continue
+        s, e = _strip_span(text, start, cut)
+        if e > s:
+            spans.append((s, e, bool(_HEADING.match(text, s))))
+        start = m.end()
+    s, e = _strip_span(text, start, len(text))
+    if e > s:
+        spans.append((s, e, bool(_HEADING.match(text, s))))
+    return spans
+
+
+def _split_long(text: str, start: int, end: int, tokens: int, max_tokens: int) -> List[Tuple[int, int, int]]:
+    """Split one over-long sentence into word-aligned pieces of ~max_tokens."""
+    per_piece = max(1, (end - start) * max_tokens // max(tokens, 1))
+    pieces = []
+    while start < end:
+        stop = min(start + per_piece, end)
+        if stop < end:
+            space = text.rfind(" ", start + 1, stop)
+            if space > start:
+                stop = space
+        s, e = _strip_span(text, start, stop)
+        if e > s:
+            pieces.append((s, e, count_tokens(text[s:e])))
+        start = stop
+    return pieces
+
+
+def chunk_spans(
+    text: str,
+    target_tokens: int = CHUNK_TARGET_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> List[Span]:
+    """
+    Character spans of sentence-aligned chunks of about target_tokens.
 
+    Sentences are packed greedily; a section heading starts a new chunk once
+    the current one is at least half full. Consecutive chunks in a section
+    share trailing whole sentences worth at most overlap_tokens. A short tail
+    is merged into the previous chunk when the result stays near target.
+    Linear in len(text).
+    """
+    units = []  # (start, end, tokens, starts_section)
+    for s, e, heading in sentence_spans(text):
+        n = count_tokens(text[s:e])
+        if n > target_tokens:
+            units.extend((ps, pe, pn, heading and i == 0)
+                         for i, (ps, pe, pn) in enumerate(_split_long(text, s, e, n, target_tokens)))
+        else:
+            units.append((s, e, n, heading))
+
+    chunks: List[Tuple[int, int, int]] = []  # (first unit, last unit + 1, tokens)
+    first, tokens = 0, 0
+    for i, (_, _, n, heading) in enumerate(units):
+        new_section = heading and tokens >= target_tokens // 2
+        if i > first and (tokens + n > target_tokens or new_section):
+            chunks.append((first, i, tokens))
+            if new_section:
+                first, tokens = i, 0
+            else:
+                # Carry trailing sentences of the finished chunk as overlap
+                first = i
+                carried = 0
+                while (first - 1 > chunks[-1][0] and carried + units[first - 1][2] <= overlap_tokens
+                       and carried + units[first - 1][2] + n <= target_tokens):
+                    first -= 1
+                    carried += units[first][2]
+                tokens = carried
+        tokens += n
+
+    if first < len(units):
+        merged = sum(u[2] for u in units[chunks[-1][0]:]) if chunks else 0
+        if chunks and tokens < target_tokens // 4 and merged <= target_tokens + target_tokens // 4:
+            chunks[-1] = (chunks[-1][0], len(units), merged)
+        else:
+            chunks.append((first, len(units), tokens))
+
+    return [(units[a][0], units[b - 1][1]) for a, b, _ in chunks]
+
+
+def iter_chunk_documents(
+    docs: Iterable[DocumentChunk],
+    target_tokens: int = CHUNK_TARGET_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    min_chunk_chars: int = 200,
+) -> Iterator[TextChunk]:
+    """
+    Streaming version of chunk_documents: consumes pages lazily and yields
+    TextChunks as soon as each page is split.
+    """
     for doc in docs:
-        pieces = chunk_text(doc.text, chunk_size=chunk_size, overlap=overlap)
+        spans = chunk_spans(doc.text, target_tokens=target_tokens, overlap_tokens=overlap_tokens)
 
-        for idx, piece in enumerate(pieces):
-            if len(piece) < min_chunk_chars:
+        for idx, (start, end) in enumerate(spans):
+            if end - start < min_chunk_chars:
                 continue
 
             meta = dict(doc.metadata)
             meta.update({
                 "chunk_id": idx,
-                "chunk_size": chunk_size,
-                "overlap": overlap,
+                "start_char": start,
+                "end_char": end,
+                "target_tokens": target_tokens,
+                "overlap_tokens": overlap_tokens,
             })
 
-            all_chunks.append(TextChunk(text=piece, metadata=meta))
+            yield TextChunk(text=doc.text[start:end], metadata=meta)
 
-    return all_chunks
+
+def chunk_documents(
+    docs: List[DocumentChunk],
+    target_tokens: int = CHUNK_TARGET_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    min_chunk_chars: int = 200,
+) -> List[TextChunk]:
+    """
+    Convert page-level DocumentChunks into sentence-aligned TextChunks.
+    Keeps metadata for citations (source + page) and adds chunk_id within a
+    page plus start_char/end_char offsets into the page text.
+    """
+    return list(iter_chunk_documents(
+        docs,
+        target_tokens=target_tokens,
+        overlap_tokens=overlap_tokens,
+        min_chunk_chars=min_chunk_chars,
+    ))
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from rag.ranking import keyword_only
+from rag.tokens import count_tokens
+from rag.tracing import span
 
 
 @dataclass
@@ -9,8 +13,9 @@ class Citation:
     cid: int
     source: str
     page: int
-    score: float
+    score: float  # vector similarity
     snippet: str
+    keyword_only: bool = False  # hybrid hit found by BM25 alone: no similarity score
 
 
 def _safe_int(x, default=-1) -> int:
@@ -20,14 +25,27 @@ def _safe_int(x, default=-1) -> int:
         return default
 
 
+def format_context_entry(cid: int, source: str, page: int, snippet: str) -> str:
+    """One numbered evidence entry as fed to the model."""
+    return f"[{cid}] Source: {source} (page {page})\n{snippet}\n"
+
+
 def build_context_with_citations(
     results: List[Dict[str, Any]],
-    max_snippet_chars: int = 350,
+    max_snippet_chars: Optional[int] = 350,
 ) -> tuple[str, List[Citation]]:
     """
     Build an LLM-ready context block with numbered citations and return a structured list.
     Each result is expected to have: text, score, metadata{source,page,...}
+    max_snippet_chars=None keeps each text whole (already budgeted by the packer).
     """
+    with span("context", results=len(results)) as sp:
+        context_block, citations = _build_context(results, max_snippet_chars)
+        sp.set(context_chars=len(context_block), context_tokens=count_tokens(context_block))
+    return context_block, citations
+
+
+def _build_context(results: List[Dict[str, Any]], max_snippet_chars: Optional[int]) -> tuple[str, List[Citation]]:
     citations: List[Citation] = []
     context_parts: List[str] = []
 
@@ -38,7 +56,7 @@ def build_context_with_citations(
         score = float(r.get("score", 0.0))
 
         text = (r.get("text") or "").strip()
-        snippet = text[:max_snippet_chars].strip()
+        snippet = text if max_snippet_chars is None else text[:max_snippet_chars].strip()
 
         citations.append(
             Citation(
@@ -46,25 +64,28 @@ def build_context_with_citations(
                 source=source,
                 page=page,
                 score=score,
-                snippet=snippet
+                snippet=snippet,
+                keyword_only=keyword_only(r),
             )
         )
 
         # Context entry format fed to the model
-        context_parts.append(
-            f"[{i}] Source: {source} (page {page})\n"
-            f"{snippet}\n"
-        )
+        context_parts.append(format_context_entry(i, source, page, snippet))
 
     context_block = "\n".join(context_parts).strip()
     return context_block, citations
 
 
+def score_label(c: Citation) -> str:
+    """How a citation matched, for display: its similarity, or a keyword-only match."""
+    return "keyword match" if c.keyword_only else f"similarity: {c.score:.3f}"
+
+
 def citations_to_ui_lines(citations: List[Citation]) -> List[str]:
     """
     Simple UI-friendly citation display lines.
     """
     lines = []
     for c in citations:
-        lines.append(f"[{c.cid}] {c.source} — page {c.page} (score: {c.score:.3f})")
+        lines.append(f"[{c.cid}] {c.source} — page {c.page} ({score_label(c)})")
     return lines
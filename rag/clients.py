@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "heydocai-medkb")
+CLOUD = os.getenv("PINECONE_CLOUD", "aws")
+REGION = os.getenv("PINECONE_REGION", "us-east-1")
+
+# For text-embedding-3-small
+EMBED_DIMS = 1536
+
+# One client per process: each SDK client owns an HTTP connection pool, so
+# reusing it keeps TLS sessions and keep-alive connections warm across queries.
+_lock = threading.Lock()
+_openai_client = None
+_async_openai_client = None
+_pinecone_client = None
+_pinecone_indexes: Dict[str, Any] = {}
+
+
+def get_openai_client():
+    """
+    Shared OpenAI client (lazy; created on first use).
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                from openai import OpenAI
+
+                _openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    return _openai_client
+
+
+def get_async_openai_client():
+    """
+    Shared AsyncOpenAI client for the asyncio pipeline (lazy; created on first use).
+    """
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _lock:
+            if _async_openai_client is None:
+                from openai import AsyncOpenAI
+
+                _async_openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+    return _async_openai_client
+
+
+def get_pinecone_client():
+    global _pinecone_client
+    if _pinecone_client is None:
+        with _lock:
+            if _pinecone_client is None:
+                if not PINECONE_API_KEY:
+                    raise ValueError("Missing PINECONE_API_KEY in .env")
+                from pinecone import Pinecone
+
+                _pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
+    return _pinecone_client
+
+
+def get_pinecone_index(name: str = INDEX_NAME, create: bool = False):
+    """
+    Shared Index handle per index name. With create=True the index is created
+    (cosine, EMBED_DIMS) if it does not exist yet.
+    """
+    index = _pinecone_indexes.get(name)
+    if index is not None:
+        return index
+
+    pc = get_pinecone_client()
+    with _lock:
+        if name in _pinecone_indexes:
+            return _pinecone_indexes[name]
+
+        if create:
+            from pinecone import ServerlessSpec
+
+            existing = [idx["name"] for idx in pc.list_indexes()]
+            if name not in existing:
+                pc.create_index(
+                    name=name,
+                    dimension=EMBED_DIMS,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud=CLOUD, region=REGION),
+                )
+
+        index = pc.Index(name)
+        _pinecone_indexes[name] = index
+    return index
+
+
+def reset_clients() -> None:
+    """
+    Drop cached clients (e.g. after a failed health check) so the next call reconnects.
+    """
+    global _openai_client, _async_openai_client, _pinecone_client
+    with _lock:
+        _openai_client = None
+        _async_openai_client = None
+        _pinecone_client = None
+        _pinecone_indexes.clear()
+
+
+def health_check(check_openai: bool = True, check_pinecone: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Ping each backend through the shared clients; also warms their connection pools.
+    Returns {"openai": {"ok", "latency_sec", "error"?}, "pinecone": {...}}.
+    """
+    report: Dict[str, Dict[str, Any]] = {}
+
+    def _probe(name: str, fn) -> None:
+        t0 = time.perf_counter()
+        try:
+            fn()
+            report[name] = {"ok": True, "latency_sec": round(time.perf_counter() - t0, 3)}
+        except Exception as e:
+            report[name] = {
+                "ok": False,
+                "latency_sec": round(time.perf_counter() - t0, 3),
+                "error": f"{type(e).__name__}: {e}",
+            }
+
+    if check_openai:
+        embed_model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+        _probe("openai", lambda: get_openai_client().models.retrieve(embed_model))
+    if check_pinecone:
+        _probe("pinecone", lambda: get_pinecone_index().describe_index_stats())
+
+    return report
+
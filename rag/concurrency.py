@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import random
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Transient failures worth retrying (besides 429s)
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRY_NAMES = {"APIConnectionError", "APITimeoutError", "RateLimitError", "ServiceException"}
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("status_code", "status"):
+        code = getattr(exc, attr, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(exc, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return _status_code(exc) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Works for both OpenAI and Pinecone exceptions without importing either SDK.
+    """
+    if type(exc).__name__ in _RETRY_NAMES:
+        return True
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return _status_code(exc) in _RETRY_STATUS
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds suggested by a Retry-After header, if the server sent one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_backoff(
+    fn: Callable[..., T],
+    *args: Any,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    **kwargs: Any,
+) -> T:
+    """
+    Call fn, retrying transient/rate-limit errors with exponential backoff + full jitter.
+    Honors Retry-After on 429s. Non-retryable errors are raised immediately.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay = random.uniform(0, delay)
+            if is_rate_limited(e):
+                delay = max(delay, _retry_after(e) or base_delay)
+            attempt += 1
+            print(f"Retry {attempt}/{max_retries} after {type(e).__name__}; sleeping {delay:.1f}s")
+            time.sleep(delay)
+
+
+def map_ordered(
+    pool: Executor,
+    fn: Callable[..., T],
+    items: Iterable[Any],
+    window: int,
+) -> Iterator[T]:
+    """
+    Like pool.map, but pulls `items` lazily and keeps at most `window` calls in flight.
+    Results are yielded in input order, so callers can report progress in order.
+    """
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= max(1, window):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.quantization import check_mode, decode_vector, encode_vector
+
+load_dotenv()
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/index/embed_cache.sqlite")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+# Storage for new entries: none (float32) | float16 | int8; existing rows keep their own format
+EMBED_CACHE_QUANTIZATION = os.getenv("EMBED_CACHE_QUANTIZATION", "none").lower()
+# A hit rewrites last_used only when it is older than this, so hot reads don't write (0 = every hit)
+EMBED_CACHE_TOUCH_SEC = float(os.getenv("EMBED_CACHE_TOUCH_SEC", "300"))
+
+
+def cache_key(model: str, text: str) -> str:
+    """
+    Content address for an embedding: sha256 over model name + exact text.
+    """
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache (SQLite, float32 blobs) with LRU eviction.
+    With quantization "float16" or "int8" new vectors are stored at 1/2 or
+    ~1/4 the size and widened back to float32 on read.
+    LRU order is kept to touch_interval_sec: a hit only writes when its
+    last_used is older than that. Safe to share across threads.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = EMBED_CACHE_PATH,
+        max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+        quantization: str = EMBED_CACHE_QUANTIZATION,
+        touch_interval_sec: float = EMBED_CACHE_TOUCH_SEC,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.quantization = check_mode(quantization)
+        self.touch_interval_sec = touch_interval_sec
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " dims INTEGER NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")}
+        if "quant" not in columns:
+            # Caches written before quantization hold float32 blobs
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN quant TEXT NOT NULL DEFAULT 'none'")
+        self._conn.commit()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, List[float]]:
+        """
+        Look up texts; returns {position_in_texts: vector} for hits only.
+        """
+        keys = [cache_key(model, t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        stale = []
+
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # SQLite caps bound parameters; query in slices
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vec, quant, last_used FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob, quant, last_used in rows:
+                    found[key] = decode_vector(blob, quant).tolist()
+                    if now - last_used >= self.touch_interval_sec:
+                        stale.append(key)
+
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in stale],
+                )
+                self._conn.commit()
+
+            hits = {i: found[k] for i, k in enumerate(keys) if k in found}
+            self.hits += len(hits)
+            self.misses += len(keys) - len(hits)
+
+        return hits
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows = []
+        for text, vec in zip(texts, vectors):
+            arr = np.asarray(vec, dtype=np.float32)
+            blob = encode_vector(arr, self.quantization)
+            rows.append((cache_key(model, text), model, int(arr.shape[0]), blob, self.quantization, now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dims, vec, quant, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used rows above max_entries. Caller holds the lock."""
+        if self.max_entries <= 0:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return int(count)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Process-wide cache, or None when EMBED_CACHE_ENABLED is off.
+    """
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+    return _cache
@@ -1,17 +1,51 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from rag.clients import get_openai_client
+from rag.embedding_cache import get_embedding_cache
+from rag.tracing import span
 
 load_dotenv()
 
 _EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
-_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def embed_texts(texts: list[str]) -> list[list[float]]:
+def embed_texts(texts: list[str], use_cache: bool = True) -> list[list[float]]:
     """
     Returns embeddings for a list of texts.
+    Texts already in the embedding cache (same model + identical text) are not re-sent.
     """
     if not texts:
         return []
-    resp = _client.embeddings.create(model=_EMBED_MODEL, input=texts)
-    return [item.embedding for item in resp.data]
+
+    with span("embedding", texts=len(texts)) as sp:
+        cache = get_embedding_cache() if use_cache else None
+        if cache is None:
+            resp = get_openai_client().embeddings.create(model=_EMBED_MODEL, input=texts)
+            sp.set(sent=len(texts))
+            return [item.embedding for item in resp.data]
+
+        out: list = [None] * len(texts)
+        for i, vec in cache.get_many(_EMBED_MODEL, texts).items():
+            out[i] = vec
+
+        missing = [i for i, v in enumerate(out) if v is None]
+        sp.set(cache_hits=len(texts) - len(missing), sent=0)
+        if missing:
+            # Send each distinct missing text once
+            uniq = list(dict.fromkeys(texts[i] for i in missing))
+            resp = get_openai_client().embeddings.create(model=_EMBED_MODEL, input=uniq)
+            sp.set(sent=len(uniq))
+            fresh = {t: item.embedding for t, item in zip(uniq, resp.data)}
+            cache.put_many(_EMBED_MODEL, uniq, [fresh[t] for t in uniq])
+            for i in missing:
+                out[i] = fresh[texts[i]]
+
+        return out
+
+
+def embedding_cache_stats() -> dict:
+    """
+    Hit/miss counters for the embedding cache (empty if disabled).
+    """
+    cache = get_embedding_cache()
+    return cache.stats() if cache is not None else {}
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from rag.chunking import TextChunk
+from rag.concurrency import call_with_backoff, map_ordered
+from rag.pinecone_upsert import embed_batch, get_store, EMBED_CONCURRENCY, UPSERT_CONCURRENCY
+from rag.vector_store import VectorStore
+
+_DONE = object()
+
+
+@dataclass
+class IngestStats:
+    """
+    Per-stage busy time. With overlap, wall_seconds approaches the slowest stage
+    instead of the sum of all three.
+    """
+    chunks: int = 0
+    batches: int = 0
+    parse_seconds: float = 0.0    # pulling chunks from the loader/chunker generators
+    embed_seconds: float = 0.0    # summed over concurrent requests
+    upsert_seconds: float = 0.0   # summed over concurrent requests
+    wall_seconds: float = 0.0
+
+
+def _batched(items: Iterable[TextChunk], size: int) -> Iterator[List[TextChunk]]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Blocking put that gives up once another stage has failed."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator:
+    while True:
+        item = _get(q, stop)
+        if item is _DONE:
+            return
+        yield item
+
+
+def stream_ingest(
+    chunks: Iterable[TextChunk],
+    store: Optional[VectorStore] = None,
+    batch_size: int = 64,
+    queue_size: int = 4,
+    embed_workers: int = EMBED_CONCURRENCY,
+    upsert_workers: int = UPSERT_CONCURRENCY,
+    max_retries: int = 5,
+) -> IngestStats:
+    """
+    Parse -> embed -> upsert as three overlapping stages connected by bounded queues.
+
+    `chunks` should be a lazy iterator (e.g. iter_chunk_documents over
+    iter_knowledge_base_files), so only a bounded number of batches are in
+    memory at any point regardless of corpus size. The embed and upsert stages
+    each keep up to *_workers requests in flight, with per-batch retry.
+    """
+    if store is None:
+        store = get_store()
+
+    stats = IngestStats()
+    stats_lock = threading.Lock()
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    embed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    upsert_q: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def produce():
+        try:
+            batches = _batched(chunks, batch_size)
+            while True:
+                t0 = time.perf_counter()
+                batch = next(batches, None)
+                stats.parse_seconds += time.perf_counter() - t0
+                if batch is None or not _put(embed_q, batch, stop):
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(embed_q, _DONE, stop)
+
+    def embed_one(batch: List[TextChunk]) -> List[dict]:
+        t0 = time.perf_counter()
+        records = embed_batch(batch, max_retries=max_retries)
+        with stats_lock:
+            stats.embed_seconds += time.perf_counter() - t0
+        return records
+
+    def upsert_one(records: List[dict]) -> int:
+        t0 = time.perf_counter()
+        call_with_backoff(store.upsert, records, max_retries=max_retries)
+        with stats_lock:
+            stats.upsert_seconds += time.perf_counter() - t0
+        return len(records)
+
+    def embed():
+        try:
+            with ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="ingest-embed") as pool:
+                for records in map_ordered(pool, embed_one, _drain(embed_q, stop), window=embed_workers):
+                    if not _put(upsert_q, records, stop):
+                        break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(upsert_q, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=produce, name="ingest-parse", daemon=True),
+        threading.Thread(target=embed, name="ingest-embed", daemon=True),
+    ]
+
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    # Upsert stage is driven from the calling thread
+    try:
+        with ThreadPoolExecutor(max_workers=upsert_workers, thread_name_prefix="ingest-upsert") as pool:
+            for n in map_ordered(pool, upsert_one, _drain(upsert_q, stop), window=upsert_workers):
+                stats.chunks += n
+                stats.batches += 1
+                print(f"{stats.chunks} upserted")
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
+
+    t0 = time.perf_counter()
+    store.flush()
+    stats.upsert_seconds += time.perf_counter() - t0
+    stats.wall_seconds = time.perf_counter() - t_start
+    return stats
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 
 from pypdf import PdfReader
 
+from rag.concurrency import map_ordered
+
 
 @dataclass
 class DocumentChunk:
@@ -25,10 +30,153 @@ def _clean_text(text: str) -> str:
     return text.strip()
 
 
+def _iter_pdf_range(
+    pdf_path: Path,
+    start: int,
+    end: int,
+    doc_type: str,
+    min_chars: int,
+    timing: Optional[Dict[str, float]] = None,
+) -> Iterator[DocumentChunk]:
+    """
+    Yield pages [start, end) of one PDF as they are extracted.
+    If `timing` is given, extraction CPU time is added to timing["seconds"].
+    """
+    reader = PdfReader(str(pdf_path))
+
+    for i in range(start, min(end, len(reader.pages))):
+        t0 = time.process_time()
+        page = reader.pages[i]
+        raw_text = page.extract_text() or ""
+        text = _clean_text(raw_text)
+        if timing is not None:
+            timing["seconds"] += time.process_time() - t0
+
+        # Skip empty/too-short pages (often headers, references, etc.)
+        if len(text) < min_chars:
+            continue
+
+        yield DocumentChunk(
+            text=text,
+            metadata={
+                "source": pdf_path.name,
+                "page": i + 1,  # human-readable page index
+                "doc_type": doc_type,
+                "path": str(pdf_path),
+            },
+        )
+
+
+def _extract_pdf_pages(
+    pdf_path: str,
+    start: int,
+    end: int,
+    doc_type: str,
+    min_chars: int,
+) -> tuple[List[DocumentChunk], float]:
+    """
+    Extract pages [start, end) of one PDF. Top-level so it can run in a worker process.
+    Returns (docs, CPU seconds spent).
+    """
+    timing = {"seconds": 0.0}
+    docs = list(_iter_pdf_range(Path(pdf_path), start, end, doc_type, min_chars, timing))
+    return docs, timing["seconds"]
+
+
+def _extract_pdf_task(task: tuple) -> tuple[str, List[DocumentChunk], float]:
+    """_extract_pdf_pages on a (pdf_path, start, end, doc_type, min_chars) tuple, tagged with the path."""
+    docs, seconds = _extract_pdf_pages(*task)
+    return task[0], docs, seconds
+
+
+def iter_pdf_pages(
+    pdf_files: List[Path],
+    doc_type: str = "radiology_reference",
+    min_chars: int = 200,
+    workers: int = 1,
+    pages_per_task: int = 20,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
+) -> Iterator[DocumentChunk]:
+    """
+    Stream page-level DocumentChunks for the given PDF files (in the given order).
+
+    workers > 1 spreads files, and page ranges of large files, across a process pool.
+    Output order and metadata are identical to the sequential path. At most
+    2 * workers ranges are parsed ahead of the consumer, so a slow consumer
+    (embedding/upsert) holds parsing back instead of buffering the corpus.
+    If `timings` is given it is filled with {source: {"pages", "seconds"}} where
+    seconds is the extraction CPU time summed over that file's tasks.
+    """
+    pdf_files = [Path(p) for p in pdf_files]
+
+    if workers <= 1:
+        for pdf_path in pdf_files:
+            timing = None
+            if timings is not None:
+                timing = timings[pdf_path.name] = {
+                    "pages": len(PdfReader(str(pdf_path)).pages), "seconds": 0.0
+                }
+            yield from _iter_pdf_range(pdf_path, 0, sys.maxsize, doc_type, min_chars, timing)
+        return
+
+    def tasks() -> Iterator[tuple]:
+        # One task per page range; page counts are cheap (no text extraction)
+        for pdf_path in pdf_files:
+            num_pages = len(PdfReader(str(pdf_path)).pages)
+            if timings is not None:
+                timings[pdf_path.name] = {"pages": num_pages, "seconds": 0.0}
+            step = max(1, pages_per_task)
+            for start in range(0, num_pages, step):
+                yield (str(pdf_path), start, start + step, doc_type, min_chars)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map_ordered yields in submission order -> deterministic output
+        for path, part, seconds in map_ordered(pool, _extract_pdf_task, tasks(), window=2 * workers):
+            if timings is not None:
+                timings[Path(path).name]["seconds"] += seconds
+            yield from part
+
+
+def load_pdf_files(
+    pdf_files: List[Path],
+    doc_type: str = "radiology_reference",
+    min_chars: int = 200,
+    workers: int = 1,
+    pages_per_task: int = 20,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
+) -> List[DocumentChunk]:
+    """
+    Parse the given PDF files into page-level DocumentChunks (in the given order).
+    See iter_pdf_pages for workers/timings.
+    """
+    return list(iter_pdf_pages(
+        pdf_files,
+        doc_type=doc_type,
+        min_chars=min_chars,
+        workers=workers,
+        pages_per_task=pages_per_task,
+        timings=timings,
+    ))
+
+
+def format_load_timings(timings: Dict[str, Dict[str, float]]) -> List[str]:
+    """
+    One line per file, slowest first.
+    """
+    lines = []
+    for name, t in sorted(timings.items(), key=lambda kv: kv[1]["seconds"], reverse=True):
+        pages = int(t["pages"])
+        per_page = t["seconds"] / pages * 1000 if pages else 0.0
+        lines.append(f"{name}: {pages} pages in {t['seconds']:.2f}s ({per_page:.0f} ms/page)")
+    return lines
+
+
 def load_pdfs_from_folder(
     folder_path: str | Path,
     doc_type: str = "radiology_reference",
     min_chars: int = 200,
+    workers: int = 1,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
 ) -> List[DocumentChunk]:
     """
     Load PDFs from a folder and return page-level DocumentChunks.
@@ -42,34 +190,46 @@ def load_pdfs_from_folder(
     if not pdf_files:
         raise FileNotFoundError(f"No PDF files found in: {folder}")
 
-    docs: List[DocumentChunk] = []
+    return load_pdf_files(pdf_files, doc_type=doc_type, min_chars=min_chars, workers=workers, timings=timings)
 
-    for pdf_path in pdf_files:
-        reader = PdfReader(str(pdf_path))
-        num_pages = len(reader.pages)
 
-        for i in range(num_pages):
-            page = reader.pages[i]
-            raw_text = page.extract_text() or ""
-            text = _clean_text(raw_text)
+def iter_txt_files(
+    txt_files: List[Path],
+    doc_type: str = "radiology_reference",
+    min_chars: int = 200,
+    encoding: str = "utf-8",
+) -> Iterator[DocumentChunk]:
+    """
+    Stream the given .txt files; each file becomes a single page-1 DocumentChunk.
+    """
+    for txt_path in txt_files:
+        txt_path = Path(txt_path)
+        raw = txt_path.read_text(encoding=encoding, errors="ignore")
+        text = _clean_text(raw)
+        if len(text) < min_chars:
+            continue
 
-            # Skip empty/too-short pages (often headers, references, etc.)
-            if len(text) < min_chars:
-                continue
+        yield DocumentChunk(
+            text=text,
+            metadata={
+                "source": txt_path.name,
+                "page": 1,
+                "doc_type": doc_type,
+                "path": str(txt_path),
+            },
+        )
 
-            docs.append(
-                DocumentChunk(
-                    text=text,
-                    metadata={
-                        "source": pdf_path.name,
-                        "page": i + 1,  # human-readable page index
-                        "doc_type": doc_type,
-                        "path": str(pdf_path),
-                    },
-                )
-            )
 
-    return docs
+def load_txt_files(
+    txt_files: List[Path],
+    doc_type: str = "radiology_reference",
+    min_chars: int = 200,
+    encoding: str = "utf-8",
+) -> List[DocumentChunk]:
+    """
+    Read the given .txt files; each file becomes a single page-1 DocumentChunk.
+    """
+    return list(iter_txt_files(txt_files, doc_type=doc_type, min_chars=min_chars, encoding=encoding))
 
 
 def load_txts_from_folder(
@@ -86,36 +246,56 @@ def load_txts_from_folder(
         raise FileNotFoundError(f"Knowledge base folder not found: {folder}")
 
     txt_files = sorted(folder.glob("*.txt"))
-    docs: List[DocumentChunk] = []
+    return load_txt_files(txt_files, doc_type=doc_type, min_chars=min_chars, encoding=encoding)
 
-    for txt_path in txt_files:
-        raw = txt_path.read_text(encoding=encoding, errors="ignore")
-        text = _clean_text(raw)
-        if len(text) < min_chars:
-            continue
 
-        docs.append(
-            DocumentChunk(
-                text=text,
-                metadata={
-                    "source": txt_path.name,
-                    "page": 1,
-                    "doc_type": doc_type,
-                    "path": str(txt_path),
-                },
-            )
-        )
+def list_knowledge_base_files(kb_folder: str | Path = "data/knowledge_base") -> List[Path]:
+    """
+    All KB source files in load order: PDFs first, then TXTs, each sorted by name.
+    """
+    folder = Path(kb_folder)
+    if not folder.exists():
+        raise FileNotFoundError(f"Knowledge base folder not found: {folder}")
+    return sorted(folder.glob("*.pdf")) + sorted(folder.glob("*.txt"))
+
 
-    return docs
+def iter_knowledge_base_files(
+    files: List[Path],
+    doc_type: str = "radiology_reference",
+    workers: int = 1,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
+) -> Iterator[DocumentChunk]:
+    """
+    Stream pages from a subset of KB files (PDFs first, then TXTs), without
+    holding the whole corpus in memory.
+    """
+    pdfs = [Path(f) for f in files if Path(f).suffix.lower() == ".pdf"]
+    txts = [Path(f) for f in files if Path(f).suffix.lower() == ".txt"]
+    yield from iter_pdf_pages(pdfs, doc_type=doc_type, workers=workers, timings=timings)
+    yield from iter_txt_files(txts, doc_type=doc_type)
+
+
+def load_knowledge_base_files(
+    files: List[Path],
+    doc_type: str = "radiology_reference",
+    workers: int = 1,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
+) -> List[DocumentChunk]:
+    """
+    Load an explicit subset of KB files (PDF + TXT), e.g. only the ones that changed.
+    """
+    return list(iter_knowledge_base_files(files, doc_type=doc_type, workers=workers, timings=timings))
 
 
 def load_knowledge_base(
     kb_folder: str | Path = "data/knowledge_base",
     doc_type: str = "radiology_reference",
+    workers: int = 1,
+    timings: Optional[Dict[str, Dict[str, float]]] = None,
 ) -> List[DocumentChunk]:
     """
     Load all KB documents (PDF + TXT) into page-level chunks.
     """
-    pdf_docs = load_pdfs_from_folder(kb_folder, doc_type=doc_type)
+    pdf_docs = load_pdfs_from_folder(kb_folder, doc_type=doc_type, workers=workers, timings=timings)
     txt_docs = load_txts_from_folder(kb_folder, doc_type=doc_type)
     return pdf_docs + txt_docs
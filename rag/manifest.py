@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Dict, Any, Set
+
+from rag.vector_store import LOCAL_INDEX_DIR
+
+
+def file_sha256(path: str | Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_path(backend: str, index_dir: str | Path = LOCAL_INDEX_DIR) -> Path:
+    """
+    One manifest per backend, so building one backend never marks another as up to date.
+    """
+    return Path(index_dir) / f"manifest_{backend}.json"
+
+
+@dataclass
+class IndexManifest:
+    """
+    What is currently in the vector index:
+    files -> {sha256, chunks: {vector_id: text_sha256}}.
+    `version` is bumped on every build that changes the index.
+    """
+    path: Path
+    version: int = 0
+    settings: Dict[str, Any] = field(default_factory=dict)
+    files: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    updated_at: str = ""
+
+    @classmethod
+    def load(cls, path: str | Path) -> "IndexManifest":
+        path = Path(path)
+        if not path.exists():
+            return cls(path=path)
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(
+            path=path,
+            version=int(data.get("version", 0)),
+            settings=data.get("settings", {}),
+            files=data.get("files", {}),
+            updated_at=data.get("updated_at", ""),
+        )
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": self.version,
+            "updated_at": self.updated_at,
+            "settings": self.settings,
+            "files": self.files,
+        }
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def file_hash(self, name: str) -> str | None:
+        entry = self.files.get(name)
+        return entry.get("sha256") if entry else None
+
+    def chunk_hashes(self, name: str) -> Dict[str, str]:
+        entry = self.files.get(name)
+        return dict(entry.get("chunks", {})) if entry else {}
+
+    def all_ids(self, names: List[str] | None = None) -> Set[str]:
+        names = list(self.files) if names is None else names
+        ids: Set[str] = set()
+        for name in names:
+            ids.update(self.chunk_hashes(name))
+        return ids
+
+    def bump(self) -> None:
+        self.version += 1
+        self.updated_at = time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+_version_cache: Dict[Path, tuple[float, int]] = {}
+
+
+def current_manifest_version(backend: str, index_dir: str | Path = LOCAL_INDEX_DIR) -> int:
+    """
+    Version of the backend's manifest (0 if none). Only re-reads the file when
+    its mtime changes, so this is cheap enough to call on every query.
+    """
+    path = manifest_path(backend, index_dir)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+    cached = _version_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    version = IndexManifest.load(path).version
+    _version_cache[path] = (mtime, version)
+    return version
+
+
+@dataclass
+class IndexPlan:
+    """
+    Files that need reparsing and files that disappeared since the last build.
+    """
+    changed: List[Path]
+    unchanged: List[Path]
+    removed: List[str]
+    hashes: Dict[str, str]
+
+
+def plan_rebuild(
+    files: List[Path],
+    manifest: IndexManifest,
+    settings: Dict[str, Any],
+    full: bool = False,
+) -> IndexPlan:
+    """
+    Compare current KB files against the manifest.
+    A settings change (e.g. chunk size) forces every file to be reparsed.
+    """
+    hashes = {Path(f).name: file_sha256(f) for f in files}
+    force = full or manifest.settings != settings
+
+    changed, unchanged = [], []
+    for f in files:
+        name = Path(f).name
+        if force or manifest.file_hash(name) != hashes[name]:
+            changed.append(Path(f))
+        else:
+            unchanged.append(Path(f))
+
+    removed = sorted(name for name in manifest.files if name not in hashes)
+    return IndexPlan(changed=changed, unchanged=unchanged, removed=removed, hashes=hashes)
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Pinecone's metadata filter language (the subset this project uses), so one
+# filter works unchanged on both backends:
+#   {"source": "chest_xray_guide.pdf"}                        implicit $eq
+#   {"doc_type": {"$in": ["chest_imaging", "thoracic"]}, "page": {"$lte": 40}}
+#   {"$or": [{"source": "a.pdf"}, {"source": "b.pdf"}]}
+FIELD_OPS = frozenset({"$eq", "$ne", "$in", "$nin", "$gt", "$gte", "$lt", "$lte"})
+LOGIC_OPS = frozenset({"$and", "$or"})
+
+# Fields MetadataIndex indexes up front and keeps current across writes (the sidebar filters on source)
+PRECOMPUTED_FIELDS = ("source", "doc_type")
+
+
+def validate_filter(flt: Dict[str, Any]) -> None:
+    """Raise ValueError for anything outside the supported filter language."""
+    if not isinstance(flt, dict):
+        raise ValueError(f"Metadata filter must be a dict, got {type(flt).__name__}")
+    for key, cond in flt.items():
+        if key in LOGIC_OPS:
+            if not isinstance(cond, list) or not cond:
+                raise ValueError(f"{key} takes a non-empty list of filters")
+            for sub in cond:
+                validate_filter(sub)
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator: {key}")
+        elif isinstance(cond, dict):
+            for op, value in cond.items():
+                if op not in FIELD_OPS:
+                    raise ValueError(f"Unsupported operator {op!r} on field {key!r}")
+                if op in ("$in", "$nin") and not isinstance(value, list):
+                    raise ValueError(f"{op} on field {key!r} takes a list")
+
+
+def filter_key(flt: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Canonical string for a filter (cache keys); None for no filter."""
+    return json.dumps(flt, sort_keys=True) if flt else None
+
+
+def matches(meta: Dict[str, Any], flt: Dict[str, Any]) -> bool:
+    """Evaluate a filter against one metadata dict (reference semantics for MetadataIndex)."""
+    for key, cond in flt.items():
+        if key == "$and":
+            if not all(matches(meta, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(meta, sub) for sub in cond):
+                return False
+        else:
+            ops = cond if isinstance(cond, dict) else {"$eq": cond}
+            value = meta.get(key)
+            for op, target in ops.items():
+                if op == "$eq" and value != target:
+                    return False
+                if op == "$ne" and value == target:
+                    return False
+                if op == "$in" and value not in target:
+                    return False
+                if op == "$nin" and value in target:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        return False
+                    if ((op == "$gt" and not value > target) or (op == "$gte" and not value >= target)
+                            or (op == "$lt" and not value < target) or (op == "$lte" and not value <= target)):
+                        return False
+    return True
+
+
+class MetadataIndex:
+    """
+    Inverted indexes over a list of metadata dicts, for evaluating filters
+    as boolean row masks without touching the dicts at query time:
+
+      keyword postings   field -> {value: sorted int32 rows}   ($eq/$ne/$in/$nin)
+      numeric columns    field -> (sorted values, rows in that order)   (ranges)
+
+    The keyword postings of `fields` (PRECOMPUTED_FIELDS) are built up front
+    and kept current by update() and remove(), so the first filter on them
+    is as fast as later ones. Any other field is indexed the first time a
+    filter uses it, so unfiltered fields (e.g. chunk text) cost nothing, and
+    is dropped on writes. The resulting masks are cached per filter (they
+    act as precomputed bitmaps for repeated filters) until the rows change.
+    """
+
+    MASK_CACHE_SIZE = 64
+
+    def __init__(self, metadata: List[Dict[str, Any]], fields: Iterable[str] = PRECOMPUTED_FIELDS):
+        self.metadata = metadata
+        self.n = len(metadata)
+        self.fields = tuple(fields)
+        self._keyword: Dict[str, Dict[Any, np.ndarray]] = {}
+        self._numeric: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        for field in self.fields:
+            self._keyword_postings(field)
+
+    def update(self, metadata: List[Dict[str, Any]], changed: List[int]) -> None:
+        """
+        Rows `changed` of metadata were overwritten, or appended past the old
+        length. Precomputed postings are patched; other indexes are dropped.
+        """
+        with self._lock:
+            old_n = self.n
+            self.metadata, self.n = metadata, len(metadata)
+            self._reset_lazy()
+            rewritten = np.asarray([i for i in changed if i < old_n], dtype=np.int32)
+            for field in self.fields:
+                postings = self._keyword[field]
+                if rewritten.size:
+                    for value, rows in list(postings.items()):
+                        postings[value] = rows[~np.isin(rows, rewritten)]
+                grouped: Dict[Any, List[int]] = {}
+                for i in changed:
+                    if field in metadata[i]:
+                        grouped.setdefault(_hashable(metadata[i][field]), []).append(i)
+                for value, rows in grouped.items():
+                    added = np.asarray(rows, dtype=np.int32)
+                    current = postings.get(value)
+                    postings[value] = added if current is None else np.union1d(current, added).astype(np.int32)
+                self._keyword[field] = {v: rows for v, rows in postings.items() if rows.size}
+
+    def remove(self, metadata: List[Dict[str, Any]], keep: np.ndarray) -> None:
+        """
+        Rows where keep is False were deleted and the rest renumbered in
+        order; metadata is the remaining list.
+        """
+        with self._lock:
+            self.metadata, self.n = metadata, len(metadata)
+            self._reset_lazy()
+            renumber = (np.cumsum(keep) - 1).astype(np.int32)
+            for field in self.fields:
+                remapped = {v: renumber[rows[keep[rows]]] for v, rows in self._keyword[field].items()}
+                self._keyword[field] = {v: rows for v, rows in remapped.items() if rows.size}
+
+    def _reset_lazy(self) -> None:
+        self._masks.clear()
+        self._numeric.clear()
+        for field in [f for f in self._keyword if f not in self.fields]:
+            del self._keyword[field]
+
+    def mask(self, flt: Dict[str, Any]) -> np.ndarray:
+        """Read-only boolean array: True for rows matching flt."""
+        key = filter_key(flt)
+        with self._lock:
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                return cached
+            out = self._eval(flt)
+            out.setflags(write=False)
+            self._masks[key] = out
+            if len(self._masks) > self.MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+            return out
+
+    def rows(self, flt: Dict[str, Any]) -> np.ndarray:
+        """Matching row ids, ascending."""
+        return np.flatnonzero(self.mask(flt))
+
+    def _eval(self, flt: Dict[str, Any]) -> np.ndarray:
+        out = np.ones(self.n, dtype=bool)
+        for key, cond in flt.items():
+            if key == "$and":
+                for sub in cond:
+                    out &= self._eval(sub)
+            elif key == "$or":
+                any_of = np.zeros(self.n, dtype=bool)
+                for sub in cond:
+                    any_of |= self._eval(sub)
+                out &= any_of
+            else:
+                ops = cond if isinstance(cond, dict) else {"$eq": cond}
+                for op, target in ops.items():
+                    out &= self._field_mask(key, op, target)
+        return out
+
+    def _field_mask(self, field: str, op: str, target: Any) -> np.ndarray:
+        m = np.zeros(self.n, dtype=bool)
+        if op in ("$eq", "$ne", "$in", "$nin"):
+            postings = self._keyword_postings(field)
+            for value in (target if op in ("$in", "$nin") else [target]):
+                rows = postings.get(_hashable(value))
+                if rows is not None:
+                    m[rows] = True
+            return ~m if op in ("$ne", "$nin") else m
+
+        values, rows = self._numeric_column(field)
+        if op in ("$gt", "$gte"):
+            lo = np.searchsorted(values, target, side="right" if op == "$gt" else "left")
+            m[rows[lo:]] = True
+        else:
+            hi = np.searchsorted(values, target, side="left" if op == "$lt" else "right")
+            m[rows[:hi]] = True
+        return m
+
+    def _keyword_postings(self, field: str) -> Dict[Any, np.ndarray]:
+        postings = self._keyword.get(field)
+        if postings is None:
+            grouped: Dict[Any, List[int]] = {}
+            for i, meta in enumerate(self.metadata):
+                if field in meta:
+                    grouped.setdefault(_hashable(meta[field]), []).append(i)
+            postings = {v: np.asarray(rows, dtype=np.int32) for v, rows in grouped.items()}
+            self._keyword[field] = postings
+        return postings
+
+    def _numeric_column(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        column = self._numeric.get(field)
+        if column is None:
+            rows = [i for i, meta in enumerate(self.metadata)
+                    if isinstance(meta.get(field), (int, float)) and not isinstance(meta.get(field), bool)]
+            values = np.asarray([self.metadata[i][field] for i in rows], dtype=np.float64)
+            order = np.argsort(values, kind="stable")
+            column = (values[order], np.asarray(rows, dtype=np.int32)[order])
+            self._numeric[field] = column
+        return column
+
+
+def _hashable(value: Any) -> Any:
+    # 3 and 3.0 compare equal in filters (as in Pinecone); lists can't be dict keys
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.tokens import cached_count_tokens, truncate_tokens
+
+load_dotenv()
+
+# Evidence budget applied at retrieval time (the prompt-level packer may shrink it further)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Per-chunk cap: the chunker's target plus the short tail it may merge in
+CHUNK_TOKEN_CAP = int(os.getenv("CHUNK_TOKEN_CAP", "320"))
+
+
+def relevance(result: Dict[str, Any]) -> float:
+    """
+    Ordering key for a result: the reranker's blended rank_score when it was
+    reranked, else its retrieval score.
+    """
+    return float(result.get("rank_score", result.get("score", 0.0)))
+
+
+def knapsack(values: List[float], weights: List[int], capacity: int) -> List[int]:
+    """
+    0/1 knapsack: indices (ascending) maximizing total value with total weight
+    <= capacity. O(len(values) * capacity) via a NumPy DP row per item.
+    """
+    if capacity <= 0 or not values:
+        return []
+
+    best = np.zeros(capacity + 1, dtype=np.float64)
+    keep = np.zeros((len(values), capacity + 1), dtype=bool)
+    for i, (value, weight) in enumerate(zip(values, weights)):
+        if weight > capacity:
+            continue
+        if weight <= 0:
+            keep[i, :] = True
+            best = best + value
+            continue
+        candidate = np.full(capacity + 1, -np.inf)
+        candidate[weight:] = best[: capacity + 1 - weight] + value
+        take = candidate > best
+        keep[i] = take
+        best = np.where(take, candidate, best)
+
+    chosen = []
+    c = capacity
+    for i in range(len(values) - 1, -1, -1):
+        if keep[i, c]:
+            chosen.append(i)
+            c -= max(0, weights[i])
+    return sorted(chosen)
+
+
+def pack_by_tokens(
+    results: List[Dict[str, Any]],
+    max_context_tokens: int = CONTEXT_TOKEN_BUDGET,
+    per_chunk_token_cap: int = CHUNK_TOKEN_CAP,
+    entry_overhead_tokens: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Token-budgeted replacement for trim_to_max_chars: cap each chunk at
+    per_chunk_token_cap, then pick the subset with the highest total relevance that
+    fits max_context_tokens (smaller later chunks can fill space a large one
+    leaves). entry_overhead_tokens is added per chunk (citation header etc.).
+    Output keeps the input (relevance) order.
+    """
+    candidates, costs = [], []
+    for r in results:
+        text = (r.get("text") or "").strip()
+        if not text:
+            continue
+        if cached_count_tokens(text) > per_chunk_token_cap:
+            text = truncate_tokens(text, per_chunk_token_cap).strip()
+        r2 = dict(r)
+        r2["text"] = text
+        candidates.append(r2)
+        costs.append(cached_count_tokens(text) + entry_overhead_tokens)
+
+    chosen = knapsack([relevance(r) for r in candidates], costs, max_context_tokens)
+    return [candidates[i] for i in chosen]
@@ -1,21 +1,23 @@
 import os
 import hashlib
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 
 from rag.chunking import TextChunk
 from rag.embeddings import embed_texts
+from rag.concurrency import call_with_backoff, map_ordered
+from rag.clients import INDEX_NAME, EMBED_DIMS, get_pinecone_index
+from rag.vector_store import VectorStore, VECTOR_BACKEND, get_vector_store
 
 load_dotenv()
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "heydocai-medkb")
-CLOUD = os.getenv("PINECONE_CLOUD", "aws")
-REGION = os.getenv("PINECONE_REGION", "us-east-1")
-
-# For text-embedding-3-small
-EMBED_DIMS = 1536
+# In-flight requests per remote API during indexing
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "2"))
+# Chunk text lives in the local chunk store (rag/chunk_store.py); set to 1 to also copy
+# it into vector metadata, for app hosts that don't share LOCAL_INDEX_DIR with the builder
+CHUNK_TEXT_IN_METADATA = os.getenv("CHUNK_TEXT_IN_METADATA", "0") == "1"
 
 def _make_id(meta: dict) -> str:
     """
@@ -25,46 +27,80 @@ def _make_id(meta: dict) -> str:
     return hashlib.sha1(base.encode("utf-8")).hexdigest()
 
 def get_index():
-    if not PINECONE_API_KEY:
-        raise ValueError("Missing PINECONE_API_KEY in .env")
+    """
+    Shared Pinecone Index handle, creating the index on first use if missing.
+    """
+    return get_pinecone_index(INDEX_NAME, create=True)
 
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    existing = [idx["name"] for idx in pc.list_indexes()]
+def get_store(backend: Optional[str] = None) -> VectorStore:
+    """
+    Store to write into. Pinecone goes through get_index() so the index is created if missing.
+    """
+    backend = (backend or VECTOR_BACKEND).lower()
+    if backend == "pinecone":
+        get_index()
+    return get_vector_store(backend)
 
-    if INDEX_NAME not in existing:
-        pc.create_index(
-            name=INDEX_NAME,
-            dimension=EMBED_DIMS,
-            metric="cosine",
-            spec=ServerlessSpec(cloud=CLOUD, region=REGION),
-        )
+def build_upserts(batch: List[TextChunk], vectors: List[List[float]]) -> List[dict]:
+    """
+    Pair chunks with their embeddings as vector-store records. The chunk
+    text is left out of the metadata (it is served from the chunk store)
+    unless CHUNK_TEXT_IN_METADATA is set.
+    """
+    upserts = []
+    for c, vec in zip(batch, vectors):
+        meta = dict(c.metadata)
+        if CHUNK_TEXT_IN_METADATA:
+            meta["text"] = c.text  # store snippet for citations
+        vec_id = _make_id(meta)
 
-    return pc.Index(INDEX_NAME)
+        upserts.append({
+            "id": vec_id,
+            "values": vec,
+            "metadata": meta
+        })
+    return upserts
 
-def upsert_chunks(chunks: List[TextChunk], batch_size: int = 64):
-    index = get_index()
+def embed_batch(batch: List[TextChunk], max_retries: int = 5) -> List[dict]:
+    """
+    Embed one batch (with rate-limit-aware retry) and return its upsert records.
+    """
+    vectors = call_with_backoff(embed_texts, [c.text for c in batch], max_retries=max_retries)
+    return build_upserts(batch, vectors)
+
+def upsert_chunks(
+    chunks: List[TextChunk],
+    batch_size: int = 64,
+    store: Optional[VectorStore] = None,
+    embed_workers: int = EMBED_CONCURRENCY,
+    upsert_workers: int = UPSERT_CONCURRENCY,
+    max_retries: int = 5,
+):
+    """
+    Embed and upsert in batches with up to `embed_workers` embedding requests and
+    `upsert_workers` upserts in flight. Each batch is retried independently;
+    progress is reported in batch order.
+    """
+    if store is None:
+        store = get_store()
 
     total = len(chunks)
-    print(f"Upserting {total} chunks into Pinecone index '{INDEX_NAME}'...")
-
-    for start in range(0, total, batch_size):
-        batch = chunks[start:start + batch_size]
-        texts = [c.text for c in batch]
-        vectors = embed_texts(texts)
+    target = f"Pinecone index '{INDEX_NAME}'" if store.name == "pinecone" else f"{store.name} index"
+    print(f"Upserting {total} chunks into {target}...")
 
-        upserts = []
-        for c, vec in zip(batch, vectors):
-            meta = dict(c.metadata)
-            meta["text"] = c.text  # store snippet for citations
-            vec_id = _make_id(meta)
+    batches = (chunks[start:start + batch_size] for start in range(0, total, batch_size))
 
-            upserts.append({
-                "id": vec_id,
-                "values": vec,
-                "metadata": meta
-            })
+    def upsert(records: List[dict]) -> int:
+        call_with_backoff(store.upsert, records, max_retries=max_retries)
+        return len(records)
 
-        index.upsert(vectors=upserts)
-        print(f"{min(start + batch_size, total)}/{total} upserted")
+    done = 0
+    with ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="embed") as embed_pool, \
+            ThreadPoolExecutor(max_workers=upsert_workers, thread_name_prefix="upsert") as upsert_pool:
+        embedded = map_ordered(embed_pool, lambda b: embed_batch(b, max_retries), batches, window=embed_workers)
+        for n in map_ordered(upsert_pool, upsert, embedded, window=upsert_workers):
+            done += n
+            print(f"{done}/{total} upserted")
 
+    store.flush()
     print("Upsert complete.")
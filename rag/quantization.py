@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+# none = exact float32; float16 halves storage; int8 (per-vector scale) quarters it
+QUANT_MODES = ("none", "float16", "int8")
+
+# Rows widened to float32 at a time while scoring codes (~16 MB per block)
+_SCAN_BYTES = 1 << 24
+
+
+def check_mode(mode: str) -> str:
+    mode = (mode or "none").lower()
+    if mode not in QUANT_MODES:
+        raise ValueError(f"Unknown quantization: {mode!r} (expected one of {', '.join(QUANT_MODES)})")
+    return mode
+
+
+def quantize(mat: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    (codes, scales) for a 2-D float matrix. int8 uses a symmetric per-row
+    scale (row max |x| / 127), so a row decodes as codes * scale; float16
+    has no scales. Rows are converted in blocks, so mat may be a large memmap.
+    """
+    mode = check_mode(mode)
+    if mode == "none":
+        return np.asarray(mat, dtype=np.float32), None
+
+    n = mat.shape[0]
+    dims = mat.shape[1] if mat.ndim == 2 else 0
+    rows = max(1, _SCAN_BYTES // max(dims * 4, 1))
+    if mode == "float16":
+        codes = np.empty((n, dims), dtype=np.float16)
+        for lo in range(0, n, rows):
+            codes[lo:lo + rows] = mat[lo:lo + rows]
+        return codes, None
+
+    codes = np.empty((n, dims), dtype=np.int8)
+    scales = np.empty(n, dtype=np.float32)
+    for lo in range(0, n, rows):
+        block = np.asarray(mat[lo:lo + rows], dtype=np.float32)
+        scale = np.abs(block).max(axis=1, initial=0.0) / 127.0
+        scale[scale == 0] = 1.0
+        codes[lo:lo + rows] = np.rint(block / scale[:, None])
+        scales[lo:lo + rows] = scale
+    return codes, scales
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    out = np.asarray(codes, dtype=np.float32)
+    return out * scales[:, None] if scales is not None else out
+
+
+def score_codes(q: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    q (b, d) float32 against quantized rows: (b, n) approximate dot products.
+    NumPy has no BLAS kernel for int8/float16, so codes are widened to
+    float32 a block of rows at a time; peak extra memory is one block, not
+    a float32 copy of the index.
+    """
+    n, dims = codes.shape
+    out = np.empty((q.shape[0], n), dtype=np.float32)
+    rows = max(1, _SCAN_BYTES // max(dims * 4, 1))
+    for lo in range(0, n, rows):
+        out[:, lo:lo + rows] = q @ np.asarray(codes[lo:lo + rows], dtype=np.float32).T
+    if scales is not None:
+        out *= scales
+    return out
+
+
+def encode_vector(vec: np.ndarray, mode: str) -> bytes:
+    """One vector as a blob: float32/float16 values, or int8 codes followed by a float32 scale."""
+    mode = check_mode(mode)
+    vec = np.asarray(vec, dtype=np.float32).reshape(1, -1)
+    if mode == "none":
+        return vec.tobytes()
+    codes, scales = quantize(vec, mode)
+    return codes.tobytes() + (scales.tobytes() if scales is not None else b"")
+
+
+def decode_vector(blob: bytes, mode: str) -> np.ndarray:
+    mode = check_mode(mode)
+    if mode == "none":
+        return np.frombuffer(blob, dtype=np.float32)
+    if mode == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    codes = np.frombuffer(blob[:-4], dtype=np.int8)
+    (scale,) = np.frombuffer(blob[-4:], dtype=np.float32)
+    return codes.astype(np.float32) * scale
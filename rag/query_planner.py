@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# Terms patients typically need explained, grouped loosely by region. Matching
+# is case-insensitive and treats hyphens and spaces alike ("ground glass" ==
+# "ground-glass"); plural forms are matched by the pattern, not listed.
+RADIOLOGY_LEXICON = frozenset("""
+atelectasis|consolidation|pleural effusion|effusion|pneumothorax|hydropneumothorax|pneumonia
+|ground-glass opacity|ground-glass|opacity|infiltrate|interstitial thickening|septal thickening
+|reticular opacities|honeycombing|bronchiectasis|bronchial wall thickening|emphysema|bulla|bleb
+|air bronchogram|air trapping|mosaic attenuation|tree-in-bud|nodule|pulmonary nodule|mass|cavitation
+|granuloma|calcified granuloma|hilar lymphadenopathy|lymphadenopathy|mediastinal widening
+|pulmonary edema|interstitial edema|kerley b lines|vascular congestion|cephalization|cardiomegaly
+|pericardial effusion|aortic ectasia|aortic aneurysm|tortuous aorta|pulmonary embolism|fibrosis
+|scarring|subsegmental atelectasis|linear atelectasis|costophrenic angle|blunting|hyperinflation
+|elevated hemidiaphragm|pleural thickening|pleural plaque|empyema|abscess|hiatal hernia
+|degenerative changes|spondylosis|osteophyte|osteopenia|osteoporosis|compression fracture|fracture
+|lytic lesion|sclerotic lesion|osteomyelitis|joint effusion|osteoarthritis|subchondral sclerosis
+|joint space narrowing|bone marrow edema|meniscal tear|ligament tear|tendinosis|bursitis|enthesophyte
+|disc herniation|disc bulge|spinal stenosis|foraminal stenosis|spondylolisthesis|hepatomegaly
+|splenomegaly|hepatic steatosis|fatty liver|cirrhosis|cholelithiasis|gallstones|cholecystitis
+|biliary dilatation|hydronephrosis|nephrolithiasis|renal cyst|simple cyst|complex cyst|ascites
+|free air|pneumoperitoneum|bowel obstruction|ileus|diverticulosis|diverticulitis|appendicitis
+|colitis|wall thickening|fat stranding|lesion|cyst|hemangioma|adenoma|metastasis|neoplasm|malignancy
+|infarct|ischemia|hemorrhage|hematoma|subdural hematoma|white matter hyperintensities|microvascular
+|small vessel disease|atrophy|volume loss|midline shift|mass effect|edema|hydrocephalus|aneurysm
+|stenosis|occlusion|thrombus|thrombosis|plaque|calcification|enhancement|contrast enhancement
+|hypodense|hyperdense|hypoechoic|hyperechoic|isoechoic|heterogeneous|homogeneous|incidental
+|incidentaloma|benign|unremarkable|no acute|postoperative changes|surgical clips|sternotomy wires
+|lines and tubes|endotracheal tube|central venous catheter|nasogastric tube|pacemaker
+|birads|bi-rads|lung-rads|li-rads|ti-rads|spiculated|well-circumscribed
+""".replace("\n", "").split("|"))
+
+# Section headings (any case) -> canonical section name
+_SECTIONS = {
+    "impression": "impression", "conclusion": "impression", "conclusions": "impression",
+    "assessment": "impression", "summary": "impression", "opinion": "impression",
+    "findings": "findings", "finding": "findings", "report": "findings", "description": "findings",
+    "history": "history", "clinical history": "history", "indication": "history",
+    "indications": "history", "reason for exam": "history", "clinical information": "history",
+    "technique": "technique", "comparison": "comparison", "procedure": "technique",
+}
+_HEADING = re.compile(
+    r"(?:^|(?<=[\s.]))(" + "|".join(sorted(map(re.escape, _SECTIONS), key=len, reverse=True)) + r")\s*:",
+    re.IGNORECASE,
+)
+
+
+def _term_pattern(term: str) -> str:
+    pattern = re.escape(term).replace(r"\-", r"[-\s]").replace(r"\ ", r"[-\s]")
+    # opacity/opacities, nodule/nodules, mass/masses
+    return pattern[:-1] + "(?:y|ies)" if term.endswith("y") else pattern + "(?:e?s)?"
+
+
+# Longest terms first so "pleural effusion" wins over "effusion"
+_TERMS = re.compile(
+    r"\b(?:" + "|".join(_term_pattern(t) for t in sorted(RADIOLOGY_LEXICON, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+# A cue earlier in the same sentence negates a term; "no (interval) change" does not
+_NEGATION = re.compile(
+    r"\b(?:no(?!\s+(?:significant\s+|interval\s+)?change)|without|negative for|free of|resolved"
+    r"|resolution of|absence of|not seen)\b[^.;]*$",
+    re.IGNORECASE,
+)
+# Reassuring boilerplate rather than findings to look up
+_LOW_VALUE = frozenset({"no acute", "unremarkable", "benign", "homogeneous", "incidental"})
+
+# Where a term was found, best first; negated mentions rank after all positive ones
+_SECTION_RANK = {"impression": 0, "findings": 1, "body": 2, "history": 3, "technique": 4, "comparison": 5}
+
+
+def split_sections(report_text: str) -> Dict[str, str]:
+    """
+    Report text by canonical section (impression, findings, history, ...).
+    Text before the first heading, or a report without headings, is "body";
+    repeated headings are concatenated.
+    """
+    sections: Dict[str, str] = {}
+    matches = list(_HEADING.finditer(report_text))
+    starts = [(0, "body")] + [(m.end(), _SECTIONS[m.group(1).lower()]) for m in matches]
+    ends = [m.start() for m in matches] + [len(report_text)]
+    for (start, name), end in zip(starts, ends):
+        text = report_text[start:end].strip()
+        if text:
+            sections[name] = f"{sections[name]} {text}".strip() if name in sections else text
+    return sections
+
+
+_CANONICAL = {" ".join(t.replace("-", " ").split()): t for t in RADIOLOGY_LEXICON}
+
+
+def _canonical(term: str) -> str:
+    """Lexicon spelling of a matched term (plural, case and hyphens normalised)."""
+    term = " ".join(term.lower().replace("-", " ").split())
+    for candidate in (term, term[:-1], term[:-2], term[:-3] + "y"):
+        if candidate in _CANONICAL:
+            return _CANONICAL[candidate]
+    return term
+
+
+@dataclass
+class QueryPlan:
+    """Retrieval queries for one report and the lexicon terms behind them."""
+    queries: List[str]
+    terms: List[str] = field(default_factory=list)
+    negated: List[str] = field(default_factory=list)
+    sections: List[str] = field(default_factory=list)
+
+
+def extract_terms(report_text: str) -> Tuple[List[str], List[str]]:
+    """
+    Lexicon terms in the report as (positive, negated), each best first:
+    impression before findings before other sections, then by first mention.
+    A term is negated only if every mention follows a negation cue in its
+    sentence ("No pneumothorax", "negative for consolidation").
+    """
+    best: Dict[str, Tuple[int, int]] = {}  # term -> (section rank, first offset)
+    positive: set = set()
+    offset = 0
+    for name, text in split_sections(report_text).items():
+        for m in _TERMS.finditer(text):
+            term = _canonical(m.group(0))
+            if term in _LOW_VALUE:
+                continue
+            sentence_start = max(text.rfind(".", 0, m.start()), text.rfind(";", 0, m.start())) + 1
+            if not _NEGATION.search(text, sentence_start, m.start()):
+                positive.add(term)
+            key = (_SECTION_RANK.get(name, 2), offset + m.start())
+            if term not in best or key < best[term]:
+                best[term] = key
+        offset += len(text)
+
+    ordered = sorted(best, key=best.get)
+    return [t for t in ordered if t in positive], [t for t in ordered if t not in positive]
+
+
+def _words(term: str) -> str:
+    return f" {term.replace('-', ' ')} "
+
+
+def _drop_overlaps(terms: List[str], keep: List[str] = ()) -> List[str]:
+    """
+    terms in order, minus any that overlap a longer one: "effusion" goes
+    when "pleural effusion" is present (the longer term takes the shorter
+    one's place). Terms overlapping anything in keep are dropped outright.
+    """
+    out: List[str] = []
+    for term in terms:
+        if any(_words(term) in _words(k) or _words(k) in _words(term) for k in keep):
+            continue
+        if any(_words(term) in _words(t) for t in out):
+            continue
+        covered = [i for i, t in enumerate(out) if _words(t) in _words(term)]
+        if covered:
+            out[covered[0]] = term
+            out = [t for i, t in enumerate(out) if i not in covered[1:]]
+        else:
+            out.append(term)
+    return out
+
+
+def plan_queries(report_text: str, max_queries: int = 6, max_negated: int = 1) -> QueryPlan:
+    """
+    Turn a whole report into a few focused retrieval queries, with no LLM
+    call: one per key lexicon term (positive findings first, impression
+    before findings), plus the impression itself when there is one.
+    A term contained in a longer selected one ("nodule" in "pulmonary
+    nodule") is dropped, and at most max_negated queries go to negated
+    findings, so "No pneumothorax or effusion" can't crowd out the rest.
+    queries is empty when the report has neither.
+    """
+    sections = split_sections(report_text)
+    positive, negated = extract_terms(report_text)
+    positive = _drop_overlaps(positive)
+    negated = _drop_overlaps(negated, keep=positive)[: max(0, max_negated)]
+
+    queries: List[str] = []
+    impression = sections.get("impression")
+    if impression:
+        queries.append(f"Explain this radiology impression: {impression[:300]}")
+
+    terms = (positive + negated)[: max(0, max_queries - len(queries))]
+    queries.extend(f"What does {t} mean in a radiology report?" for t in terms)
+
+    return QueryPlan(
+        queries=queries,
+        terms=terms,
+        negated=[t for t in negated if t in terms],
+        sections=list(sections),
+    )
@@ -1,21 +1,30 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
+
+from rag.packing import CHUNK_TOKEN_CAP, pack_by_tokens, relevance
+from rag.rerank import rerank
+from rag.tracing import span
 
 
 def dedupe_by_source_page(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Keep only the best-scoring chunk per (source, page).
+    Keep only the most relevant chunk per (source, page).
     Prevents the context from being dominated by one page.
     """
     best: dict[Tuple[str, int], Dict[str, Any]] = {}
     for r in results:
         meta = r.get("metadata", {})
         key = (meta.get("source", "unknown"), int(meta.get("page", -1)))
-        if key not in best or r.get("score", 0) > best[key].get("score", 0):
+        if key not in best or relevance(r) > relevance(best[key]):
             best[key] = r
-    # preserve sorting by score descending
-    return sorted(best.values(), key=lambda x: x.get("score", 0), reverse=True)
+    # preserve sorting by relevance descending
+    return sorted(best.values(), key=relevance, reverse=True)
+
+
+def keyword_only(result: Dict[str, Any]) -> bool:
+    """True for a hybrid hit that BM25 found and the vector search did not."""
+    return "lexical_score" in result and "vector_score" not in result
 
 
 def filter_by_threshold(
@@ -24,8 +33,41 @@ def filter_by_threshold(
 ) -> List[Dict[str, Any]]:
     """
     Remove weak matches. Score ranges vary; 0.50 is a good starting point.
+    Keyword-only hybrid hits have no similarity to compare; they were gated
+    on BM25 query-term coverage instead and are kept.
+    """
+    return [r for r in results if r.get("score", 0.0) >= min_score or keyword_only(r)]
+
+
+def fuse_rrf(result_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
     """
-    return [r for r in results if r.get("score", 0.0) >= min_score]
+    Reciprocal rank fusion of ranked result lists (e.g. vector + BM25) by id.
+    The fused value sum(1 / (k + rank)), scaled so rank 1 in every list is
+    1.0, goes in "rank_score" and orders the output. "score" keeps the
+    first list's score (0.0 for ids only later lists found), so fusing
+    [vector, lexical] leaves it the vector similarity that min_score and
+    the UI refer to. Each input's own score is kept under
+    "<retriever>_score" when the result dict carries a "retriever" key
+    ("vector", "lexical").
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    rrf: Dict[str, float] = {}
+    first = {r.get("id"): r.get("score", 0.0) for r in (result_lists[0] if result_lists else [])}
+    for results in result_lists:
+        for rank, r in enumerate(results, start=1):
+            rid = r.get("id")
+            if rid not in fused:
+                fused[rid] = {k_: v for k_, v in r.items() if k_ != "retriever"}
+                rrf[rid] = 0.0
+            rrf[rid] += 1.0 / (k + rank)
+            if "retriever" in r:
+                fused[rid][f"{r['retriever']}_score"] = r.get("score", 0.0)
+
+    best = len([res for res in result_lists if res]) / (k + 1)
+    for rid, r in fused.items():
+        r["score"] = first.get(rid, 0.0)
+        r["rank_score"] = rrf[rid] / best if best else 0.0
+    return sorted(fused.values(), key=lambda x: x["rank_score"], reverse=True)
 
 
 def trim_to_max_chars(
@@ -64,21 +106,38 @@ def rank_and_filter(
     max_context_chars: int = 4500,
     per_chunk_char_cap: int = 900,
     final_top_k: int = 6,
+    max_context_tokens: Optional[int] = None,
+    per_chunk_token_cap: int = CHUNK_TOKEN_CAP,
+    query: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """
     Full ranking/filtering pipeline:
     1) score threshold
-    2) dedupe by (source,page)
-    3) sort by score
-    4) limit count
-    5) trim by total character budget
+    2) rerank against query (when given and a reranker is configured),
+       dropping marginal chunks
+    3) dedupe by (source,page)
+    4) sort by relevance (rank_score when reranked)
+    5) limit count
+    6) fit the budget: token knapsack when max_context_tokens is set,
+       else the character budget
     """
-    step1 = filter_by_threshold(raw_results, min_score=min_score)
-    step2 = dedupe_by_source_page(step1)
-    step3 = step2[:final_top_k]
-    step4 = trim_to_max_chars(
-        step3,
-        max_context_chars=max_context_chars,
-        per_chunk_char_cap=per_chunk_char_cap
-    )
-    return step4
+    with span("ranking", candidates=len(raw_results)) as sp:
+        step1 = filter_by_threshold(raw_results, min_score=min_score)
+        if query:
+            step1 = rerank(query, step1)
+        step2 = dedupe_by_source_page(step1)
+        step3 = step2[:final_top_k]
+        if max_context_tokens is not None:
+            step4 = pack_by_tokens(
+                step3,
+                max_context_tokens=max_context_tokens,
+                per_chunk_token_cap=per_chunk_token_cap,
+            )
+        else:
+            step4 = trim_to_max_chars(
+                step3,
+                max_context_chars=max_context_chars,
+                per_chunk_char_cap=per_chunk_char_cap
+            )
+        sp.set(above_threshold=len(step1), kept=len(step4))
+        return step4
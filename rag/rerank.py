@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.bm25 import get_bm25_index, tokenize
+from rag.packing import relevance
+from rag.query_cache import TTLLRUCache, normalize_query
+from rag.tracing import span
+
+load_dotenv()
+
+# feature (default) | onnx | none
+RERANKER = os.getenv("RERANKER", "feature").lower()
+# Directory with model.onnx + tokenizer.json (e.g. an exported ms-marco MiniLM cross-encoder)
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR", "models/reranker")
+RERANK_BATCH = int(os.getenv("RERANK_BATCH", "16"))
+# No new batch is started once this much time has been spent; unscored candidates rank last
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "50"))
+# Combined score (relative to the best candidate) a chunk needs to reach the prompt
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0.5"))
+RERANK_MIN_KEEP = int(os.getenv("RERANK_MIN_KEEP", "2"))
+# Retrieval scores closer than this are treated as near-ties rather than stretched to 0..1
+RETRIEVAL_SPREAD_FLOOR = 0.1
+
+# Raw reranker scores keyed by (reranker, normalized query, chunk id)
+_score_cache = TTLLRUCache(
+    maxsize=int(os.getenv("RERANK_CACHE_SIZE", "4096")),
+    ttl_sec=float(os.getenv("QUERY_CACHE_TTL_SEC", "600")),
+)
+
+
+class Reranker:
+    """
+    Scores (query, chunk text) pairs in batches. score() returns raw
+    relevance in [0, 1]; rerank() blends it with the retrieval score using
+    retrieval_weight.
+    """
+
+    name = "base"
+    retrieval_weight = 0.5
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        raise NotImplementedError
+
+
+class FeatureReranker(Reranker):
+    """
+    Lexical features, no model: IDF-weighted share of the query terms found
+    in the chunk (IDF from the BM25 index when built, else uniform) and the
+    share of query bigrams found verbatim. Well under a millisecond per chunk.
+    """
+
+    name = "feature"
+    retrieval_weight = 0.7
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        q_tokens = tokenize(query)
+        terms = list(dict.fromkeys(q_tokens))
+        if not terms:
+            return [0.0] * len(texts)
+        weights = self._idf_weights(terms)
+        total = sum(weights.values())
+        q_bigrams = set(zip(q_tokens, q_tokens[1:]))
+
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            present = set(tokens)
+            coverage = sum(w for t, w in weights.items() if t in present) / total
+            phrase = len(q_bigrams & set(zip(tokens, tokens[1:]))) / len(q_bigrams) if q_bigrams else 0.0
+            scores.append(0.75 * coverage + 0.25 * phrase)
+        return scores
+
+    @staticmethod
+    def _idf_weights(terms: List[str]) -> Dict[str, float]:
+        index = get_bm25_index()
+        if index is None or len(index) == 0:
+            return {t: 1.0 for t in terms}
+        return {t: index.idf(t) for t in terms}
+
+
+class OnnxCrossEncoder(Reranker):
+    """
+    Cross-encoder exported to ONNX, run on CPU with onnxruntime. Needs the
+    optional `onnxruntime` and `tokenizers` packages and RERANK_MODEL_DIR
+    holding model.onnx + tokenizer.json. Logits are squashed with a sigmoid.
+    """
+
+    name = "onnx"
+    retrieval_weight = 0.3
+
+    def __init__(self, model_dir: str | Path = RERANK_MODEL_DIR, max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        self.session = ort.InferenceSession(str(model_dir / "model.onnx"), providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        encodings = self.tokenizer.encode_batch([(query, t) for t in texts])
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        logits = np.asarray(logits).reshape(len(texts), -1)[:, -1]
+        return [1.0 / (1.0 + math.exp(-float(x))) for x in logits]
+
+
+_reranker: Optional[Reranker] = None
+_reranker_loaded = False
+
+
+def get_reranker() -> Optional[Reranker]:
+    """
+    Process-wide reranker for RERANKER, or None when disabled. An ONNX model
+    that can't be loaded falls back to the feature scorer.
+    """
+    global _reranker, _reranker_loaded
+    if _reranker_loaded:
+        return _reranker
+
+    if RERANKER == "onnx":
+        try:
+            _reranker = OnnxCrossEncoder(RERANK_MODEL_DIR)
+        except Exception as e:
+            print(f"[rerank] ONNX reranker unavailable ({type(e).__name__}: {e}); using feature scorer")
+            _reranker = FeatureReranker()
+    elif RERANKER == "feature":
+        _reranker = FeatureReranker()
+    elif RERANKER != "none":
+        raise ValueError(f"Unknown RERANKER: {RERANKER!r} (expected 'feature', 'onnx' or 'none')")
+    _reranker_loaded = True
+    return _reranker
+
+
+def rerank(
+    query: str,
+    results: List[Dict[str, Any]],
+    reranker: Optional[Reranker] = None,
+    budget_ms: float = RERANK_BUDGET_MS,
+    min_score: float = RERANK_MIN_SCORE,
+    min_keep: int = RERANK_MIN_KEEP,
+    batch_size: int = RERANK_BATCH,
+) -> List[Dict[str, Any]]:
+    """
+    Rescore retrieved chunks for query, best first.
+
+    Candidates are scored in retrieval order, in batches, reusing cached
+    scores per (query, chunk id); once budget_ms is spent no new batch
+    starts and the unscored (weakest) candidates follow the scored ones in
+    retrieval order, with rerank_score None. The retrieval order is
+    rag.packing.relevance (the RRF rank_score for hybrid results, else the
+    similarity), saved as "retrieval_score". Each scored result gets a
+    rank_score blending that retrieval value rescaled over the candidate set
+    (best 1.0, worst 0.0 unless the spread is under RETRIEVAL_SPREAD_FLOOR)
+    and rerank / best rerank, weighted by retrieval_weight. "score" is left
+    alone, so it stays the similarity min_score thresholds and the UI use.
+    Scored chunks with a rank_score below min_score are dropped, but at
+    least min_keep are kept.
+    """
+    reranker = reranker or get_reranker()
+    if reranker is None or not results:
+        return results
+
+    with span("rerank", reranker=reranker.name, candidates=len(results)) as sp:
+        t0 = time.perf_counter()
+        qkey = normalize_query(query)
+        ordered = sorted(results, key=relevance, reverse=True)
+        raw: List[Optional[float]] = [
+            _score_cache.get((reranker.name, qkey, r.get("id") or r.get("text", ""))) for r in ordered
+        ]
+        cached = sum(1 for s in raw if s is not None)
+
+        todo = [i for i, s in enumerate(raw) if s is None]
+        exhausted = False
+        for start in range(0, len(todo), batch_size):
+            if start and (time.perf_counter() - t0) * 1000 > budget_ms:
+                exhausted = True
+                break
+            batch = todo[start:start + batch_size]
+            for i, s in zip(batch, reranker.score(query, [ordered[i].get("text", "") for i in batch])):
+                raw[i] = s
+                _score_cache.put((reranker.name, qkey, ordered[i].get("id") or ordered[i].get("text", "")), s)
+
+        retrieval = [relevance(r) for r in ordered]
+        top = max(retrieval, default=0.0)
+        spread = max(top - min(retrieval, default=0.0), RETRIEVAL_SPREAD_FLOOR)
+        best_rerank = max((s for s in raw if s is not None), default=0.0) or 1.0
+        w = reranker.retrieval_weight
+
+        out, unscored = [], []
+        for r, s, rs in zip(ordered, raw, retrieval):
+            r2 = dict(r)
+            r2["retrieval_score"] = rs
+            r2["rerank_score"] = s
+            if s is None:
+                unscored.append(r2)
+                continue
+            r2["rank_score"] = w * (1.0 - (top - rs) / spread) + (1 - w) * s / best_rerank
+            out.append(r2)
+        out.sort(key=lambda x: x["rank_score"], reverse=True)
+        kept = out[:max(min_keep, 0)] + [r for r in out[max(min_keep, 0):] if r["rank_score"] >= min_score]
+
+        # Never judged by the reranker: keep them, below every scored chunk, in retrieval order
+        floor = min((r["rank_score"] for r in kept), default=0.0)
+        for r2 in unscored:
+            r2["rank_score"] = min(floor, w * (1.0 - (top - r2["retrieval_score"]) / spread))
+        kept += unscored
+
+        sp.set(cached=cached, scored=len(raw) - len(unscored) - cached, kept=len(kept),
+               budget_exhausted=exhausted, unscored=len(unscored), ms=round((time.perf_counter() - t0) * 1000, 3))
+        return kept
+
+
+def rerank_cache_stats() -> Dict[str, float]:
+    return _score_cache.stats()
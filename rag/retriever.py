@@ -1,51 +1,307 @@
+import contextvars
+import logging
 import os
-from typing import List, Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from pinecone import Pinecone
 
+from rag.bm25 import get_bm25_index
+from rag.chunk_store import ChunkStore, chunk_store_reader
+from rag.concurrency import is_retryable
 from rag.embeddings import embed_texts
-from rag.ranking import rank_and_filter
+from rag.ranking import filter_by_threshold, fuse_rrf, rank_and_filter
+from rag.packing import CHUNK_TOKEN_CAP, CONTEXT_TOKEN_BUDGET
+from rag.manifest import current_manifest_version
+from rag.metadata_filter import filter_key, validate_filter
+from rag.query_cache import TTLLRUCache, normalize_query
+from rag.rerank import RERANKER
+from rag.tracing import span
+from rag.vector_store import VECTOR_BACKEND, VectorStore, get_vector_store
 
 load_dotenv()
 
-INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "heydocai-medkb")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+logger = logging.getLogger(__name__)
 
+# Ranked results keyed by normalized query + retrieval settings + index version
+_result_cache = TTLLRUCache(
+    maxsize=int(os.getenv("QUERY_CACHE_SIZE", "256")),
+    ttl_sec=float(os.getenv("QUERY_CACHE_TTL_SEC", "600")),
+)
 
-def retrieve_top_k(
-    query: str,
-    top_k: int = 12,              # fetch more initially
-    min_score: float = 0.50,      # filter after retrieval
-    final_top_k: int = 6,         # return fewer, higher-signal
-) -> List[Dict[str, Any]]:
-    if not query.strip():
-        return []
 
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    index = pc.Index(INDEX_NAME)
+# Queries per embeddings request in retrieve_many (API limit is 2048 inputs)
+EMBED_QUERY_BATCH = int(os.getenv("EMBED_QUERY_BATCH", "512"))
 
-    query_embedding = embed_texts([query])[0]
+# Hybrid retrieval: BM25 over the local inverted index, fused with the vector results
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Lexical hits must contain this IDF-weighted share of the query terms
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.5"))
+# Past this, hybrid retrieval answers from BM25 alone (0 = wait indefinitely)
+VECTOR_TIMEOUT_SEC = float(os.getenv("VECTOR_TIMEOUT_SEC", "10"))
+
+# Background vector searches in hybrid mode. Size it for concurrent callers (eval workers,
+# app sessions) so searches don't queue into the timeout
+VECTOR_SEARCH_WORKERS = int(os.getenv("VECTOR_SEARCH_WORKERS", "16"))
+_vector_pool = ThreadPoolExecutor(max_workers=VECTOR_SEARCH_WORKERS, thread_name_prefix="vector-search")
 
-    res = index.query(
-        vector=query_embedding,
-        top_k=top_k,
-        include_metadata=True,
-        include_values=False,
-    )
 
+def _to_raw_results(res: Dict[str, Any]) -> List[Dict[str, Any]]:
     raw_results = []
     for match in res.get("matches", []):
         meta = match.get("metadata", {}) or {}
         raw_results.append({
+            "id": match.get("id"),
             "text": meta.get("text", ""),
             "score": float(match.get("score", 0.0)),
             "metadata": meta,
         })
+    return raw_results
+
+
+def _lexical_results(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": h["id"],
+            "text": h["metadata"].get("text", ""),
+            "score": h["score"],
+            "metadata": h["metadata"],
+            "retriever": "lexical",
+        }
+        for h in hits
+    ]
+
 
-    return rank_and_filter(
-        raw_results,
+def _fill_missing_text(
+    candidates: List[List[Dict[str, Any]]],
+    store: Optional[VectorStore],
+) -> List[List[Dict[str, Any]]]:
+    """
+    Candidates still without text (id missing from a stale chunk store, or
+    vectors written without text and no chunk store) get their metadata
+    re-fetched from the vector store, in one call for the whole batch. Any
+    still blank are dropped with a warning: empty evidence must not reach
+    ranking (it would dedupe as (unknown, -1)) or the prompt.
+    """
+    missing = sorted({r["id"] for raw in candidates for r in raw if not (r.get("text") or "").strip()})
+    if not missing:
+        return candidates
+
+    fetched = store.fetch(missing) if store is not None else {}
+    out = []
+    dropped = set()
+    for raw in candidates:
+        kept = []
+        for r in raw:
+            if not (r.get("text") or "").strip():
+                meta = fetched.get(r["id"]) or {}
+                if not (meta.get("text") or "").strip():
+                    dropped.add(r["id"])
+                    continue
+                r = dict(r, text=meta["text"], metadata={**meta, **(r.get("metadata") or {})})
+            kept.append(r)
+        out.append(kept)
+    if dropped:
+        logger.warning("%d retrieved chunks have no text in the chunk store or vector metadata and were "
+                       "dropped; rebuild the index (or set CHUNK_TEXT_IN_METADATA=1 when the app can't "
+                       "read LOCAL_INDEX_DIR)", len(dropped))
+    return out
+
+
+def retrieve_top_k(
+    query: str,
+    top_k: int = 12,              # fetch more initially
+    min_score: float = 0.50,      # filter after retrieval
+    final_top_k: int = 6,         # return fewer, higher-signal
+    use_cache: bool = True,
+    timings: Optional[Dict[str, float]] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Pass a dict as `timings` to collect per-stage seconds
+    (embedding, vector_query, lexical, ranking); cache hits record none.
+    `metadata_filter` restricts evidence by chunk metadata, e.g.
+    {"source": {"$in": ["chest_xray_guide.pdf"]}} (see rag.metadata_filter).
+    """
+    return retrieve_many(
+        [query],
+        top_k=top_k,
         min_score=min_score,
         final_top_k=final_top_k,
-        max_context_chars=4500,
-        per_chunk_char_cap=900,
-    )
+        use_cache=use_cache,
+        timings=timings,
+        metadata_filter=metadata_filter,
+    )[0]
+
+
+def retrieve_many(
+    queries: List[str],
+    top_k: int = 12,
+    min_score: float = 0.50,
+    final_top_k: int = 6,
+    use_cache: bool = True,
+    timings: Optional[Dict[str, float]] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Batched retrieve_top_k: one result list per query, in order.
+    Cache misses are embedded in as few requests as possible (duplicates once)
+    and scored with one store.query_many call. `timings` gets batch totals.
+
+    When a BM25 index has been built (and HYBRID_RETRIEVAL is on), the vector
+    search runs in the background while BM25 answers in-thread; vector hits
+    above min_score and lexical hits covering LEXICAL_MIN_COVERAGE of the
+    query are fused with reciprocal rank fusion before rank_and_filter.
+    Fusion sets the order (rank_score); "score" stays the vector similarity,
+    0.0 for keyword-only hits (see rag.ranking.keyword_only). If
+    the vector side exceeds VECTOR_TIMEOUT_SEC or fails with a transient
+    error (rag.concurrency.is_retryable), the lexical results are used alone
+    (and not cached); any other error is raised.
+
+    `metadata_filter` is pushed down to the vector store (Pinecone filter=,
+    or the local metadata index) and to BM25, so both lists only hold
+    matching chunks.
+
+    When a chunk store has been built, chunk text and metadata are read from
+    it for the candidates left after thresholding and fusion, rather than
+    shipped back with every vector match.
+    """
+    # Held open until ranking is done: a rebuild meanwhile closes the old store afterwards
+    with chunk_store_reader() as chunks:
+        return _retrieve_many(queries, top_k, min_score, final_top_k, use_cache, timings, metadata_filter, chunks)
+
+
+def _retrieve_many(
+    queries: List[str],
+    top_k: int,
+    min_score: float,
+    final_top_k: int,
+    use_cache: bool,
+    timings: Optional[Dict[str, float]],
+    metadata_filter: Optional[Dict[str, Any]],
+    chunks: Optional[ChunkStore],
+) -> List[List[Dict[str, Any]]]:
+    if metadata_filter:
+        validate_filter(metadata_filter)
+    out: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+    version = current_manifest_version(VECTOR_BACKEND)
+    lexical = get_bm25_index() if HYBRID_RETRIEVAL else None
+    keys = {}
+
+    for i, query in enumerate(queries):
+        if not query.strip():
+            out[i] = []
+            continue
+        keys[i] = (normalize_query(query), top_k, min_score, final_top_k, VECTOR_BACKEND, version,
+                   lexical is not None, RERANKER, filter_key(metadata_filter))
+
+    if use_cache and keys:
+        with span("retrieval_cache", queries=len(keys)) as sp:
+            for i, key in keys.items():
+                cached = _result_cache.get(key)
+                if cached is not None:
+                    out[i] = cached
+            hits = sum(1 for i in keys if out[i] is not None)
+            sp.set(hit=hits == len(keys), hits=hits)
+
+    # Distinct normalized queries still needed -> positions waiting on them
+    pending: Dict[tuple, List[int]] = {}
+    for i, key in keys.items():
+        if out[i] is None:
+            pending.setdefault(key, []).append(i)
+
+    if pending:
+        store = get_vector_store()
+        texts = [queries[positions[0]] for positions in pending.values()]
+        stage: Dict[str, float] = {}
+
+        def dense_search() -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+            # Timings are returned, not written to `stage`: after a timeout this
+            # worker keeps running and must not overwrite the fallback's numbers
+            t0 = time.perf_counter()
+            embeddings = []
+            for start in range(0, len(texts), EMBED_QUERY_BATCH):
+                embeddings.extend(embed_texts(texts[start:start + EMBED_QUERY_BATCH]))
+            t1 = time.perf_counter()
+
+            with span("vector_query", backend=store.name, top_k=top_k, queries=len(texts),
+                      filtered=bool(metadata_filter)) as sp:
+                # With a chunk store the index returns ids + scores only; text comes from the store
+                responses = store.query_many(embeddings, top_k=top_k, include_metadata=chunks is None,
+                                             filter=metadata_filter)
+                sp.set(matches=sum(len(r.get("matches", [])) for r in responses))
+            return responses, {"embedding": t1 - t0, "vector_query": time.perf_counter() - t1}
+
+        degraded = False
+        if lexical is None:
+            responses, dense_stage = dense_search()
+            stage.update(dense_stage)
+            lexical_hits = [[] for _ in texts]
+        else:
+            # Copy the context so the worker's spans land in the caller's trace
+            future = _vector_pool.submit(contextvars.copy_context().run, dense_search)
+            tl = time.perf_counter()
+            with span("lexical_query", docs=len(lexical), queries=len(texts)) as sp:
+                lexical_hits = [
+                    _lexical_results(lexical.search(t, top_k=top_k, min_coverage=LEXICAL_MIN_COVERAGE,
+                                                    filter=metadata_filter))
+                    for t in texts
+                ]
+                sp.set(matches=sum(len(h) for h in lexical_hits))
+            stage["lexical"] = time.perf_counter() - tl
+            try:
+                responses, dense_stage = future.result(timeout=VECTOR_TIMEOUT_SEC or None)
+                stage.update(dense_stage)
+            except Exception as e:
+                # Only outages fall back to BM25; bad filters, dimension
+                # mismatches, auth errors and bugs surface to the caller
+                if not (isinstance(e, FutureTimeoutError) or is_retryable(e)):
+                    raise
+                degraded = True
+                responses = [{"matches": []} for _ in texts]
+                stage["vector_query"] = time.perf_counter() - tl
+                logger.warning("vector search unavailable (%s: %s); answering from BM25 only",
+                               type(e).__name__, e)
+
+        t2 = time.perf_counter()
+        candidates = []
+        for res, lex in zip(responses, lexical_hits):
+            raw = filter_by_threshold(_to_raw_results(res), min_score=min_score)
+            if lexical is not None:
+                dense = [dict(r, retriever="vector") for r in raw]
+                raw = fuse_rrf([dense, lex], k=RRF_K)
+            if chunks is not None:
+                # Only the surviving candidates are read (one decompression per touched block)
+                raw = chunks.hydrate(raw)
+            candidates.append(raw)
+        candidates = _fill_missing_text(candidates, None if degraded else store)
+
+        for (key, positions), raw in zip(pending.items(), candidates):
+            ranked = rank_and_filter(
+                raw,
+                query=queries[positions[0]],
+                min_score=min_score,
+                final_top_k=final_top_k,
+                max_context_tokens=CONTEXT_TOKEN_BUDGET,
+                per_chunk_token_cap=CHUNK_TOKEN_CAP,
+            )
+            if use_cache and not degraded:
+                _result_cache.put(key, ranked)
+            for i in positions:
+                out[i] = ranked
+        stage["ranking"] = time.perf_counter() - t2
+
+        if timings is not None:
+            timings.update(stage)
+
+    # Callers may mutate results; never hand out the cached dicts
+    return [[dict(r) for r in results] for results in out]
+
+
+def retrieval_cache_stats() -> Dict[str, float]:
+    return _result_cache.stats()
+
+
+def clear_retrieval_cache() -> None:
+    _result_cache.clear()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import List, Optional
+
+# Tokenizer used when no model is given (the chat model's, since prompts are what we budget)
+DEFAULT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+
+# Chat format overhead per message / per reply (OpenAI cookbook numbers)
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    """tiktoken encoding for model, or None if tiktoken is not installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or DEFAULT_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Exact count with tiktoken when available, else ~4 characters per token.
+    """
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=65536)
+def cached_count_tokens(text: str, model: Optional[str] = None) -> int:
+    """count_tokens memoized per text: KB chunks recur across queries."""
+    return count_tokens(text, model)
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Longest prefix of text within max_tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = _encoding(model)
+    if enc is None:
+        return text[: max_tokens * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])
+
+
+def count_message_tokens(messages: List[dict], model: Optional[str] = None) -> int:
+    """Prompt tokens for a chat-completions message list."""
+    total = TOKENS_PER_REPLY
+    for m in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(m.get("content") or "", model)
+    return total
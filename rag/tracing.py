@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "none" (collect in memory only), "jsonl" or "otel"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "logs/traces.jsonl")
+
+_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    """
+    One timed stage. Attributes hold counts and sizes only (never prompt or report text).
+    """
+    name: str
+    start: float
+    end: Optional[float] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    span_id: int = field(default_factory=lambda: next(_ids))
+    parent_id: Optional[int] = None
+    _trace: Optional["Trace"] = field(default=None, repr=False)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        """Close a span started with start_span(); safe to call twice."""
+        if self.end is None:
+            self.end = time.perf_counter()
+            if self._trace is not None:
+                self._trace.add(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - self._trace.start) * 1000, 3) if self._trace else 0.0,
+            "duration_ms": round(self.duration_ms, 3),
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """
+    All spans recorded for one request (e.g. one Explain click).
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.start_wall_ns = time.time_ns()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def stage_ms(self) -> Dict[str, float]:
+        """Total milliseconds per span name, in first-seen order."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        for s in spans:
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+        return totals
+
+    def attr(self, span_name: str, key: str, default=None):
+        """First value of an attribute recorded on spans with this name."""
+        with self._lock:
+            for s in self.spans:
+                if s.name == span_name and key in s.attrs:
+                    return s.attrs[key]
+        return default
+
+    def breakdown(self) -> str:
+        parts = [f"{name} {ms:.0f}ms" for name, ms in self.stage_ms().items()]
+        return " | ".join(parts + [f"total {self.duration_ms:.0f}ms"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_wall_ns / 1e9)),
+            "duration_ms": round(self.duration_ms, 3),
+            "attrs": self.attrs,
+            "spans": [s.to_dict() for s in spans],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("rag_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("rag_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def start_span(name: str, **attrs) -> Span:
+    """
+    Detached span for work that outlives a `with` block (e.g. a token stream);
+    call .finish() when done. It is not made the parent of later spans.
+    """
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    return Span(
+        name=name,
+        start=time.perf_counter(),
+        attrs=dict(attrs),
+        parent_id=parent.span_id if parent else None,
+        _trace=trace,
+    )
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """
+    Time a stage. Outside a trace the span is still returned but not recorded,
+    so instrumented functions cost next to nothing when nobody is tracing.
+    """
+    s = start_span(name, **attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        s.finish()
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Trace]:
+    """
+    Collect every span recorded inside the block (including worker threads
+    started via asyncio.to_thread / contextvars.copy_context) and export it.
+    """
+    t = Trace(name, **attrs)
+    t_token = _current_trace.set(t)
+    s_token = _current_span.set(None)
+    try:
+        yield t
+    finally:
+        _current_span.reset(s_token)
+        _current_trace.reset(t_token)
+        t.end = time.perf_counter()
+        exporter = get_exporter()
+        if exporter is not None:
+            try:
+                exporter.export(t)
+            except Exception as e:
+                print(f"[tracing] export failed: {type(e).__name__}: {e}")
+
+
+class JsonlExporter:
+    """Appends one JSON object per trace to a local file."""
+
+    def __init__(self, path: str | Path = TRACE_LOG_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, t: Trace) -> None:
+        line = json.dumps(t.to_dict())
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OTelExporter:
+    """
+    Replays finished traces into the globally configured OpenTelemetry tracer
+    provider (requires opentelemetry-api; configure the SDK/exporter as usual).
+    """
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError as e:
+            raise ImportError("TRACE_EXPORTER=otel requires `pip install opentelemetry-api opentelemetry-sdk`") from e
+        self._otel = otel_trace
+        self._tracer = otel_trace.get_tracer("heydoc.rag")
+
+    def _ns(self, t: Trace, perf: float) -> int:
+        return t.start_wall_ns + int((perf - t.start) * 1e9)
+
+    def export(self, t: Trace) -> None:
+        root = self._tracer.start_span(t.name, start_time=t.start_wall_ns, attributes=_otel_attrs(t.attrs))
+        contexts = {None: self._otel.set_span_in_context(root)}
+        with t._lock:
+            spans = sorted(t.spans, key=lambda s: s.start)
+        for s in spans:
+            parent_ctx = contexts.get(s.parent_id, contexts[None])
+            otel_span = self._tracer.start_span(
+                s.name, context=parent_ctx, start_time=self._ns(t, s.start), attributes=_otel_attrs(s.attrs)
+            )
+            contexts[s.span_id] = self._otel.set_span_in_context(otel_span)
+            otel_span.end(end_time=self._ns(t, s.end or t.end))
+        root.end(end_time=self._ns(t, t.end))
+
+
+def _otel_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v if isinstance(v, (bool, int, float, str)) else str(v) for k, v in attrs.items()}
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """Process-wide exporter selected by TRACE_EXPORTER, or None."""
+    global _exporter
+    if TRACE_EXPORTER in ("", "none"):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            if TRACE_EXPORTER == "jsonl":
+                _exporter = JsonlExporter(TRACE_LOG_PATH)
+            elif TRACE_EXPORTER == "otel":
+                _exporter = OTelExporter()
+            else:
+                raise ValueError(f"Unknown TRACE_EXPORTER: {TRACE_EXPORTER!r} (expected none, jsonl or otel)")
+    return _exporter
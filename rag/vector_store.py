@@ -0,0 +1,573 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from rag.ann import IVFIndex
+from rag.metadata_filter import MetadataIndex
+from rag.quantization import check_mode, quantize, score_codes
+
+load_dotenv()
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/index")
+# Parallel Pinecone requests for query_many (the index has no batch query endpoint)
+PINECONE_QUERY_CONCURRENCY = int(os.getenv("PINECONE_QUERY_CONCURRENCY", "8"))
+# Local index scoring precision: none (float32) | float16 | int8
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+# Quantized queries rescore top_k * this many candidates exactly from the float32 file (0 = off)
+QUANT_RESCORE = int(os.getenv("QUANT_RESCORE", "4"))
+# Approximate search for the local index: none (exact scan) | ivf
+LOCAL_ANN = os.getenv("LOCAL_ANN", "none").lower()
+# Inverted lists (0 = ~4 * sqrt(n)) and lists scanned per query
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Indexes smaller than this are always scanned exactly
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "50000"))
+
+
+class VectorStore:
+    """
+    Minimal vector-store interface used by the retriever and the upsert job.
+    Mirrors the subset of the Pinecone Index API this project relies on.
+    """
+
+    name = "base"
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """filter: Pinecone-style metadata filter (see rag.metadata_filter)."""
+        raise NotImplementedError
+
+    def query_many(
+        self,
+        vectors: List[List[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """One query() result per vector, in order. Backends override this to batch."""
+        return [self.query(v, top_k=top_k, include_metadata=include_metadata, filter=filter) for v in vectors]
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Metadata of the given ids (unknown ids are left out)."""
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Persist buffered writes (no-op for remote backends)."""
+        return None
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    Thin wrapper around a Pinecone Index handle.
+    """
+
+    name = "pinecone"
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        self.index.upsert(vectors=vectors)
+
+    def delete(self, ids: List[str]) -> None:
+        # Pinecone caps ids per delete request
+        for start in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[start:start + 1000])
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for start in range(0, len(ids), 1000):
+            res = self.index.fetch(ids=ids[start:start + 1000])
+            vectors = getattr(res, "vectors", None)
+            if vectors is None:
+                vectors = res.get("vectors", {})
+            for vid, vec in vectors.items():
+                meta = vec.get("metadata") if isinstance(vec, dict) else getattr(vec, "metadata", None)
+                out[vid] = dict(meta or {})
+        return out
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        # Filters run server-side, before top_k is taken
+        res = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=False,
+            **({"filter": filter} if filter else {}),
+        )
+        matches = []
+        for match in res.get("matches", []):
+            matches.append({
+                "id": match.get("id"),
+                "score": float(match.get("score", 0.0)),
+                "metadata": match.get("metadata", {}) or {},
+            })
+        return {"matches": matches}
+
+    def query_many(
+        self,
+        vectors: List[List[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        if len(vectors) <= 1:
+            return super().query_many(vectors, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # The shared Index handle is thread-safe; requests overlap on its connection pool
+        with ThreadPoolExecutor(max_workers=min(PINECONE_QUERY_CONCURRENCY, len(vectors))) as pool:
+            return list(pool.map(
+                lambda v: self.query(v, top_k=top_k, include_metadata=include_metadata, filter=filter), vectors
+            ))
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process cosine index for air-gapped deployments.
+
+    Vectors are L2-normalized at write time and kept as one contiguous
+    float32 matrix (memory-mapped from index_dir), so a query is a single
+    matrix-vector product followed by argpartition.
+
+    With quantization ("float16" or "int8") queries scan a compact copy of
+    the matrix instead (vectors_<mode>.npy, plus per-vector scales for
+    int8) and rescore the top top_k * rescore candidates exactly against
+    the float32 file, which is then only paged in for those rows.
+
+    With ann="ivf" an IVFIndex (rag.ann) is trained on flush once the index
+    holds min_ann_vectors, and queries score only the rows of the nprobe
+    nearest lists (through the codes when quantized). Upserts and deletes
+    keep it current without retraining; it is retrained on flush once the
+    index has outgrown its lists.
+
+    Metadata filters are evaluated against a MetadataIndex (posting lists
+    per field value, built at load and patched on every write for
+    source/doc_type; cached row masks), and only the matching rows are
+    scored, so a selective filter makes a query cheaper rather than
+    over-fetching and discarding.
+    """
+
+    name = "local"
+    VECTORS_FILE = "vectors.npy"
+    METADATA_FILE = "metadata.jsonl"
+    SCALES_FILE = "vector_scales.npy"
+
+    def __init__(
+        self,
+        index_dir: str | Path = LOCAL_INDEX_DIR,
+        quantization: str = VECTOR_QUANTIZATION,
+        rescore: int = QUANT_RESCORE,
+        ann: str = LOCAL_ANN,
+        nprobe: int = IVF_NPROBE,
+        nlist: int = IVF_NLIST,
+        min_ann_vectors: int = ANN_MIN_VECTORS,
+    ):
+        if ann not in ("none", "ivf"):
+            raise ValueError(f"Unknown LOCAL_ANN: {ann!r} (expected 'none' or 'ivf')")
+        self.index_dir = Path(index_dir)
+        self.quantization = check_mode(quantization)
+        self.rescore = rescore
+        self.ann = ann
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.min_ann_vectors = min_ann_vectors
+        self._ivf: Optional[IVFIndex] = None
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        # Quantized copy of _vectors; None when stale (rebuilt on the next query)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._pos: Dict[str, int] = {}
+        self._pending: Dict[str, tuple[np.ndarray, Dict[str, Any]]] = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+        # Filter indexes over _metadata, kept current by _consolidate and delete
+        self._meta_index = MetadataIndex(self._metadata)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._consolidate()
+            return len(self._ids)
+
+    @property
+    def dims(self) -> int:
+        return int(self._vectors.shape[1]) if self._vectors.size else 0
+
+    def _load(self) -> None:
+        vec_path = self.index_dir / self.VECTORS_FILE
+        meta_path = self.index_dir / self.METADATA_FILE
+        if not vec_path.exists() or not meta_path.exists():
+            return
+
+        self._vectors = np.load(vec_path, mmap_mode="r")
+        with meta_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                self._ids.append(row["id"])
+                self._metadata.append(row.get("metadata", {}))
+
+        if len(self._ids) != self._vectors.shape[0]:
+            raise ValueError(
+                f"Local index is inconsistent: {len(self._ids)} ids vs "
+                f"{self._vectors.shape[0]} vectors in {self.index_dir}"
+            )
+        self._pos = {vid: i for i, vid in enumerate(self._ids)}
+        self._load_codes()
+        if self.ann == "ivf":
+            self._ivf = IVFIndex.load(self.index_dir, n=len(self._ids), dims=self.dims,
+                                      newer_than=vec_path.stat().st_mtime)
+
+    @property
+    def codes_file(self) -> Path:
+        return self.index_dir / f"vectors_{self.quantization}.npy"
+
+    def _load_codes(self) -> None:
+        """Map the saved quantized matrix if it matches the vectors; otherwise it is rebuilt lazily."""
+        if self.quantization == "none" or not self.codes_file.exists():
+            return
+        if self.codes_file.stat().st_mtime < (self.index_dir / self.VECTORS_FILE).stat().st_mtime:
+            return
+        codes = np.load(self.codes_file, mmap_mode="r")
+        scales = None
+        if self.quantization == "int8":
+            scales_path = self.index_dir / self.SCALES_FILE
+            if not scales_path.exists():
+                return
+            scales = np.load(scales_path, mmap_mode="r")
+            if scales.shape[0] != codes.shape[0]:
+                return
+        if codes.shape == self._vectors.shape:
+            self._codes, self._scales = codes, scales
+
+    def build_ann(self) -> None:
+        """Train the IVF index over the current matrix (flush does this when needed)."""
+        with self._lock:
+            self._consolidate()
+            if len(self._ids):
+                self._ivf = IVFIndex.train(self._vectors, nlist=self.nlist)
+
+    def _ensure_codes(self) -> None:
+        """Quantize the matrix if the codes are stale. Caller holds the lock."""
+        if self.quantization != "none" and self._codes is None and self._vectors.size:
+            self._codes, self._scales = quantize(self._vectors, self.quantization)
+
+    @staticmethod
+    def _normalize(mat: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return mat / norms
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        """
+        Buffer vectors; they are merged into the matrix on the next query/flush.
+        Existing ids are overwritten in place.
+        """
+        with self._lock:
+            for v in vectors:
+                values = np.asarray(v["values"], dtype=np.float32)
+                if self.dims and values.shape[0] != self.dims:
+                    raise ValueError(f"Vector dims {values.shape[0]} != index dims {self.dims}")
+                self._pending[v["id"]] = (values, dict(v.get("metadata", {}) or {}))
+            if vectors:
+                self._dirty = True
+
+    def _consolidate(self) -> None:
+        if not self._pending:
+            return
+
+        new_ids = [vid for vid in self._pending if vid not in self._pos]
+        updates = [vid for vid in self._pending if vid in self._pos]
+
+        dims = next(iter(self._pending.values()))[0].shape[0]
+        if self.dims and dims != self.dims:
+            raise ValueError(f"Vector dims {dims} != index dims {self.dims}")
+
+        # Copy out of the read-only memmap before modifying
+        base = np.array(self._vectors, dtype=np.float32).reshape(-1, dims)
+        changed = [self._pos[vid] for vid in updates]
+        for vid in updates:
+            values, meta = self._pending[vid]
+            i = self._pos[vid]
+            base[i] = self._normalize(values)
+            self._metadata[i] = meta
+
+        if new_ids:
+            added = self._normalize(np.stack([self._pending[vid][0] for vid in new_ids]))
+            base = np.concatenate([base, added.astype(np.float32)], axis=0)
+            for vid in new_ids:
+                self._pos[vid] = len(self._ids)
+                self._ids.append(vid)
+                self._metadata.append(self._pending[vid][1])
+            changed.extend(range(len(self._ids) - len(new_ids), len(self._ids)))
+
+        self._vectors = np.ascontiguousarray(base, dtype=np.float32)
+        self._codes = self._scales = None
+        self._meta_index.update(self._metadata, changed)
+        if self._ivf is not None:
+            self._ivf = self._ivf.update(changed, self._vectors[changed])
+        self._pending.clear()
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._consolidate()
+            return {vid: dict(self._metadata[self._pos[vid]]) for vid in ids if vid in self._pos}
+
+    def delete(self, ids: List[str]) -> None:
+        """
+        Remove vectors by id (unknown ids are ignored).
+        """
+        with self._lock:
+            for vid in ids:
+                self._pending.pop(vid, None)
+            self._consolidate()
+
+            drop = {self._pos[vid] for vid in ids if vid in self._pos}
+            if not drop:
+                return
+
+            keep = np.ones(len(self._ids), dtype=bool)
+            keep[list(drop)] = False
+            self._vectors = np.ascontiguousarray(self._vectors[keep], dtype=np.float32)
+            self._codes = self._scales = None
+            if self._ivf is not None:
+                self._ivf = self._ivf.keep(keep)
+            self._ids = [vid for i, vid in enumerate(self._ids) if keep[i]]
+            self._metadata = [m for i, m in enumerate(self._metadata) if keep[i]]
+            self._meta_index.remove(self._metadata, keep)
+            self._pos = {vid: i for i, vid in enumerate(self._ids)}
+            self._dirty = True
+
+    def flush(self) -> None:
+        """
+        Write the matrix and metadata to index_dir atomically, then re-map.
+        """
+        with self._lock:
+            self._consolidate()
+            if not self._dirty:
+                return
+
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            vec_path = self.index_dir / self.VECTORS_FILE
+            meta_path = self.index_dir / self.METADATA_FILE
+
+            tmp_vec = vec_path.with_suffix(".npy.tmp")
+            with tmp_vec.open("wb") as f:
+                np.save(f, self._vectors)
+
+            tmp_meta = meta_path.with_suffix(".jsonl.tmp")
+            with tmp_meta.open("w", encoding="utf-8") as f:
+                for vid, meta in zip(self._ids, self._metadata):
+                    f.write(json.dumps({"id": vid, "metadata": meta}) + "\n")
+
+            os.replace(tmp_vec, vec_path)
+            os.replace(tmp_meta, meta_path)
+
+            # Codes and the IVF index go last; loading ignores files older than vectors.npy
+            self._ensure_codes()
+            if self._codes is not None:
+                for path, arr in ((self.index_dir / self.SCALES_FILE, self._scales), (self.codes_file, self._codes)):
+                    if arr is None:
+                        continue
+                    tmp = path.with_suffix(".npy.tmp")
+                    with tmp.open("wb") as f:
+                        np.save(f, arr)
+                    os.replace(tmp, path)
+
+            if self.ann == "ivf" and len(self._ids) >= self.min_ann_vectors:
+                if self._ivf is None or (not self.nlist and self._ivf.needs_retrain(len(self._ids))):
+                    self._ivf = IVFIndex.train(self._vectors, nlist=self.nlist)
+                self._ivf.save(self.index_dir)
+
+            self._vectors = np.load(vec_path, mmap_mode="r")
+            self._codes = self._scales = None
+            self._load_codes()
+            self._dirty = False
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        return self.query_many([vector], top_k=top_k, include_metadata=include_metadata, filter=filter)[0]
+
+    def query_many(
+        self,
+        vectors: List[List[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Score a block of queries with one matrix product and a row-wise
+        argpartition. Blocks are sized to keep the score matrix around 64 MB.
+        Quantized stores score the codes, then rescore top_k * rescore
+        candidates exactly (scores are then exact cosines). With an IVF
+        index each query scores only the rows of its nprobe nearest lists.
+        A filter restricts scoring to the matching rows (exactly, when they
+        are fewer than an IVF probe would visit).
+        """
+        # Snapshot under the lock; scoring itself runs lock-free so queries don't serialize
+        with self._lock:
+            self._consolidate()
+            self._ensure_codes()
+            matrix, codes, scales = self._vectors, self._codes, self._scales
+            ids, metadata = self._ids, self._metadata
+            ivf = self._ivf if len(ids) >= self.min_ann_vectors else None
+            allowed = None
+            if filter:
+                allowed = self._meta_index.mask(filter)
+
+        n = matrix.shape[0]
+        subset = None
+        if allowed is not None:
+            subset = np.flatnonzero(allowed)
+            # Few matches: score them all exactly instead of probing lists they may not be in
+            if ivf is not None and subset.size <= n * self.nprobe // ivf.nlist:
+                ivf = None
+        if n == 0 or top_k <= 0 or len(vectors) == 0 or (subset is not None and subset.size == 0):
+            return [{"matches": []} for _ in vectors]
+
+        q = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        if q.shape[1] != matrix.shape[1]:
+            raise ValueError(f"Query dims {q.shape[1]} != index dims {matrix.shape[1]}")
+        q = self._normalize(q)
+
+        n_allowed = n if subset is None else subset.size
+        k = min(top_k, n_allowed)
+        candidates = min(n_allowed, k * self.rescore) if self.rescore > 0 else k
+        # A broad filter is cheaper as a full scan with excluded rows masked out than as a row gather
+        excluded = ~allowed if subset is not None and ivf is None and subset.size * 2 > n else None
+        block = max(1, min(256, (1 << 24) // n))
+        out = []
+        for start in range(0, q.shape[0], block):
+            qb = q[start:start + block]
+            if ivf is None:
+                hits = [self._search(qb, k, candidates, matrix, codes, scales,
+                                     rows=subset if excluded is None else None, excluded=excluded)]
+            else:
+                hits = [
+                    self._search(qb[i:i + 1], k, candidates, matrix, codes, scales,
+                                 rows=rows if allowed is None else rows[allowed[rows]])
+                    for i, rows in enumerate(ivf.probe(qb, self.nprobe))
+                ]
+
+            for top, top_scores in hits:
+                for row_ids, row_scores in zip(top, top_scores):
+                    out.append({"matches": [
+                        {
+                            "id": ids[i],
+                            "score": float(score),
+                            "metadata": dict(metadata[i]) if include_metadata else {},
+                        }
+                        for i, score in zip(row_ids, row_scores)
+                    ]})
+        return out
+
+    def _search(
+        self,
+        qb: np.ndarray,
+        k: int,
+        candidates: int,
+        matrix: np.ndarray,
+        codes: Optional[np.ndarray],
+        scales: Optional[np.ndarray],
+        rows: Optional[np.ndarray] = None,
+        excluded: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Row ids and scores of the k best rows for each query in qb, among
+        rows (all if None) minus any row flagged in the excluded mask.
+        """
+        def subset(arr):
+            return arr if rows is None else arr[rows]
+
+        if codes is None:
+            scores = qb @ np.asarray(subset(matrix), dtype=np.float32).T
+        else:
+            scores = score_codes(qb, subset(codes), None if scales is None else subset(scales))
+        if excluded is not None:
+            scores[:, excluded] = -np.inf
+
+        if codes is None:
+            top, top_scores = self._top_k(scores, k)
+            return (top if rows is None else rows[top]), top_scores
+
+        top, top_scores = self._top_k(scores, max(k, candidates))
+        if rows is not None:
+            top = rows[top]
+        if self.rescore > 0:
+            # Exact cosines for the candidates only; sorted row order keeps memmap reads sequential
+            unique = np.unique(top)
+            exact = np.asarray(matrix[unique], dtype=np.float32)[np.searchsorted(unique, top)]
+            best, top_scores = self._top_k(np.einsum("bd,bcd->bc", qb, exact), k)
+            top = np.take_along_axis(top, best, axis=1)
+        return top, top_scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Column indices and values of each row's k best scores, best first."""
+        n = scores.shape[1]
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(n), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+_STORES: Dict[str, VectorStore] = {}
+
+
+def get_vector_store(backend: Optional[str] = None) -> VectorStore:
+    """
+    Return a process-wide store for the configured backend ("pinecone" or "local").
+    """
+    backend = (backend or VECTOR_BACKEND).lower()
+    if backend in _STORES:
+        return _STORES[backend]
+
+    if backend == "local":
+        store: VectorStore = LocalVectorStore(LOCAL_INDEX_DIR)
+    elif backend == "pinecone":
+        from rag.clients import get_pinecone_index
+
+        store = PineconeVectorStore(get_pinecone_index())
+    else:
+        raise ValueError(f"Unknown VECTOR_BACKEND: {backend!r} (expected 'pinecone' or 'local')")
+
+    _STORES[backend] = store
+    return store
@@ -0,0 +1,33 @@
+import tempfile
+import time
+
+from rag.bm25 import BM25Index, tokenize
+from rag.ranking import filter_by_threshold, fuse_rrf
+
+if __name__ == "__main__":
+    docs = [
+        ("a", {"source": "kb.pdf", "page": 1, "text": "Ground-glass opacity is hazy increased lung attenuation."}),
+        ("b", {"source": "kb.pdf", "page": 2, "text": "A pleural effusion is fluid in the pleural space."}),
+        ("c", {"source": "kb.pdf", "page": 3, "text": "Atelectasis is partial collapse of the lung."}),
+    ]
+    print(tokenize("What does ground-glass opacity mean?"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        BM25Index.build(docs).save(tmp)
+        index = BM25Index.load(tmp)
+
+        t0 = time.perf_counter()
+        hits = index.search("ground glass opacity", top_k=3, min_coverage=0.5)
+        print(f"{(time.perf_counter() - t0) * 1000:.3f} ms", [(h["id"], round(h["score"], 3), h["coverage"]) for h in hits])
+        assert hits and hits[0]["id"] == "a"
+
+    vector = [{"id": "c", "score": 0.8, "retriever": "vector"}, {"id": "a", "score": 0.7, "retriever": "vector"}]
+    lexical = [{"id": "a", "score": 5.1, "retriever": "lexical"}]
+    fused = fuse_rrf([vector, lexical])
+    for r in fused:
+        print(r)
+    # Fusion orders by rank_score; score stays the vector similarity (0.0 for keyword-only hits)
+    assert [r["id"] for r in fused] == ["a", "c"] and [r["score"] for r in fused] == [0.7, 0.8]
+    # min_score gates vector similarities; a keyword-only hit has none and is kept
+    kept = filter_by_threshold(fuse_rrf([vector, [{"id": "b", "score": 3.0, "retriever": "lexical"}]]), 0.75)
+    assert sorted(r["id"] for r in kept) == ["b", "c"]
@@ -0,0 +1,55 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from rag.chunk_store import ChunkStore, chunk_store_reader, get_chunk_store, update_chunk_store
+
+if __name__ == "__main__":
+    words = "pleural effusion consolidation atelectasis fracture nodule opacity ground-glass".split()
+    records = []
+    for i in range(20000):
+        meta = {"source": f"ref_{i // 400:03d}.pdf", "page": i % 400 // 8 + 1, "chunk_id": i % 8}
+        vid = hashlib.sha1(f"{meta['source']}|p{meta['page']}|c{meta['chunk_id']}".encode()).hexdigest()
+        text = " ".join(words[(i * 7 + j) % len(words)] for j in range(120)) + f" (chunk {i})"
+        records.append((vid, text, meta))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        store = ChunkStore.write(records, tmp)
+        print(f"Wrote {len(store)} chunks in {time.perf_counter() - t0:.2f}s: "
+              f"{store.stored_bytes / 1e6:.2f} MB stored, {store.raw_bytes / 1e6:.2f} MB raw ({store.codec})")
+
+        wanted = [records[i][0] for i in (5, 6, 7, 12000, 19999)] + ["0" * 40, "not-an-id"]
+        t0 = time.perf_counter()
+        got = store.get_many(wanted)
+        print(f"get_many({len(wanted)}): {1000 * (time.perf_counter() - t0):.2f} ms")
+        print("Texts match:", all(g["text"] == records[i][1] for g, i in zip(got, (5, 6, 7, 12000, 19999))))
+        print("Unknown ids:", got[-2:])
+
+        hydrated = store.hydrate([{"id": records[42][0], "score": 0.8, "metadata": {}}, {"id": "x", "text": "kept"}])
+        print("Hydrated:", hydrated[0]["metadata"], hydrated[0]["text"][-12:], "| untouched:", hydrated[1]["text"])
+
+        # Incremental rewrite: drop ref_000.pdf, keep the rest, stream in a new file's chunks
+        keep = {vid for vid, _, meta in records if meta["source"] != "ref_000.pdf"}
+        writer = update_chunk_store(keep, tmp)
+        writer.add("a" * 40, "new chunk text", {"source": "new.pdf", "page": 1, "chunk_id": 0})
+        print("Old store still readable before commit:", store.get(records[0][0]) is not None)
+        store.close()
+        store = writer.commit()
+        print("After update:", len(store), "chunks;", records[0][0] in store, records[400][0] in store,
+              store.get("a" * 40)["text"])
+        print("Full scan matches:", sum(1 for _ in store.items()) == len(store))
+        store.close()
+
+        # A rebuild replaces the process-wide store; the old one closes once its last reader exits
+        meta_file = os.path.join(tmp, ChunkStore.META_FILE)
+        with chunk_store_reader(tmp) as reading:
+            ChunkStore.write(records[:10], tmp).close()
+            os.utime(meta_file, (time.time() + 5, time.time() + 5))
+            fresh = get_chunk_store(tmp)
+            print("Reader still served after reload:", fresh is not reading and reading.get(records[400][0]) is not None)
+        print("Old store closed after reader exit:", reading._mmap.closed, "| new store open:", not fresh._mmap.closed)
+        ChunkStore.write(records[:5], tmp).close()
+        os.utime(meta_file, (time.time() + 10, time.time() + 10))
+        print("Replaced without readers closes at once:", get_chunk_store(tmp) is not fresh and fresh._mmap.closed)
@@ -3,7 +3,7 @@ from rag.chunking import chunk_documents
 
 if __name__ == "__main__":
     docs = load_knowledge_base("data/knowledge_base")
-    chunks = chunk_documents(docs, chunk_size=1000, overlap=150)
+    chunks = chunk_documents(docs, target_tokens=256, overlap_tokens=32)
 
     print(f"Pages loaded: {len(docs)}")
     print(f"Chunks created: {len(chunks)}")
@@ -12,3 +12,10 @@ if __name__ == "__main__":
         print("\n--- CHUNK SAMPLE ---")
         print("META:", c.metadata)
         print("TEXT:", c.text[:300], "...")
+
+    # Offsets point back into the page text exactly
+    pages = {(d.metadata["source"], d.metadata["page"]): d.text for d in docs}
+    for c in chunks:
+        m = c.metadata
+        assert pages[(m["source"], m["page"])][m["start_char"]:m["end_char"]] == c.text
+    print("\nOffsets OK")
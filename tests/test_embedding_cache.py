@@ -0,0 +1,32 @@
+import tempfile
+from pathlib import Path
+
+from rag.embedding_cache import EmbeddingCache
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(Path(tmp) / "cache.sqlite", max_entries=3, touch_interval_sec=0)
+
+        texts = ["atelectasis", "pleural effusion", "pneumothorax"]
+        cache.put_many("test-model", texts, [[float(i)] * 4 for i in range(3)])
+
+        print(cache.get_many("test-model", texts + ["unseen text"]))
+        print(cache.get_many("other-model", texts))  # different model -> all misses
+
+        # Touch the first entry, then overflow: "pleural effusion" is the LRU victim
+        cache.get_many("test-model", ["atelectasis"])
+        cache.put_many("test-model", ["consolidation"], [[9.0] * 4])
+        print(sorted(cache.get_many("test-model", texts + ["consolidation"]).keys()))
+
+        print(cache.stats())
+        cache.close()
+
+        # Default touch interval: re-reading fresh entries does not write to SQLite
+        cache = EmbeddingCache(Path(tmp) / "cache.sqlite")
+        cache.put_many("test-model", ["atelectasis"], [[1.0] * 4])
+        writes = cache._conn.total_changes
+        for _ in range(100):
+            cache.get_many("test-model", ["atelectasis", "consolidation"])
+        print("Writes from 100 reads:", cache._conn.total_changes - writes)
+        assert cache._conn.total_changes == writes
+        cache.close()
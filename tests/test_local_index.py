@@ -0,0 +1,31 @@
+import tempfile
+import time
+
+import numpy as np
+
+from rag.vector_store import LocalVectorStore
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    n, dims = 20000, 1536
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalVectorStore(tmp)
+        vecs = rng.standard_normal((n, dims)).astype(np.float32)
+        store.upsert([
+            {"id": f"v{i}", "values": vecs[i], "metadata": {"source": "synthetic", "page": i}}
+            for i in range(n)
+        ])
+        store.flush()
+
+        # Reload from disk (memory-mapped) and query with a known vector
+        store = LocalVectorStore(tmp)
+        print(f"Vectors loaded: {len(store)} x {store.dims}")
+
+        t0 = time.perf_counter()
+        res = store.query(vecs[42], top_k=5)
+        t1 = time.perf_counter()
+
+        print(f"Query time: {(t1 - t0) * 1000:.2f} ms")
+        for m in res["matches"]:
+            print(m["id"], round(m["score"], 4), m["metadata"])
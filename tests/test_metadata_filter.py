@@ -0,0 +1,75 @@
+import tempfile
+import time
+
+import numpy as np
+
+from rag.bm25 import BM25Index
+from rag.metadata_filter import MetadataIndex, matches, validate_filter
+from rag.vector_store import LocalVectorStore
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    n, dims = 20000, 256
+    doc_types = ["chest_imaging", "msk_imaging", "neuro_imaging", "radiology_reference"]
+    metadata = [
+        {"source": f"ref_{i // 400:03d}.pdf", "page": i % 400 // 8 + 1, "doc_type": doc_types[i // 400 % 4],
+         "text": f"chunk {i} pleural effusion" if i % 7 == 0 else f"chunk {i} fracture"}
+        for i in range(n)
+    ]
+
+    filters = [
+        {"source": "ref_003.pdf"},
+        {"doc_type": {"$in": ["chest_imaging", "neuro_imaging"]}, "page": {"$lte": 10}},
+        {"$or": [{"source": "ref_001.pdf"}, {"page": {"$gt": 48}}]},
+        {"doc_type": {"$ne": "msk_imaging"}, "source": {"$nin": ["ref_000.pdf"]}},
+        {"page": {"$gte": 3, "$lt": 5}},
+    ]
+    index = MetadataIndex(metadata)
+    for flt in filters:
+        validate_filter(flt)
+        expected = np.array([matches(m, flt) for m in metadata])
+        print(f"{int(expected.sum()):>6} rows match, index agrees: {np.array_equal(index.mask(flt), expected)}")
+
+    try:
+        validate_filter({"page": {"$regex": "x"}})
+    except ValueError as e:
+        print("Rejected:", e)
+
+    vecs = rng.standard_normal((n, dims)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalVectorStore(tmp)
+        store.upsert([{"id": f"v{i}", "values": vecs[i], "metadata": metadata[i]} for i in range(n)])
+        store.flush()
+
+        flt = {"source": "ref_003.pdf"}
+        t0 = time.perf_counter()
+        store.query(vecs[0], top_k=10)
+        t1 = time.perf_counter()
+        store.query(vecs[0], top_k=10, filter=flt)
+        t2 = time.perf_counter()
+        res = store.query(vecs[1300], top_k=10, filter=flt)
+        t3 = time.perf_counter()
+        print(f"Unfiltered {1000 * (t1 - t0):.2f} ms, filtered (first) {1000 * (t2 - t1):.2f} ms, "
+              f"filtered (cached mask) {1000 * (t3 - t2):.2f} ms")
+        print("Filtered hits:", len(res["matches"]), "all match:",
+              all(m["metadata"]["source"] == "ref_003.pdf" for m in res["matches"]),
+              "top:", res["matches"][0]["id"])
+
+        # Writes patch the source/doc_type postings instead of discarding them
+        store.upsert([{"id": "v5", "values": vecs[5], "metadata": dict(metadata[5], source="ref_003.pdf")},
+                      {"id": "new", "values": vecs[6], "metadata": dict(metadata[6], source="ref_003.pdf")}])
+        store.delete([f"v{i}" for i in range(1200, 1210)])
+        rows = store._meta_index.rows(flt)
+        agree = all(np.array_equal(store._meta_index.mask(f), np.array([matches(m, f) for m in store._metadata]))
+                    for f in filters)
+        print("After writes:", len(rows), "rows, index agrees:", agree)
+        assert agree and len(rows) == 400 - 10 + 2
+
+        ivf = LocalVectorStore(tmp, ann="ivf", min_ann_vectors=0)
+        ivf.build_ann()
+        res = ivf.query(vecs[1300], top_k=10, filter={"doc_type": "msk_imaging"})
+        print("IVF filtered all match:", all(m["metadata"]["doc_type"] == "msk_imaging" for m in res["matches"]))
+
+    bm25 = BM25Index.build((f"v{i}", m) for i, m in enumerate(metadata))
+    hits = bm25.search("pleural effusion", top_k=5, filter={"doc_type": "neuro_imaging"})
+    print("BM25 filtered:", [(h["id"], h["metadata"]["doc_type"]) for h in hits[:3]])
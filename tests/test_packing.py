@@ -0,0 +1,49 @@
+from rag.packing import knapsack, pack_by_tokens
+from rag.tokens import count_tokens
+from app.context import pack_prompt, prompt_tokens
+from app.prompts import SYSTEM_BASE, explain_prompt
+
+
+if __name__ == "__main__":
+    # One big high-score item loses to two smaller ones with more total value
+    print(knapsack([0.9, 0.6, 0.6], [10, 5, 5], 10))  # expect [1, 2]
+
+    results = [
+        {"id": f"r{i}", "text": ("Pleural effusion is fluid around the lung. " * (30 if i == 0 else 4)),
+         "score": 0.9 - i * 0.05, "metadata": {"source": f"doc{i}.pdf", "page": i}}
+        for i in range(6)
+    ]
+    packed = pack_by_tokens(results, max_context_tokens=300, per_chunk_token_cap=120)
+    print([r["id"] for r in packed], sum(count_tokens(r["text"]) for r in packed))
+
+    report = "FINDINGS: Small left pleural effusion. IMPRESSION: Small effusion."
+    # The prompt template alone is ~450 tokens; each budget leaves room for some evidence
+    for budget in (3000, 800, 600):
+        user_prompt, _, citations, _ = pack_prompt(
+            lambda ctx: explain_prompt("normal", report, ctx), results, budget_tokens=budget
+        )
+        used = prompt_tokens(SYSTEM_BASE, [], user_prompt)
+        print(f"budget={budget} used={used} chunks={len(citations)}")
+        assert citations and used <= budget
+
+    # Long chat history: the oldest turns go before any evidence does
+    history = []
+    for i in range(6):
+        history += [{"role": "user", "content": f"Question {i} about the effusion? " * 15},
+                    {"role": "assistant", "content": f"Answer {i}: it is small. " * 30}]
+    no_history = pack_prompt(lambda ctx: explain_prompt("normal", report, ctx), results, budget_tokens=1500)
+    packed = pack_prompt(lambda ctx: explain_prompt("normal", report, ctx), results,
+                         history_messages=history, budget_tokens=1500)
+    used = prompt_tokens(SYSTEM_BASE, packed.history_messages, packed.user_prompt)
+    print(f"history {len(history)} -> {len(packed.history_messages)} messages, "
+          f"chunks={len(packed.citations)} (without history {len(no_history.citations)}), used={used}")
+    assert len(packed.citations) == len(no_history.citations) and used <= 1500
+    assert packed.history_messages == history[len(history) - len(packed.history_messages):]
+    assert not packed.history_messages or packed.history_messages[0]["role"] == "user"
+
+    # Evidence floor: when no whole chunk fits, MIN_EVIDENCE_CHUNKS shortened ones are sent instead
+    long_chunks = [dict(r, text=results[0]["text"]) for r in results]
+    floor = pack_prompt(lambda ctx: explain_prompt("normal", report, ctx), long_chunks, budget_tokens=650)
+    used = prompt_tokens(SYSTEM_BASE, [], floor.user_prompt)
+    print(f"long chunks: chunks={len(floor.citations)} used={used}")
+    assert len(floor.citations) >= 2 and used <= 650
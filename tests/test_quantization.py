@@ -0,0 +1,59 @@
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from rag.embedding_cache import EmbeddingCache
+from rag.quantization import dequantize, quantize
+from rag.vector_store import LocalVectorStore
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    n, dims, k = 20000, 1536, 10
+    vecs = rng.standard_normal((n, dims)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+
+    for mode in ("float16", "int8"):
+        codes, scales = quantize(vecs, mode)
+        err = np.abs(dequantize(codes, scales) - vecs).max()
+        print(f"{mode}: {codes.nbytes / vecs.nbytes:.2f}x float32 size, max abs error {err:.5f}")
+
+    # Queries near stored vectors, so the true neighbours are well separated
+    queries = vecs[:50] + 0.5 * rng.standard_normal((50, dims)).astype(np.float32) / np.sqrt(dims)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalVectorStore(tmp, quantization="int8")
+        store.upsert([{"id": f"v{i}", "values": vecs[i], "metadata": {"page": i}} for i in range(n)])
+        store.flush()
+        print("Files:", sorted(p.name for p in Path(tmp).iterdir()))
+
+        exact = LocalVectorStore(tmp, quantization="none")
+        truth = [{m["id"] for m in r["matches"]} for r in exact.query_many(queries, top_k=k)]
+
+        for mode in ("float16", "int8"):
+            for rescore in (0, 4):
+                store = LocalVectorStore(tmp, quantization=mode, rescore=rescore)
+                t0 = time.perf_counter()
+                res = store.query_many(queries, top_k=k)
+                ms = (time.perf_counter() - t0) * 1000
+                recall = np.mean([len({m["id"] for m in r["matches"]} & t) / k for r, t in zip(res, truth)])
+                print(f"{mode} rescore={rescore}: recall@{k} {recall:.3f}, {ms:.1f} ms for {len(queries)} queries")
+
+        # Exact rescoring returns the float32 cosine for the top hit
+        store = LocalVectorStore(tmp, quantization="int8")
+        top = store.query(vecs[42], top_k=1)["matches"][0]
+        print("Self match:", top["id"], round(top["score"], 4))
+
+        # Updates invalidate the codes; the next query requantizes
+        store.upsert([{"id": "v42", "values": -vecs[42], "metadata": {"page": 42}}])
+        print("After update:", store.query(vecs[42], top_k=1)["matches"][0]["id"] != "v42")
+
+        cache = EmbeddingCache(Path(tmp) / "cache.sqlite", quantization="int8")
+        cache.put_many("test-model", ["atelectasis"], [vecs[0].tolist()])
+        cache.quantization = "none"
+        cache.put_many("test-model", ["effusion"], [vecs[1].tolist()])
+        hits = cache.get_many("test-model", ["atelectasis", "effusion"])
+        print("Cache int8 error:", round(float(np.abs(np.array(hits[0]) - vecs[0]).max()), 5),
+              "float32 exact:", bool(np.array_equal(np.array(hits[1], dtype=np.float32), vecs[1])))
+        cache.close()
@@ -0,0 +1,26 @@
+from rag.query_planner import extract_terms, plan_queries, split_sections
+
+if __name__ == "__main__":
+    report = (
+        "EXAM: Chest X-ray PA and lateral. CLINICAL HISTORY: Cough and fever. "
+        "FINDINGS: Patchy ground glass opacities in the right lower lobe. Small left pleural effusion. "
+        "No pneumothorax. Heart size is normal. "
+        "IMPRESSION: Right lower lobe consolidation, likely pneumonia."
+    )
+
+    print("Sections:", list(split_sections(report)))
+    positive, negated = extract_terms(report)
+    print("Positive:", positive)
+    print("Negated:", negated)
+    assert positive[0] == "consolidation" and "pneumothorax" in negated
+
+    plan = plan_queries(report)
+    for q in plan.queries:
+        print("-", q)
+
+    # Negated findings get one query; shorter terms inside longer ones are dropped
+    report = ("FINDINGS: 8 mm pulmonary nodule in the right upper lobe; the nodule is solid. "
+              "No pneumothorax or effusion. No consolidation. IMPRESSION: Pulmonary nodule.")
+    plan = plan_queries(report)
+    print("Terms:", plan.terms, "negated:", plan.negated)
+    assert "nodule" not in plan.terms and "pulmonary nodule" in plan.terms and len(plan.negated) == 1
@@ -0,0 +1,23 @@
+from rag.rerank import FeatureReranker, rerank, rerank_cache_stats
+
+if __name__ == "__main__":
+    query = "What is a pleural effusion?"
+    results = [
+        {"id": "a", "score": 0.82, "text": "Atelectasis is partial collapse of the lung.", "metadata": {}},
+        {"id": "b", "score": 0.80, "text": "A pleural effusion is fluid in the pleural space.", "metadata": {}},
+        {"id": "c", "score": 0.74, "text": "The heart size is within normal limits.", "metadata": {}},
+        {"id": "d", "score": 0.71, "text": "Small effusions blunt the costophrenic angle.", "metadata": {}},
+    ]
+
+    for r in rerank(query, results, reranker=FeatureReranker()):
+        print(r["id"], round(r["rank_score"], 3), "retrieval", r["score"], "rerank", round(r["rerank_score"], 3))
+
+    # Second call is served from the per-(query, chunk id) score cache
+    rerank(query, results, reranker=FeatureReranker())
+    print(rerank_cache_stats())
+
+    # Zero budget: only the first batch is scored; the rest follow it unscored, in retrieval order
+    out = rerank("heart size", results, reranker=FeatureReranker(), budget_ms=0, batch_size=2)
+    print([(r["id"], r["rerank_score"] is not None) for r in out])
+    assert len(out) == len(results) and [r["id"] for r in out[2:]] == ["c", "d"]
+    assert all(r["score"] == r["retrieval_score"] for r in out)
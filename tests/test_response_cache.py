@@ -0,0 +1,55 @@
+import tempfile
+from pathlib import Path
+
+from app.prompts import qa_prompt
+from app.response_cache import ResponseCache
+
+
+def toy_embed(texts):
+    # Bag-of-letters vectors: enough to make near-duplicate prompts similar
+    out = []
+    for t in texts:
+        v = [0.0] * 26
+        for ch in t.lower():
+            if "a" <= ch <= "z":
+                v[ord(ch) - 97] += 1.0
+        out.append(v)
+    return out
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(Path(tmp) / "llm.sqlite", max_entries=2,
+                              similarity_threshold=0.98, embed_fn=toy_embed)
+
+        args = ("gpt-4o-mini", 0.2, "system", [])
+        q = "Explain the impression in simple terms."
+        cache.put(*args, q, "cached answer", question=q)
+
+        print(cache.get(*args, q))                                     # exact hit
+        near = "Explain the impression in simple terms!!"
+        print(cache.get(*args, near, question=near))                   # near-duplicate hit
+        print(cache.get(*args, "Is anything urgent?", question="Is anything urgent?"))  # miss
+        print(cache.get("gpt-4o", 0.2, "system", [], "Explain the impression in simple terms."))  # other model
+
+        print(cache.stats())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(Path(tmp) / "llm.sqlite", similarity_threshold=0.98, embed_fn=toy_embed)
+        args = ("gpt-4o-mini", 0.2, "system", [])
+        evidence = "[1] chest_xray.pdf p.3: A pulmonary nodule is a small round opacity."
+        question = "How big is the nodule?"
+        left_6mm = "FINDINGS: 6 mm nodule in the left upper lobe. IMPRESSION: Follow-up CT in 12 months."
+        right_16mm = "FINDINGS: 16 mm nodule in the right upper lobe. IMPRESSION: Follow-up CT in 12 months."
+
+        prompt = qa_prompt(question, left_6mm, evidence)
+        cache.put(*args, prompt, "The nodule is 6 mm, in the left upper lobe.", question=question)
+
+        # Same report and evidence, near-duplicate question: reused
+        similar = "How big is the nodule??"
+        print("Near-duplicate question:", cache.get(*args, qa_prompt(similar, left_6mm, evidence), question=similar))
+        # Near-identical report (laterality and size differ): never reused, however similar the prompts are
+        other = qa_prompt(question, right_16mm, evidence)
+        print("Other report:", cache.get(*args, other, question=question))
+        # Without a question only the exact key is used
+        print("No question given:", cache.get(*args, qa_prompt(similar, left_6mm, evidence)))
@@ -13,3 +13,10 @@ if __name__ == "__main__":
         print("Source:", r["metadata"].get("source"))
         print("Page:", r["metadata"].get("page"))
         print("Text:", r["text"][:250], "...\n")
+
+    # Batched: one embeddings request for all questions, results in order
+    from rag.retriever import retrieve_many
+
+    questions = [query, "Explain the term 'atelectasis' in plain English.", "What is a pleural effusion?"]
+    for q, res in zip(questions, retrieve_many(questions, top_k=5)):
+        print(f"{len(res)} chunks | top score {max((r['score'] for r in res), default=0):.3f} | {q}")
@@ -0,0 +1,36 @@
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from rag.tracing import JsonlExporter, span, trace
+from rag.ranking import rank_and_filter
+from rag.citations import build_context_with_citations
+
+
+if __name__ == "__main__":
+    results = [
+        {"id": f"r{i}", "text": "Atelectasis is partial lung collapse. " * 10, "score": 0.9 - i * 0.05,
+         "metadata": {"source": f"doc{i % 3}.pdf", "page": i}}
+        for i in range(8)
+    ]
+
+    with trace("smoke") as tr:
+        with span("embedding", texts=1):
+            time.sleep(0.01)
+        ranked = rank_and_filter(results)
+        build_context_with_citations(ranked)
+
+    print(tr.breakdown())
+    print(tr.attr("ranking", "kept"), tr.attr("context", "context_tokens"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "traces.jsonl"
+        JsonlExporter(path).export(tr)
+        record = json.loads(path.read_text(encoding="utf-8"))
+        print([s["name"] for s in record["spans"]])
+
+    # Outside a trace spans are not recorded
+    with span("embedding") as sp:
+        pass
+    print("untraced span ok:", sp.end is not None)